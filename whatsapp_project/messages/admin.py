@@ -1,9 +1,28 @@
-# from django.contrib import admin
-# from .models import MessageLog
+from django.contrib import admin
+from .models import MessageLog
 
-# @admin.register(MessageLog)
-# class MessageLogAdmin(admin.ModelAdmin):
-#     list_display = ('created_at', 'is_relevant', 'forwarded_to_telegram', 'source')
-#     list_filter = ('is_relevant', 'forwarded_to_telegram', 'source', 'created_at')
-#     search_fields = ('raw_text',)
+# Reviewed labels are what `python manage.py train_local_classifier` learns from
+@admin.register(MessageLog)
+class MessageLogAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'short_text', 'is_relevant', 'classification_rule', 'label', 'forwarded_to_telegram')
+    list_editable = ('label',)
+    list_filter = ('label', 'is_relevant', 'classification_rule', 'forwarded_to_telegram', 'created_at')
+    search_fields = ('raw_text',)
+    actions = ('label_relevant', 'label_irrelevant', 'clear_label')
+    list_per_page = 50
 
+    @admin.display(description='Message')
+    def short_text(self, obj):
+        return obj.raw_text[:80]
+
+    @admin.action(description='Label selected messages as relevant')
+    def label_relevant(self, request, queryset):
+        self.message_user(request, f"{queryset.update(label=True)} messages labelled relevant")
+
+    @admin.action(description='Label selected messages as not relevant')
+    def label_irrelevant(self, request, queryset):
+        self.message_user(request, f"{queryset.update(label=False)} messages labelled not relevant")
+
+    @admin.action(description='Clear the label of selected messages')
+    def clear_label(self, request, queryset):
+        self.message_user(request, f"{queryset.update(label=None)} labels cleared")
@@ -0,0 +1,33 @@
+"""
+Broker-less work claiming on top of the database, shared by the background
+commands. Works on Postgres in production and SQLite locally.
+"""
+from django.db import connection, transaction
+
+
+def claim_batch(queryset, batch_size: int, **updates) -> list:
+    """
+    Take up to batch_size rows of queryset for this worker by applying updates
+    (e.g. a status change) and return their primary keys.
+
+    Postgres locks the rows with SELECT ... FOR UPDATE SKIP LOCKED so concurrent
+    workers pick disjoint batches. SQLite has no row locks, so rows are claimed
+    one at a time with an UPDATE that re-checks the queryset's filter; a row
+    another worker took first simply updates nothing.
+    """
+    model = queryset.model
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            pks = list(
+                queryset.select_for_update(skip_locked=True).values_list('pk', flat=True)[:batch_size]
+            )
+            if pks:
+                model.objects.filter(pk__in=pks).update(**updates)
+        return pks
+
+    claimed = []
+    for pk in list(queryset.values_list('pk', flat=True)[:batch_size]):
+        if queryset.filter(pk=pk).update(**updates):
+            claimed.append(pk)
+    return claimed
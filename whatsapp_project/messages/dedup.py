@@ -0,0 +1,186 @@
+"""
+Near-duplicate detection for forwarded opportunities.
+
+The same requirement is reposted with a different greeting, emoji or footer, so
+exact hashes miss it. Messages are reduced to MinHash signatures over word
+shingles of the preprocessed text and indexed with LSH banding, which keeps a
+lookup to a handful of dict probes however many messages are in the window.
+"""
+import hashlib
+import logging
+import struct
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from decouple import config
+
+from .filter import preprocess_message
+
+logger = logging.getLogger(__name__)
+
+DEDUP_ENABLED = config('DEDUP_ENABLED', default=True, cast=bool)
+DEDUP_WINDOW_SECONDS = config('DEDUP_WINDOW_SECONDS', default=24 * 60 * 60, cast=int)
+DEDUP_MAX_ENTRIES = config('DEDUP_MAX_ENTRIES', default=50000, cast=int)
+DEDUP_THRESHOLD = config('DEDUP_THRESHOLD', default=0.6, cast=float)
+
+# 64 hash functions in 16 bands of 4 rows: pairs above ~0.5 Jaccard similarity
+# almost always share a band, pairs below ~0.3 almost never do
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+
+# One SHAKE-128 digest per shingle yields all 64 independent 32-bit hash values,
+# which is much cheaper than 64 modular permutations in Python
+_SIGNATURE_STRUCT = struct.Struct(f'<{NUM_PERMUTATIONS}I')
+
+
+def shingles(message: str) -> set:
+    """Word bigrams of the normalized message (single words for one-word messages)"""
+    words = preprocess_message(message).lower().split()
+    if len(words) < 2:
+        return set(words)
+    return {f"{first} {second}" for first, second in zip(words, words[1:])}
+
+
+def minhash_signature(message: str) -> tuple:
+    """MinHash signature of the message; an empty message has an empty signature"""
+    rows = [
+        _SIGNATURE_STRUCT.unpack(hashlib.shake_128(shingle.encode('utf-8')).digest(_SIGNATURE_STRUCT.size))
+        for shingle in shingles(message)
+    ]
+    if not rows:
+        return ()
+    return tuple(map(min, zip(*rows)))
+
+
+def signature_to_bytes(signature: tuple) -> bytes:
+    return _SIGNATURE_STRUCT.pack(*signature) if signature else b''
+
+
+def signature_from_bytes(data: bytes) -> tuple:
+    return _SIGNATURE_STRUCT.unpack(bytes(data)) if data else ()
+
+
+def estimated_similarity(first: tuple, second: tuple) -> float:
+    """Fraction of agreeing MinHash slots, an estimate of Jaccard similarity"""
+    if not first or not second:
+        return 0.0
+    return sum(1 for a, b in zip(first, second) if a == b) / NUM_PERMUTATIONS
+
+
+class NearDuplicateIndex:
+    """Sliding-window MinHash-LSH index of forwarded messages"""
+
+    def __init__(self, window_seconds: int = DEDUP_WINDOW_SECONDS,
+                 max_entries: int = DEDUP_MAX_ENTRIES, threshold: float = DEDUP_THRESHOLD):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (signature, added_at)
+        self._order = deque()  # (added_at, key), oldest first
+        self._buckets = [{} for _ in range(BANDS)]  # band -> {band values: set(keys)}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _bands(signature: tuple):
+        for band in range(BANDS):
+            start = band * ROWS_PER_BAND
+            yield band, signature[start:start + ROWS_PER_BAND]
+
+    def _expire(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._order and (self._order[0][0] < cutoff or len(self._order) > self.max_entries):
+            _, key = self._order.popleft()
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                continue
+            for band, values in self._bands(entry[0]):
+                bucket = self._buckets[band].get(values)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._buckets[band][values]
+
+    def add(self, key, signature: tuple, added_at: float = None):
+        """Index a forwarded message under key (normally its MessageLog id)"""
+        if not signature:
+            return
+        added_at = time.time() if added_at is None else added_at
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (signature, added_at)
+            self._order.append((added_at, key))
+            for band, values in self._bands(signature):
+                self._buckets[band].setdefault(values, set()).add(key)
+            self._expire(time.time())
+
+    def find(self, signature: tuple):
+        """Key of the most similar indexed message above the threshold, or None"""
+        if not signature:
+            return None
+        with self._lock:
+            self._expire(time.time())
+            candidates = set()
+            for band, values in self._bands(signature):
+                candidates.update(self._buckets[band].get(values, ()))
+
+            best_key = None
+            best_similarity = self.threshold
+            for key in candidates:
+                similarity = estimated_similarity(signature, self._entries[key][0])
+                if similarity >= best_similarity:
+                    best_key, best_similarity = key, similarity
+
+        return best_key
+
+
+# One index per worker, warmed from recently forwarded messages on first use
+_near_duplicate_index = None
+_near_duplicate_index_lock = threading.Lock()
+
+
+def get_near_duplicate_index():
+    """Get the worker's near-duplicate index, or None when dedup is disabled"""
+    global _near_duplicate_index
+    if not DEDUP_ENABLED:
+        return None
+    if _near_duplicate_index is None:
+        with _near_duplicate_index_lock:
+            if _near_duplicate_index is None:
+                index = NearDuplicateIndex()
+                _warm_index(index)
+                _near_duplicate_index = index
+    return _near_duplicate_index
+
+
+def _warm_index(index: NearDuplicateIndex):
+    """Load messages forwarded inside the window so restarts don't re-forward them"""
+    try:
+        from django.db.models import Q
+        from django.utils import timezone
+        from .models import MessageLog, TelegramOutbox
+
+        since = timezone.now() - timedelta(seconds=index.window_seconds)
+        # Messages still waiting in the Telegram outbox count as forwarded
+        queued = Q(telegram_outbox__status__in=[TelegramOutbox.PENDING, TelegramOutbox.SENDING])
+        recent = (
+            MessageLog.objects
+            .filter(Q(forwarded_to_telegram=True) | queued, created_at__gte=since)
+            .distinct()
+            .order_by('-created_at')
+            .values_list('id', 'raw_text', 'minhash', 'created_at')[:index.max_entries]
+        )
+        rows = list(recent)
+        for message_id, raw_text, minhash, created_at in reversed(rows):
+            # Rows forwarded before signatures were stored are hashed on the fly
+            signature = signature_from_bytes(minhash) if minhash else minhash_signature(raw_text)
+            index.add(message_id, signature, created_at.timestamp())
+        logger.info(f"Near-duplicate index warmed with {len(rows)} forwarded messages")
+    except Exception as e:
+        logger.warning(f"Could not warm near-duplicate index: {e}")
@@ -0,0 +1,166 @@
+"""
+Digest mode: coalesce forwards into fewer Telegram messages.
+
+With TELEGRAM_DIGEST enabled, queued outbox rows are buffered per chat and sent
+together once DIGEST_MAX_ITEMS have piled up or the oldest has waited
+DIGEST_WINDOW_SECONDS. Buffered rows stay in the outbox, so anything a dying
+process did not flush is still delivered by dispatch_outbox.
+"""
+import atexit
+import logging
+import threading
+
+from decouple import config
+
+from .metrics import metric_key, register_collector
+from .telegram import OPPORTUNITY_HEADER
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_DIGEST = config('TELEGRAM_DIGEST', default=False, cast=bool)
+DIGEST_WINDOW_SECONDS = config('DIGEST_WINDOW_SECONDS', default=60.0, cast=float)
+DIGEST_MAX_ITEMS = config('DIGEST_MAX_ITEMS', default=10, cast=int)
+
+# Telegram rejects sendMessage text longer than this
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+DIGEST_SEPARATOR = "\n\n━━━━━━━━━━\n\n"
+
+
+def digest_item(text: str) -> str:
+    """A queued forward without its own header, ready to be listed in a digest"""
+    return text.removeprefix(OPPORTUNITY_HEADER).strip("\n")
+
+
+def digest_header(count: int) -> str:
+    return f"🚀 {count} NEW OPPORTUNITIES\n\n" if count > 1 else OPPORTUNITY_HEADER + "\n"
+
+
+def pack_digest(entries: list, limit: int = TELEGRAM_MAX_MESSAGE_LENGTH) -> list:
+    """
+    Split outbox entries into Telegram messages of at most limit characters.
+    Returns [(texts, entries)]: usually one text carrying several entries, or
+    several texts carrying one entry too long for a single message.
+    """
+    groups = []
+    current_items, current_entries = [], []
+
+    def close_current():
+        if current_entries:
+            text = digest_header(len(current_entries)) + DIGEST_SEPARATOR.join(current_items)
+            groups.append(([text], list(current_entries)))
+            current_items.clear()
+            current_entries.clear()
+
+    for entry in entries:
+        item = digest_item(entry.text)
+        candidate = current_items + [item]
+        length = len(digest_header(len(candidate))) + len(DIGEST_SEPARATOR.join(candidate))
+        if length <= limit:
+            current_items.append(item)
+            current_entries.append(entry)
+            continue
+
+        close_current()
+        if len(digest_header(1)) + len(item) <= limit:
+            current_items.append(item)
+            current_entries.append(entry)
+        else:
+            # A single forward over the limit goes out in consecutive parts
+            body_limit = limit - len(digest_header(1))
+            texts = [
+                digest_header(1) + item[start:start + body_limit]
+                for start in range(0, len(item), body_limit)
+            ]
+            groups.append((texts, [entry]))
+
+    close_current()
+    return groups
+
+
+class DigestBuffer:
+    """
+    Per-chat buffer of queued outbox row ids, handed to flush_callback(pks)
+    when a chat reaches max_items, after window_seconds, or at shutdown
+    """
+
+    def __init__(self, flush_callback, window_seconds: float = DIGEST_WINDOW_SECONDS,
+                 max_items: int = DIGEST_MAX_ITEMS):
+        self.flush_callback = flush_callback
+        self.window_seconds = window_seconds
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._pending = {}  # chat_id -> [outbox pks]
+        self._timers = {}  # chat_id -> threading.Timer
+        self.flushes = 0
+
+    def add(self, chat_id, pk: int):
+        with self._lock:
+            pks = self._pending.setdefault(chat_id, [])
+            pks.append(pk)
+            full = len(pks) >= self.max_items
+            if not full and chat_id not in self._timers:
+                timer = threading.Timer(self.window_seconds, self.flush, args=(chat_id,))
+                timer.daemon = True
+                self._timers[chat_id] = timer
+                timer.start()
+        if full:
+            self.flush(chat_id)
+
+    def flush(self, chat_id):
+        with self._lock:
+            pks = self._pending.pop(chat_id, [])
+            timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        if not pks:
+            return
+        self.flushes += 1
+        try:
+            self.flush_callback(pks)
+        except Exception as e:
+            # The rows are still queued in the outbox for dispatch_outbox
+            logger.error(f"Digest flush for chat {chat_id} failed: {e}")
+
+    def flush_all(self):
+        with self._lock:
+            chat_ids = list(self._pending)
+        for chat_id in chat_ids:
+            self.flush(chat_id)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "buffered": sum(len(pks) for pks in self._pending.values()),
+                "chats": len(self._pending),
+                "flushes": self.flushes,
+                "window_seconds": self.window_seconds,
+                "max_items": self.max_items,
+            }
+
+
+_digest_buffer = None
+_digest_buffer_lock = threading.Lock()
+
+
+def get_digest_buffer(flush_callback):
+    """The worker's digest buffer, flushed at interpreter shutdown"""
+    global _digest_buffer
+    if _digest_buffer is None:
+        with _digest_buffer_lock:
+            if _digest_buffer is None:
+                _digest_buffer = DigestBuffer(flush_callback)
+                atexit.register(_digest_buffer.flush_all)
+    return _digest_buffer
+
+
+def _metrics_collector() -> dict:
+    if _digest_buffer is None:
+        return {}
+    stats = _digest_buffer.snapshot()
+    return {
+        "counters": {metric_key('digest_flushes_total'): stats['flushes']},
+        "gauges": {metric_key('digest_buffered_rows'): stats['buffered']},
+    }
+
+
+register_collector(_metrics_collector)
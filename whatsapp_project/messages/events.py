@@ -0,0 +1,78 @@
+"""
+Cheap classification of webhook events before the body is decoded.
+
+Most gateway traffic is presence, receipt, chat and connection updates that the
+webhook ignores. Their event type is read straight from the raw bytes, so they
+can be answered without building the Python object graph or logging payloads.
+"""
+import re
+import threading
+
+from .metrics import metric_key, register_collector
+
+UPSERT_EVENT = 'messages.upsert'
+
+# Events the gateway sends; counters and metric labels are limited to these, whatever a body claims
+GATEWAY_EVENTS = frozenset({
+    'application.startup', 'qrcode.updated', 'connection.update', 'logout.instance', 'remove.instance',
+    'messages.set', UPSERT_EVENT, 'messages.update', 'messages.delete', 'send.message',
+    'contacts.set', 'contacts.upsert', 'contacts.update', 'presence.update',
+    'chats.set', 'chats.upsert', 'chats.update', 'chats.delete',
+    'groups.upsert', 'groups.update', 'group-participants.update',
+    'labels.edit', 'labels.association', 'call',
+})
+
+# JSON strings can't contain a bare quote, so message text can never fake this
+EVENT_TYPE_PATTERN = re.compile(rb'"event"\s*:\s*"([^"\\]{1,100})"')
+
+_event_counters = {}
+_event_counters_lock = threading.Lock()
+
+
+def sniff_event_type(body: bytes):
+    """The first "event" value in a raw webhook body, or None if there isn't one"""
+    match = EVENT_TYPE_PATTERN.search(body)
+    return match.group(1).decode('ascii', 'replace') if match else None
+
+
+def is_ignorable_event(body: bytes, event_type) -> bool:
+    """
+    Whether a body can be dropped without parsing: its event type is known and
+    upserts aren't mentioned anywhere, so a nested "event" key can't hide one
+    """
+    return event_type is not None and event_type != UPSERT_EVENT and UPSERT_EVENT.encode() not in body
+
+
+def event_label(event_type) -> str:
+    """The counter key for an event type taken from a request: a known gateway event, 'unknown' or 'other'"""
+    if not event_type:
+        return 'unknown'
+    if isinstance(event_type, str) and event_type in GATEWAY_EVENTS:
+        return event_type
+    return 'other'
+
+
+def record_event(event_type, fast_path: bool = False):
+    """Count a webhook event by type, and whether it was answered from the fast path"""
+    with _event_counters_lock:
+        counters = _event_counters.setdefault(event_label(event_type), {"received": 0, "fast_path": 0})
+        counters["received"] += 1
+        if fast_path:
+            counters["fast_path"] += 1
+
+
+def event_stats() -> dict:
+    """Per-event-type counters for this worker"""
+    with _event_counters_lock:
+        return {event_type: dict(counters) for event_type, counters in _event_counters.items()}
+
+
+def _metrics_collector() -> dict:
+    return {"counters": {
+        metric_key('webhook_events_total', event=event_type, path=path): counters[key]
+        for event_type, counters in event_stats().items()
+        for path, key in (('all', 'received'), ('fast', 'fast_path'))
+    }}
+
+
+register_collector(_metrics_collector)
@@ -1,6 +1,18 @@
 import re
+import asyncio
 import logging
 import os
+import hashlib
+import threading
+import time
+from asgiref.sync import sync_to_async
+from cachetools import TTLCache
+from decouple import config
+from .local_model import local_model_version, local_verdict, local_verdicts
+from .metrics import inc, metric_key, observe, register_collector
+from .pipeline import ClassifierPipeline, MessageContext, Stage
+from .rules import RULES_CHECK_SECONDS, RULES_FILE, RuleSet, RuleStore
+from .resilience import CircuitBreaker, TokenBucket
 # Try to import Google Generative AI, but handle gracefully if not available
 try:
     import google.generativeai as genai
@@ -64,6 +76,101 @@ def configure_gemini():
 # Initialize Gemini model with memory conservation
 _gemini_model = None
 
+# Upper bound on a single generate_content call so a slow answer cannot hold a worker
+GEMINI_TIMEOUT = config('GEMINI_TIMEOUT', default=15.0, cast=float)
+
+# Every Gemini call in this worker shares one rate limiter and circuit breaker.
+# While the circuit is open borderline messages fall straight back to the pattern
+# verdict, so a Gemini outage never becomes a webhook latency outage.
+gemini_rate_limiter = TokenBucket(
+    rate=config('GEMINI_RATE_PER_MINUTE', default=60.0, cast=float) / 60,
+    capacity=config('GEMINI_BURST', default=10, cast=int)
+)
+gemini_breaker = CircuitBreaker(
+    'gemini',
+    error_rate_threshold=config('GEMINI_BREAKER_ERROR_RATE', default=0.5, cast=float),
+    min_calls=config('GEMINI_BREAKER_MIN_CALLS', default=5, cast=int),
+    window_seconds=config('GEMINI_BREAKER_WINDOW', default=60.0, cast=float),
+    slow_call_seconds=config('GEMINI_BREAKER_SLOW_SECONDS', default=8.0, cast=float),
+    cooldown_seconds=config('GEMINI_BREAKER_COOLDOWN', default=30.0, cast=float)
+)
+
+class GeminiUnavailable(Exception):
+    """Gemini was not called: rate limited or circuit open"""
+
+def call_gemini(model, prompt: str, timeout: float = None):
+    """
+    model.generate_content behind the shared rate limiter and circuit breaker.
+    Callers with an explicit deadline (background workers) may wait for a rate
+    limit token within it; the webhook path never waits.
+    """
+    # The breaker goes first, so calls it rejects don't use up rate limit tokens
+    if not gemini_breaker.allow():
+        inc('gemini_requests_total', outcome='circuit_open')
+        raise GeminiUnavailable("Gemini circuit open")
+    if not gemini_rate_limiter.acquire(timeout=timeout or 0.0):
+        gemini_breaker.cancel()
+        inc('gemini_requests_total', outcome='rate_limited')
+        raise GeminiUnavailable("Gemini rate limit reached")
+
+    started = time.monotonic()
+    try:
+        response = model.generate_content(
+            prompt, request_options={"timeout": timeout or GEMINI_TIMEOUT}
+        )
+    except Exception:
+        _record_gemini_call('error', time.monotonic() - started)
+        raise
+    _record_gemini_call('ok', time.monotonic() - started)
+    return response
+
+async def acall_gemini(model, prompt: str, timeout: float = None):
+    """
+    call_gemini for async callers: generate_content_async under asyncio.wait_for,
+    so a request past its deadline is cancelled instead of left running. Never
+    waits for a rate limit token.
+    """
+    if not gemini_breaker.allow():
+        inc('gemini_requests_total', outcome='circuit_open')
+        raise GeminiUnavailable("Gemini circuit open")
+    if not gemini_rate_limiter.try_acquire():
+        gemini_breaker.cancel()
+        inc('gemini_requests_total', outcome='rate_limited')
+        raise GeminiUnavailable("Gemini rate limit reached")
+
+    timeout = timeout or GEMINI_TIMEOUT
+    started = time.monotonic()
+    try:
+        response = await asyncio.wait_for(
+            model.generate_content_async(prompt, request_options={"timeout": timeout}),
+            timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        _record_gemini_call('timeout', time.monotonic() - started)
+        raise
+    except BaseException:
+        # Cancellation of the caller counts too: the call did not complete
+        _record_gemini_call('error', time.monotonic() - started)
+        raise
+    _record_gemini_call('ok', time.monotonic() - started)
+    return response
+
+def _record_gemini_call(outcome: str, latency: float):
+    """Feed a finished (or failed) call to the breaker and the metrics"""
+    if outcome == 'ok':
+        gemini_breaker.record_success(latency)
+    else:
+        gemini_breaker.record_failure(latency)
+    inc('gemini_requests_total', outcome=outcome)
+    observe('gemini_request_seconds', latency)
+
+def gemini_health() -> dict:
+    """Breaker state and rate limiter counters for monitoring"""
+    return {
+        "breaker": gemini_breaker.snapshot(),
+        "rate_limiter": gemini_rate_limiter.snapshot()
+    }
+
 def get_gemini_model():
     """Get Gemini model instance - memory conservative"""
     global _gemini_model
@@ -93,81 +200,167 @@ def preprocess_message(message: str) -> str:
     message = re.sub(r'forwarded as received\.?', '', message, flags=re.IGNORECASE)
     return message.strip()
 
-def quick_keyword_check(message: str) -> bool:
-    """Quick check for freelance/development keywords - memory efficient"""
-    message_lower = message.lower()
-
-    # Comprehensive disqualifiers that are never freelance jobs
-    hard_disqualifiers = [
-        'salary', 'in hand', 'hours duty', 'bus canteen', 'mnc company',
-        'urgent requirement', 'send resume', 'sir', 'education :', 'male & female',
-        'qualification :', 'immediate hiring', 'steel deal', 'get access',
-        # Service offering patterns (VedaTechX style)
-        'what we offer', 'we offer', 'our services', 'we provide', 'we deliver',
-        'fiverr', 'gig', 'dm me to get started', 'contact us for', 'visit our',
-        'check out our', 'hire us', 'we specialize', 'we are expert',
-        'explore the gig', 'madeonfiverr', 'our expertise', 'we help you',
-        'you\'re in the right place', 'we merge', 'transform your', 
-        'tailored to your', 'smart erp solutions', 'ancient wisdom',
-        'exceptional solutions', 'empowering your business'
-    ]
-
-    if any(disq in message_lower for disq in hard_disqualifiers):
-        return False
+# Comprehensive disqualifiers that are never freelance jobs
+HARD_DISQUALIFIERS = [
+    'salary', 'in hand', 'hours duty', 'bus canteen', 'mnc company',
+    'urgent requirement', 'send resume', 'sir', 'education :', 'male & female',
+    'qualification :', 'immediate hiring', 'steel deal', 'get access',
+    # Service offering patterns (VedaTechX style)
+    'what we offer', 'we offer', 'our services', 'we provide', 'we deliver',
+    'fiverr', 'gig', 'dm me to get started', 'contact us for', 'visit our',
+    'check out our', 'hire us', 'we specialize', 'we are expert',
+    'explore the gig', 'madeonfiverr', 'our expertise', 'we help you',
+    'you\'re in the right place', 'we merge', 'transform your', 
+    'tailored to your', 'smart erp solutions', 'ancient wisdom',
+    'exceptional solutions', 'empowering your business'
+]
 
-    # Expanded hiring intent keywords (more inclusive)
-    hiring_keywords = [
-        'looking for', 'need', 'require', 'seeking', 'wanted', 'hire', 'hiring',
-        'any ', 'available', 'dm me', 'contact me', 'reach out', 'freelance', 
-        'freelancer', 'project', 'build', 'create', 'develop', 'need to',
-        'need to build', 'need to create', 'need to develop'
-    ]
-
-    # Expanded skill keywords (include all the original comprehensive list)
-    skill_keywords = [
-        'developer', 'designer', 'freelancer', 'video editor', 'marketer',
-        'appointment setter', 'content writer', 'programmer', 'coder',
-        # Add back the comprehensive list
-        'web developer', 'website developer', 'frontend developer', 'backend developer',
-        'full stack developer', 'web designer', 'ui developer', 'ux developer',
-        'app developer', 'mobile developer', 'flutter developer', 'react developer',
-        'wordpress developer', 'shopify developer', 'mern stack', 'mean stack',
-        'graphic designer', 'ui designer', 'ux designer', 'poster designer',
-        'logo designer', 'brand designer', 'figma designer', 'video editor',
-        'photographer', 'videographer', 'content creator', 'animator',
-        'digital marketer', 'social media marketer', 'seo expert', 'content writer',
-        'copywriter', 'lead generator', 'ads manager', 'marketing specialist',
-        'data scientist', 'ai developer', 'ml engineer', 'blockchain developer',
-        'c++ developer', 'python developer', 'java developer', 'software tester',
-        'qa engineer', 'devops engineer', 'database developer',
-        'website development', 'web development', 'app development', 'logo design',
-        'website design', 'mobile app', 'e-commerce', 'portfolio site',
-        'business website', 'landing page', 'automation', 'chatbot', 'site', 'website',
-        # Special patterns for Shopify
-        'shopify', 'shopify website', 'shopify site', 'shopify store'
-    ]
-
-    has_hiring_intent = any(keyword in message_lower for keyword in hiring_keywords)
-    has_skill_requirement = any(keyword in message_lower for keyword in skill_keywords)
-
-    return has_hiring_intent and has_skill_requirement
-
-def gemini_intent_check(message: str) -> dict:
-    """Use Gemini API to determine message intent"""
-    try:
-        model = get_gemini_model()
+# Expanded hiring intent keywords (more inclusive)
+HIRING_KEYWORDS = [
+    'looking for', 'need', 'require', 'seeking', 'wanted', 'hire', 'hiring',
+    'any ', 'available', 'dm me', 'contact me', 'reach out', 'freelance', 
+    'freelancer', 'project', 'build', 'create', 'develop', 'need to',
+    'need to build', 'need to create', 'need to develop'
+]
 
-        if not model or model is False:
-            return {"intent": "unknown", "confidence": 0.0}
+# Expanded skill keywords (include all the original comprehensive list)
+SKILL_KEYWORDS = [
+    'developer', 'designer', 'freelancer', 'video editor', 'marketer',
+    'appointment setter', 'content writer', 'programmer', 'coder',
+    # Add back the comprehensive list
+    'web developer', 'website developer', 'frontend developer', 'backend developer',
+    'full stack developer', 'web designer', 'ui developer', 'ux developer',
+    'app developer', 'mobile developer', 'flutter developer', 'react developer',
+    'wordpress developer', 'shopify developer', 'mern stack', 'mean stack',
+    'graphic designer', 'ui designer', 'ux designer', 'poster designer',
+    'logo designer', 'brand designer', 'figma designer',
+    'photographer', 'videographer', 'content creator', 'animator',
+    'digital marketer', 'social media marketer', 'seo expert',
+    'copywriter', 'lead generator', 'ads manager', 'marketing specialist',
+    'data scientist', 'ai developer', 'ml engineer', 'blockchain developer',
+    'c++ developer', 'python developer', 'java developer', 'software tester',
+    'qa engineer', 'devops engineer', 'database developer',
+    'website development', 'web development', 'app development', 'logo design',
+    'website design', 'mobile app', 'e-commerce', 'portfolio site',
+    'business website', 'landing page', 'automation', 'chatbot', 'site', 'website',
+    # Special patterns for Shopify
+    'shopify', 'shopify website', 'shopify site', 'shopify store'
+]
 
-        # Clean the message
-        clean_message = preprocess_message(message)
+# Service offerings that disguise themselves with "looking for"
+DECEPTIVE_PATTERNS = [
+    'what we offer', 'we offer', 'fiverr', 'gig', 'dm me to get started', 
+    'our services', 'we deliver', 'we provide', 'we specialize', 'we merge',
+    'transform your', 'you\'re in the right place', 'tailored to your',
+    'exceptional solutions', 'empowering your business'
+]
 
-        # Create prompt for Gemini
-        prompt = f"""
-Analyze this message very carefully and classify it into one of these categories:
+# Company job indicators
+COMPANY_INDICATORS = [
+    'we\'re hiring', 'we are hiring', 'hiring:', 'join our team', 'full time',
+    'company', 'intern', 'internship', 'office', 'onsite', 'employee',
+    'only for freshers', 'freshers!', 'candidates with', 'pf esic',
+    'interview depend', 'department', 'on roll job', 'production supervisor'
+]
+
+# Freelancer offer indicators
+FREELANCER_INDICATORS = [
+    'i am', 'i\'m', 'offering', 'available for', 'portfolio', 
+    'my services', 'hire me', 'contact us', 'we are', 'we provide',
+    'get your', 'just ₹', 'starting from', 'just edited', 'loved working',
+    'kindly share portfolio', 'drop a', 'if you\'re', 'views are awesome'
+]
+
+# Positive indicators for genuine job requirements
+JOB_REQUIREMENT_INDICATORS = [
+    'looking for', 'need', 'require', 'seeking', 'wanted',
+    'any ', 'available', 'dm me', 'contact me', 'reach out',
+    'freelance', 'freelancer', 'project'
+]
+
+# Step 1 regexes only look at the start of long messages; the keyword matcher
+# still scans the full text, so the cap bounds time without hiding disqualifiers
+MAX_REJECT_SCAN_CHARS = 2000
+
+# Immediate rejection rules as (name, pattern). Gaps between words are bounded
+# windows and digit runs are possessive, so no rule can backtrack across a long
+# forwarded post
+IMMEDIATE_REJECT_RULES = [
+    # Salary patterns
+    ('salary_range', r'(?<!\d)\d++\s*+to\s*+\d++.{0,80}?(?:in hand|salary)'),
+    ('salary_amount', r'salary.{0,60}?₹.{0,30}?\d'),
+    ('in_hand_amount', r'(?<!\d)\d++.{0,60}?in hand'),
+    # Company job patterns
+    ('education_grade', r'education.{0,30}?:.{0,60}?\d++th'),
+    ('male_female', r'male.{0,20}?&.{0,20}?female'),
+    ('bus_canteen', r'bus.{0,60}?canteen'),
+    ('urgent_requirement_male', r'urgent.{0,30}?requirement.{0,60}?male'),
+    ('mnc_company', r'mnc.{0,40}?company'),
+    ('send_resume_urgently', r'send.{0,30}?resume.{0,30}?urgently'),
+    # Service offering patterns
+    ('what_we_offer', r'what.{0,20}?we.{0,20}?offer'),
+    ('fiverr_link', r'fiverr\.com'),
+    ('explore_the_gig', r'explore.{0,20}?the.{0,20}?gig'),
+    ('dm_to_get_started', r'dm.{0,10}?me.{0,10}?to.{0,10}?get.{0,10}?started'),
+    ('right_place', r'you\'re.{0,10}?in.{0,10}?the.{0,10}?right.{0,10}?place'),
+    ('ancient_wisdom', r'we.{0,20}?merge.{0,30}?ancient.{0,20}?wisdom'),
+    ('transform_operations', r'transform.{0,30}?your.{0,30}?operations'),
+    ('empowering_business', r'empowering.{0,30}?your.{0,30}?business'),
+]
+
+# Declared version of the built-in rules; the full version also hashes the lists,
+# so editing any of them is enough to stop stale cached verdicts being served
+RULES_VERSION = 1
+
+# The built-in rule set, compiled once at import. Every keyword list becomes one
+# automaton: one pass per message reports the hits for all categories, so cost
+# stays flat as the lists grow. The regexes stay separate patterns: sre has no
+# shared prefix optimisation for one big alternation, which measured several times slower
+BUILTIN_RULES = RuleSet({
+    'disqualifier': HARD_DISQUALIFIERS,
+    'hiring': HIRING_KEYWORDS,
+    'skill': SKILL_KEYWORDS,
+    'deceptive': DECEPTIVE_PATTERNS,
+    'company': COMPANY_INDICATORS,
+    'freelancer': FREELANCER_INDICATORS,
+    'job_requirement': JOB_REQUIREMENT_INDICATORS,
+}, IMMEDIATE_REJECT_RULES, MAX_REJECT_SCAN_CHARS, str(RULES_VERSION))
+KEYWORD_MATCHER = BUILTIN_RULES.matcher
+COMPILED_REJECT_RULES = BUILTIN_RULES.compiled_reject_rules
+
+def _rules_changed(rules: RuleSet):
+    # Stage hit rates measured on the old rules say little about the new ones
+    CLASSIFIER_PIPELINE.reset_order()
+
+# RULES_FILE, when set, replaces the built-in rules and is reloaded when it changes
+RULE_STORE = RuleStore(BUILTIN_RULES, RULES_FILE, RULES_CHECK_SECONDS, on_change=_rules_changed)
 
-1. "Client looking to hire freelancer" - Someone genuinely needs to hire a freelancer/developer for their project
+def current_rules() -> RuleSet:
+    """The rule set new classifications use (checks RULES_FILE for changes at most every RULES_CHECK_SECONDS)"""
+    return RULE_STORE.current()
+
+def match_reject_rule(message_lower: str):
+    """Return the name of the first immediate rejection rule that fires, or None"""
+    return current_rules().match_reject_rule(message_lower)
+
+def scan_keywords(message: str) -> dict:
+    """Single pass over the message returning {category: set(matched keywords)}"""
+    return current_rules().matcher.scan(message.lower())
+
+def quick_keyword_check(message: str, hits: dict = None) -> bool:
+    """Quick check for freelance/development keywords - memory efficient"""
+    if hits is None:
+        hits = scan_keywords(message)
+
+    if hits['disqualifier']:
+        return False
+
+    return bool(hits['hiring']) and bool(hits['skill'])
+
+# Bump GEMINI_PROMPT_VERSION whenever the prompt changes: stored verdicts are
+# keyed by it, so answers to an older prompt are never reused
+GEMINI_PROMPT_VERSION = 'v1'
+GEMINI_CATEGORY_INSTRUCTIONS = """1. "Client looking to hire freelancer" - Someone genuinely needs to hire a freelancer/developer for their project
 2. "Freelancer offering services" - Someone is advertising their services, even if they use phrases like "Looking for clients"
 3. "Company job posting" - Company hiring for full-time positions
 4. "General message" - Other types of messages
@@ -179,8 +372,13 @@ IMPORTANT: Pay special attention to these red flags that indicate SERVICE OFFERI
 - Company names promoting their services
 - Lists of services they provide
 - Marketing language like "transform your business", "tailored solutions"
+"""
+
+GEMINI_PROMPT_TEMPLATE = """
+Analyze this message very carefully and classify it into one of these categories:
 
-Message: "{clean_message}"
+""" + GEMINI_CATEGORY_INSTRUCTIONS + """
+Message: "{message}"
 
 Respond with only:
 - Category: [exact category name]
@@ -193,205 +391,699 @@ Confidence: [number]
 Explanation: [reason]
 """
 
+# Several borderline messages share one copy of the instructions
+GEMINI_BATCH_PROMPT_TEMPLATE = """
+Analyze each numbered message below very carefully and classify each one independently into one of these categories:
+
+""" + GEMINI_CATEGORY_INSTRUCTIONS + """
+Messages:
+{messages}
+
+Respond with one block per message, in the same order, and nothing else:
+[number]
+Category: [category]
+Confidence: [number]
+Explanation: [reason focusing on why it's a service offer vs genuine job posting]
+"""
+
+# Upper bound on messages packed into a single batched prompt
+GEMINI_BATCH_SIZE = config('GEMINI_BATCH_SIZE', default=10, cast=int)
+
+def parse_gemini_response(response_text: str) -> dict:
+    """Extract Category / Confidence / Explanation lines from a Gemini answer"""
+    category = "unknown"
+    confidence = 0.0
+    explanation = ""
+
+    for line in response_text.split('\n'):
+        line = line.strip()
+        if line.startswith('Category:'):
+            category = line.replace('Category:', '').strip()
+        elif line.startswith('Confidence:'):
+            try:
+                confidence = float(line.replace('Confidence:', '').strip())
+            except:
+                confidence = 0.0
+        elif line.startswith('Explanation:'):
+            explanation = line.replace('Explanation:', '').strip()
+
+    return {"intent": category, "confidence": confidence, "explanation": explanation}
+
+def load_stored_verdicts(text_hashes) -> dict:
+    """Gemini verdicts persisted by any worker for this prompt version, by text hash"""
+    try:
+        from .models import GeminiVerdict
+        rows = GeminiVerdict.objects.filter(
+            text_hash__in=list(text_hashes), prompt_version=GEMINI_PROMPT_VERSION
+        )
+        return {
+            row.text_hash: {
+                "intent": row.category,
+                "confidence": row.confidence,
+                "explanation": row.explanation,
+                "stored": True
+            }
+            for row in rows
+        }
+    except Exception as e:
+        logger.warning(f"Gemini verdict store unavailable: {e}")
+        return {}
+
+def load_stored_verdict(text_hash: str):
+    """Look up a Gemini verdict persisted by any worker for this prompt version"""
+    return load_stored_verdicts([text_hash]).get(text_hash)
+
+def store_verdicts(results: dict):
+    """Persist Gemini verdicts by text hash; concurrent writers of the same hash are ignored"""
+    if not results:
+        return
+    try:
+        from .models import GeminiVerdict
+        GeminiVerdict.objects.bulk_create([
+            GeminiVerdict(
+                text_hash=text_hash,
+                prompt_version=GEMINI_PROMPT_VERSION,
+                category=result["intent"][:100],
+                confidence=result["confidence"],
+                explanation=result.get("explanation", "")
+            )
+            for text_hash, result in results.items()
+        ], ignore_conflicts=True)
+    except Exception as e:
+        logger.warning(f"Could not store Gemini verdict: {e}")
+
+def store_verdict(text_hash: str, result: dict):
+    """Persist a single Gemini verdict"""
+    store_verdicts({text_hash: result})
+
+def gemini_intent_check(message: str, timeout: float = None, stored: dict = None) -> dict:
+    """
+    Use Gemini API to determine message intent; `stored` is a verdict the caller
+    already loaded from the verdict store, which saves looking it up again
+    """
+    try:
+        # Clean the message
+        clean_message = preprocess_message(message)
+
+        # Another worker (or a previous deploy) may already have paid for this call
+        text_hash = message_fingerprint(message)
+        if stored is None:
+            stored = load_stored_verdict(text_hash)
+        if stored:
+            logger.info(f"Gemini stored result: {stored['intent']} ({stored['confidence']:.3f}) for: {message[:40]}...")
+            return stored
+
+        model = get_gemini_model()
+
+        if not model or model is False:
+            return {"intent": "unknown", "confidence": 0.0}
+
+        # Create prompt for Gemini
+        prompt = GEMINI_PROMPT_TEMPLATE.format(message=clean_message)
+
         # Get response from Gemini
-        response = model.generate_content(prompt)
+        response = call_gemini(model, prompt, timeout)
         response_text = response.text.strip()
 
         # Parse response
-        category = "unknown"
-        confidence = 0.0
+        result = parse_gemini_response(response_text)
+        result["full_response"] = response_text
 
-        for line in response_text.split('\n'):
-            line = line.strip()
-            if line.startswith('Category:'):
-                category = line.replace('Category:', '').strip()
-            elif line.startswith('Confidence:'):
-                try:
-                    confidence = float(line.replace('Confidence:', '').strip())
-                except:
-                    confidence = 0.0
+        logger.info(f"Gemini result: {result['intent']} ({result['confidence']:.3f}) for: {message[:40]}...")
 
-        logger.info(f"Gemini result: {category} ({confidence:.3f}) for: {message[:40]}...")
+        store_verdict(text_hash, result)
+        return result
 
-        return {
-            "intent": category,
-            "confidence": confidence,
-            "full_response": response_text
-        }
+    except GeminiUnavailable as e:
+        logger.warning(f"Gemini skipped: {e}")
+        return {"intent": "unknown", "confidence": 0.0, "error": str(e), "skipped": True}
+    except Exception as e:
+        logger.error(f"Gemini classification failed: {e}")
+        return {"intent": "unknown", "confidence": 0.0, "error": str(e)}
+
+async def agemini_intent_check(message: str, timeout: float = None) -> dict:
+    """gemini_intent_check for async callers, with the same result shapes"""
+    try:
+        clean_message = preprocess_message(message)
+
+        text_hash = message_fingerprint(message)
+        stored = await sync_to_async(load_stored_verdict)(text_hash)
+        if stored:
+            logger.info(f"Gemini stored result: {stored['intent']} ({stored['confidence']:.3f}) for: {message[:40]}...")
+            return stored
 
+        model = get_gemini_model()
+
+        if not model or model is False:
+            return {"intent": "unknown", "confidence": 0.0}
+
+        prompt = GEMINI_PROMPT_TEMPLATE.format(message=clean_message)
+
+        response = await acall_gemini(model, prompt, timeout)
+        response_text = response.text.strip()
+
+        result = parse_gemini_response(response_text)
+        result["full_response"] = response_text
+
+        logger.info(f"Gemini result: {result['intent']} ({result['confidence']:.3f}) for: {message[:40]}...")
+
+        await sync_to_async(store_verdict)(text_hash, result)
+        return result
+
+    except GeminiUnavailable as e:
+        logger.warning(f"Gemini skipped: {e}")
+        return {"intent": "unknown", "confidence": 0.0, "error": str(e), "skipped": True}
+    except asyncio.TimeoutError:
+        logger.error(f"Gemini classification timed out: {message[:40]}...")
+        return {"intent": "unknown", "confidence": 0.0, "error": "timeout"}
     except Exception as e:
         logger.error(f"Gemini classification failed: {e}")
-        return {"intent": "unknown", "confidence": 0.0}
+        return {"intent": "unknown", "confidence": 0.0, "error": str(e)}
 
-def is_job_requirement(message: str) -> bool:
+def parse_gemini_batch_response(response_text: str) -> dict:
+    """Split a batched answer into {item number: parsed result} for well-formed items"""
+    blocks = {}
+    current = None
+    for line in response_text.split('\n'):
+        marker = re.match(r'^\s*\[(\d+)\]\s*(.*)$', line)
+        if marker:
+            current = int(marker.group(1))
+            blocks[current] = [marker.group(2)]
+        elif current is not None:
+            blocks[current].append(line)
+
+    parsed = {}
+    for number, lines in blocks.items():
+        result = parse_gemini_response('\n'.join(lines))
+        if result["intent"] != "unknown":
+            parsed[number] = result
+    return parsed
+
+def classify_batch(messages: list, timeout: float = None) -> list:
+    """
+    Classify several borderline messages with one Gemini request per GEMINI_BATCH_SIZE.
+    Returns one gemini_intent_check-style result per message, in order; items the
+    batched answer fails to cover are retried with single-message calls.
+    """
+    hashes = [message_fingerprint(message) for message in messages]
+    results = {}
+
+    try:
+        results.update(load_stored_verdicts(set(hashes)))
+
+        # One prompt slot per distinct text that has no stored verdict yet
+        to_ask = {}
+        for text_hash, message in zip(hashes, messages):
+            if text_hash not in results and text_hash not in to_ask:
+                to_ask[text_hash] = message
+
+        model = get_gemini_model() if to_ask else None
+        if to_ask and (not model or model is False):
+            return [results.get(h, {"intent": "unknown", "confidence": 0.0}) for h in hashes]
+
+        pending = list(to_ask.items())
+        for start in range(0, len(pending), GEMINI_BATCH_SIZE):
+            chunk = pending[start:start + GEMINI_BATCH_SIZE]
+            numbered = '\n'.join(
+                f'[{number}] "{preprocess_message(message)}"'
+                for number, (_, message) in enumerate(chunk, 1)
+            )
+            prompt = GEMINI_BATCH_PROMPT_TEMPLATE.format(messages=numbered)
+
+            response = call_gemini(model, prompt, timeout)
+            parsed = parse_gemini_batch_response(response.text.strip())
+            logger.info(f"Gemini batch result: {len(parsed)}/{len(chunk)} items parsed")
+
+            answered = {}
+            for number, (text_hash, message) in enumerate(chunk, 1):
+                if number in parsed:
+                    answered[text_hash] = parsed[number]
+                else:
+                    # Malformed or missing item: ask about it on its own
+                    results[text_hash] = gemini_intent_check(message, timeout=timeout)
+
+            store_verdicts(answered)
+            results.update(answered)
+
+    except Exception as e:
+        if isinstance(e, GeminiUnavailable):
+            logger.warning(f"Gemini batch skipped: {e}")
+        else:
+            logger.error(f"Gemini batch classification failed: {e}")
+        error = {"intent": "unknown", "confidence": 0.0, "error": str(e),
+                 "skipped": isinstance(e, GeminiUnavailable)}
+        return [results.get(h, error) for h in hashes]
+
+    return [results[h] for h in hashes]
+
+def is_hiring_intent(classification_result: dict) -> bool:
+    """Gemini verdict rule: a confident "Client looking to hire" answer"""
+    return (
+        "Client looking to hire" in classification_result.get("intent", "") and
+        classification_result.get("confidence", 0.0) > 0.7
+    )
+
+def _verdict(is_job: bool, rule: str, gemini: dict = None) -> dict:
+    return {"is_job": is_job, "rule": rule, "gemini": gemini}
+
+def _gemini_verdict(message: str, classification_result: dict, pattern_verdict: bool) -> dict:
+    """Step 6 verdict from Gemini's answer, or the pattern verdict when Gemini gave none"""
+    intent = classification_result.get("intent", "")
+    confidence = classification_result.get("confidence", 0.0)
+
+    if classification_result.get("error"):
+        # Gemini failed, was rate limited or the circuit is open: pattern verdict
+        logger.info(f"⚠️ GEMINI UNAVAILABLE, PATTERN VERDICT: '{message[:40]}...'")
+        return _verdict(pattern_verdict, "gemini_unavailable", classification_result)
+
+    is_job_req = is_hiring_intent(classification_result)
+
+    if is_job_req:
+        logger.info(f"✅ GEMINI FALLBACK: JOB REQUIREMENT: {confidence:.3f} - '{message[:40]}...'")
+        return _verdict(True, "gemini", classification_result)
+    else:
+        logger.info(f"❌ GEMINI FALLBACK: NOT JOB REQ: {intent} ({confidence:.3f}) - '{message[:40]}...'")
+        return _verdict(False, "gemini", classification_result)
+
+class RegexRejectStage(Stage):
+    """Step 1: Immediate rejection patterns (regex-based, memory efficient)"""
+    name = 'regex'
+    reorderable = True
+
+    def decide(self, context: MessageContext):
+        started = time.perf_counter()
+        reject_rule = context.rules.match_reject_rule(context.message_lower)
+        observe('classifier_stage_seconds', time.perf_counter() - started, stage='reject_regex')
+        if reject_rule:
+            logger.info(f"❌ REGEX PATTERN REJECT ({reject_rule}): '{context.message[:40]}...'")
+            return _verdict(False, f"regex:{reject_rule}")
+        return None
+
+class DeceptiveOfferStage(Stage):
+    """Step 2: Deceptive service offerings check"""
+    name = 'deceptive_offer'
+    reorderable = True
+    uses_hits = True
+
+    def decide(self, context: MessageContext):
+        # The phrase is fixed, not a job_requirement keyword a rules file could drop
+        if 'looking for' in context.message_lower and context.hits['deceptive']:
+            logger.info(f"❌ DECEPTIVE SERVICE OFFERING: '{context.message[:40]}...'")
+            return _verdict(False, "deceptive_offer")
+        return None
+
+class KeywordCheckStage(Stage):
+    """Step 3: Basic keyword filtering (memory efficient)"""
+    name = 'keyword_check'
+    reorderable = True
+    uses_hits = True
+
+    def decide(self, context: MessageContext):
+        if not quick_keyword_check(context.message, context.hits):
+            logger.info(f"❌ KEYWORD CHECK FAILED: '{context.message[:40]}...'")
+            return _verdict(False, "keyword_check")
+        return None
+
+class CompanyJobStage(Stage):
+    """Step 4a: company job posts"""
+    name = 'company_job'
+    reorderable = True
+    uses_hits = True
+
+    def decide(self, context: MessageContext):
+        if context.hits['company']:
+            logger.info(f"❌ COMPANY JOB DETECTED: '{context.message[:40]}...'")
+            return _verdict(False, "company_job")
+        return None
+
+class FreelancerOfferStage(Stage):
+    """Step 4b: freelancers advertising themselves"""
+    name = 'freelancer_offer'
+    reorderable = True
+    uses_hits = True
+
+    def decide(self, context: MessageContext):
+        if context.hits['freelancer']:
+            logger.info(f"❌ FREELANCER OFFER DETECTED: '{context.message[:40]}...'")
+            return _verdict(False, "freelancer_offer")
+        return None
+
+class PatternMatchStage(Stage):
+    """
+    Step 5: Positive indicators for genuine job requirements. Runs after every
+    reject-only stage, so no company or freelancer indicator is present here
+    """
+    name = 'pattern_match'
+    uses_hits = True
+
+    def decide(self, context: MessageContext):
+        if context.hits['job_requirement']:
+            logger.info(f"✅ PATTERN MATCH: JOB REQUIREMENT: '{context.message[:40]}...'")
+            return _verdict(True, "pattern_match")
+        return None
+
+class LocalModelStage(Stage):
+    """Step 5b: the trained local model settles borderline messages it is confident about"""
+    name = 'local_model'
+
+    def prepare(self, contexts: list):
+        # A batch is scored with one vectorized predict_proba call
+        started = time.perf_counter()
+        verdicts = local_verdicts([context.message for context in contexts])
+        share = (time.perf_counter() - started) / len(contexts)
+        for context, verdict in zip(contexts, verdicts):
+            context.prepared[self.name] = verdict
+            if verdict[1] is not None:
+                observe('classifier_stage_seconds', share, stage='local_model')
+
+    def decide(self, context: MessageContext):
+        if self.name in context.prepared:
+            local_is_job, probability = context.prepared[self.name]
+        else:
+            started = time.perf_counter()
+            local_is_job, probability = local_verdict(context.message)
+            if probability is not None:
+                observe('classifier_stage_seconds', time.perf_counter() - started, stage='local_model')
+        if local_is_job is not None:
+            logger.info(f"{'✅' if local_is_job else '❌'} LOCAL MODEL: {probability:.3f} - '{context.message[:40]}...'")
+            return _verdict(local_is_job, "local_model")
+        return None
+
+class GeminiStage(Stage):
+    """Step 6: Only use Gemini for borderline cases (memory conservation); always decides"""
+    name = 'gemini'
+    uses_hits = True
+
+    def decide(self, context: MessageContext):
+        message = context.message
+        pattern_verdict = bool(context.hits['job_requirement'])
+
+        # Pattern-only callers (replays, warm-up) stop before spending a Gemini call
+        if not context.use_gemini:
+            return _verdict(pattern_verdict, "gemini_skipped")
+
+        # Deferred mode hands borderline messages to the background workers unless
+        # some worker has already stored Gemini's answer for this text
+        stored = None
+        if context.defer_gemini:
+            stored = load_stored_verdict(message_fingerprint(message))
+            if stored is None:
+                logger.info(f"⏳ GEMINI DEFERRED: '{message[:40]}...'")
+                return _verdict(None, "gemini_pending")
+
+        try:
+            started = time.perf_counter()
+            classification_result = gemini_intent_check(message, stored=stored)
+            observe('classifier_stage_seconds', time.perf_counter() - started, stage='gemini')
+            return _gemini_verdict(message, classification_result, pattern_verdict)
+        except Exception as e:
+            # If Gemini fails (memory issues), fall back to pattern matching
+            logger.warning(f"Gemini failed, using pattern fallback: {e}")
+            return _verdict(pattern_verdict, "gemini_error", {"error": str(e)})  # More lenient fallback
+
+# With CLASSIFIER_ADAPTIVE_ORDER the reject-only stages are re-ranked every
+# CLASSIFIER_REORDER_EVERY messages; off by default so the deciding rule of a
+# message that several stages would reject stays the same from run to run
+CLASSIFIER_ADAPTIVE_ORDER = config('CLASSIFIER_ADAPTIVE_ORDER', default=False, cast=bool)
+CLASSIFIER_REORDER_EVERY = config('CLASSIFIER_REORDER_EVERY', default=1000, cast=int)
+
+CLASSIFIER_PIPELINE = ClassifierPipeline([
+    RegexRejectStage(),
+    DeceptiveOfferStage(),
+    KeywordCheckStage(),
+    CompanyJobStage(),
+    FreelancerOfferStage(),
+    PatternMatchStage(),
+    LocalModelStage(),
+    GeminiStage(),
+], adaptive=CLASSIFIER_ADAPTIVE_ORDER, reorder_every=CLASSIFIER_REORDER_EVERY)
+
+def _classify_uncached(message: str, use_gemini: bool = True, defer_gemini: bool = False,
+                       rules: RuleSet = None) -> dict:
     """
     Memory-efficient job requirement checker
     Uses pattern matching first, Gemini only as fallback for edge cases
     """
+    context = MessageContext(message, rules or current_rules(), use_gemini, defer_gemini)
+    result = CLASSIFIER_PIPELINE.run(context)
+    if context.scan_seconds:
+        observe('classifier_stage_seconds', context.scan_seconds, stage='keyword_scan')
+    result["rules_version"] = context.rules.version
+    return result
 
-    # Pre-filter: Aggressive pattern detection (no AI needed)
-    message_lower = message.lower()
-
-    # Step 1: Immediate rejection patterns (regex-based, memory efficient)
-    immediate_reject_patterns = [
-        # Salary patterns
-        r'\d+\s*to\s*\d+.*(?:in hand|salary)',
-        r'salary.*₹.*\d+',
-        r'\d+.*in hand',
-        # Company job patterns
-        r'education.*:.*\d+th',
-        r'male.*&.*female',
-        r'bus.*canteen',
-        r'urgent.*requirement.*male',
-        r'mnc.*company',
-        r'send.*resume.*urgently',
-        # Service offering patterns
-        r'what.*we.*offer',
-        r'fiverr\.com',
-        r'explore.*the.*gig',
-        r'dm.*me.*to.*get.*started',
-        r'you\'re.*in.*the.*right.*place',
-        r'we.*merge.*ancient.*wisdom',
-        r'transform.*your.*operations',
-        r'empowering.*your.*business'
-    ]
-
-    for pattern in immediate_reject_patterns:
-        if re.search(pattern, message_lower):
-            logger.info(f"❌ REGEX PATTERN REJECT: '{message[:40]}...'")
-            return False
+def classifier_pipeline_stats() -> dict:
+    """Stage order, and per stage how often it ran, decided and what it cost"""
+    return CLASSIFIER_PIPELINE.stats()
 
-    # Step 2: Deceptive service offerings check
-    deceptive_patterns = [
-        'what we offer', 'we offer', 'fiverr', 'gig', 'dm me to get started', 
-        'our services', 'we deliver', 'we provide', 'we specialize', 'we merge',
-        'transform your', 'you\'re in the right place', 'tailored to your',
-        'exceptional solutions', 'empowering your business'
-    ]
+def message_fingerprint(message: str) -> str:
+    """Stable hash of the normalized message text, shared by every repost of it"""
+    normalized = preprocess_message(message).lower()
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
 
-    if 'looking for' in message_lower and any(pattern in message_lower for pattern in deceptive_patterns):
-        logger.info(f"❌ DECEPTIVE SERVICE OFFERING: '{message[:40]}...'")
-        return False
+# Verdict cache in front of the classifier: the same post is forwarded into many
+# groups, so repeats skip both the rule scan and the Gemini round-trip. Keyed on
+# the rules and local model versions, so verdicts of replaced rules or a retrained
+# model are never served (they age out).
+CLASSIFIER_CACHE_SIZE = config('CLASSIFIER_CACHE_SIZE', default=4096, cast=int)
+CLASSIFIER_CACHE_TTL = config('CLASSIFIER_CACHE_TTL', default=6 * 60 * 60, cast=int)
 
-    # Step 3: Basic keyword filtering (memory efficient)
-    if not quick_keyword_check(message):
-        logger.info(f"❌ KEYWORD CHECK FAILED: '{message[:40]}...'")
-        return False
+_classification_cache = TTLCache(maxsize=CLASSIFIER_CACHE_SIZE, ttl=CLASSIFIER_CACHE_TTL)
+_classification_cache_lock = threading.Lock()
+_classification_cache_counters = {"hits": 0, "misses": 0}
 
-    # Step 4: Advanced pattern matching (before using AI)
-    # Company job indicators
-    company_indicators = [
-        'we\'re hiring', 'we are hiring', 'hiring:', 'join our team', 'full time',
-        'company', 'intern', 'internship', 'office', 'onsite', 'employee',
-        'only for freshers', 'freshers!', 'candidates with', 'pf esic',
-        'interview depend', 'department', 'on roll job', 'production supervisor'
-    ]
-
-    company_score = sum(1 for indicator in company_indicators if indicator in message_lower)
-    if company_score >= 1:
-        logger.info(f"❌ COMPANY JOB DETECTED: '{message[:40]}...'")
-        return False
+def classify_message(message: str, use_gemini: bool = True, defer_gemini: bool = False) -> dict:
+    """
+    Classify a message and explain the verdict:
+    {"is_job": bool, "rule": <deciding rule>, "gemini": <Gemini result or None>,
+     "rules_version": <version of the rules that decided>}
+    With use_gemini=False borderline messages end with rule "gemini_skipped";
+    with defer_gemini=True they end with is_job None and rule "gemini_pending".
+    """
+    if not use_gemini:
+        result = _classify_uncached(message, use_gemini=False)
+        inc('classifier_decisions_total', rule=result['rule'])
+        return result
 
-    # Freelancer offer indicators
-    freelancer_indicators = [
-        'i am', 'i\'m', 'offering', 'available for', 'portfolio', 
-        'my services', 'hire me', 'contact us', 'we are', 'we provide',
-        'get your', 'just ₹', 'starting from', 'just edited', 'loved working',
-        'kindly share portfolio', 'drop a', 'if you\'re', 'views are awesome'
-    ]
-
-    freelancer_score = sum(1 for indicator in freelancer_indicators if indicator in message_lower)
-    if freelancer_score >= 1:
-        logger.info(f"❌ FREELANCER OFFER DETECTED: '{message[:40]}...'")
-        return False
+    rules = current_rules()
+    key = verdict_cache_key(rules.version, message)
 
-    # Step 5: Positive indicators for genuine job requirements
-    job_requirement_indicators = [
-        'looking for', 'need', 'require', 'seeking', 'wanted',
-        'any ', 'available', 'dm me', 'contact me', 'reach out',
-        'freelance', 'freelancer', 'project'
-    ]
+    with _classification_cache_lock:
+        cached = _classification_cache.get(key)
+        if cached is not None:
+            _classification_cache_counters["hits"] += 1
+        else:
+            _classification_cache_counters["misses"] += 1
 
-    job_req_score = sum(1 for indicator in job_requirement_indicators if indicator in message_lower)
+    if cached is not None:
+        logger.info(f"♻️ CACHED VERDICT ({cached['rule']}): '{message[:40]}...'")
+        inc('classifier_decisions_total', rule=cached['rule'])
+        return cached
 
-    # If strong positive indicators and no negative ones, accept without AI
-    if job_req_score >= 1 and freelancer_score == 0 and company_score == 0:
-        logger.info(f"✅ PATTERN MATCH: JOB REQUIREMENT: '{message[:40]}...'")
-        return True
+    result = _classify_uncached(message, defer_gemini=defer_gemini, rules=rules)
+    _remember_verdict(key, result)
+    inc('classifier_decisions_total', rule=result['rule'])
+    return result
 
-    # Step 6: Only use Gemini for borderline cases (memory conservation)
-    try:
-        classification_result = gemini_intent_check(message)
-        intent = classification_result.get("intent", "")
-        confidence = classification_result.get("confidence", 0.0)
+def classify_message_batch(messages: list, defer_gemini: bool = False) -> list:
+    """
+    classify_message for a batch, one verdict per message in order. Cached
+    verdicts are reused and the rest run through the pipeline together, so the
+    local model scores them in one vectorized call.
+    """
+    rules = current_rules()
+    keys = [verdict_cache_key(rules.version, message) for message in messages]
+    results = {}
+    to_classify = {}
 
-        is_job_req = (
-            "Client looking to hire" in intent and 
-            confidence > 0.7
-        )
+    with _classification_cache_lock:
+        for key, message in zip(keys, messages):
+            # A repeat within the batch counts as a hit, as it would one message at a time
+            if key in results or key in to_classify:
+                _classification_cache_counters["hits"] += 1
+                continue
+            cached = _classification_cache.get(key)
+            if cached is not None:
+                _classification_cache_counters["hits"] += 1
+                results[key] = cached
+            else:
+                _classification_cache_counters["misses"] += 1
+                to_classify[key] = message
 
-        if is_job_req:
-            logger.info(f"✅ GEMINI FALLBACK: JOB REQUIREMENT: {confidence:.3f} - '{message[:40]}...'")
-            return True
-        else:
-            logger.info(f"❌ GEMINI FALLBACK: NOT JOB REQ: {intent} ({confidence:.3f}) - '{message[:40]}...'")
-            return False
+    contexts = [MessageContext(message, rules, True, defer_gemini) for message in to_classify.values()]
+    for key, context, result in zip(to_classify, contexts, CLASSIFIER_PIPELINE.run_many(contexts)):
+        if context.scan_seconds:
+            observe('classifier_stage_seconds', context.scan_seconds, stage='keyword_scan')
+        result["rules_version"] = rules.version
+        _remember_verdict(key, result)
+        results[key] = result
 
-    except Exception as e:
-        # If Gemini fails (memory issues), fall back to pattern matching
-        logger.warning(f"Gemini failed, using pattern fallback: {e}")
-        return job_req_score >= 1  # More lenient fallback
+    for key in keys:
+        inc('classifier_decisions_total', rule=results[key]['rule'])
+    return [results[key] for key in keys]
+
+def verdict_cache_key(rules_version: str, message: str) -> tuple:
+    return rules_version, local_model_version(), message_fingerprint(message)
+
+def _remember_verdict(key: tuple, result: dict):
+    # Pending and transiently failed Gemini checks must not be remembered as verdicts
+    gemini = result["gemini"]
+    if result["is_job"] is not None and not (gemini and gemini.get("error")):
+        with _classification_cache_lock:
+            _classification_cache[key] = result
+
+async def aclassify_message(message: str, timeout: float = None) -> dict:
+    """
+    classify_message for async callers: the rules run as usual and a borderline
+    message's Gemini call is awaited, so other requests proceed meanwhile
+    """
+    result = await sync_to_async(classify_message)(message, defer_gemini=True)
+    if result["rule"] != "gemini_pending":
+        return result
+
+    started = time.perf_counter()
+    classification_result = await agemini_intent_check(message, timeout)
+    observe('classifier_stage_seconds', time.perf_counter() - started, stage='gemini')
+    return _finish_deferred_verdict(message, result, classification_result)
+
+def complete_verdict(message: str, result: dict) -> dict:
+    """
+    Ask Gemini about a verdict that defer_gemini=True left as "gemini_pending";
+    any other verdict is returned as it is
+    """
+    if result["rule"] != "gemini_pending":
+        return result
+    started = time.perf_counter()
+    classification_result = gemini_intent_check(message)
+    observe('classifier_stage_seconds', time.perf_counter() - started, stage='gemini')
+    return _finish_deferred_verdict(message, result, classification_result)
+
+def _finish_deferred_verdict(message: str, deferred: dict, classification_result: dict) -> dict:
+    # Reaching Step 6 means no job requirement indicator matched, so the pattern verdict is False
+    result = _gemini_verdict(message, classification_result, False)
+    result["rules_version"] = deferred["rules_version"]
+    _remember_verdict(verdict_cache_key(result["rules_version"], message), result)
+    inc('classifier_decisions_total', rule=result['rule'])
+    return result
+
+def classification_cache_stats() -> dict:
+    """Hit/miss counters and current size of the classification cache"""
+    with _classification_cache_lock:
+        return {
+            **_classification_cache_counters,
+            "size": len(_classification_cache),
+            "maxsize": _classification_cache.maxsize,
+            "ttl": _classification_cache.ttl,
+            "rules_version": current_rules().version,
+        }
+
+def _metrics_collector() -> dict:
+    """Classification cache and Gemini breaker/rate limiter values for the metrics snapshot"""
+    cache = classification_cache_stats()
+    breaker = gemini_breaker.snapshot()
+    limiter = gemini_rate_limiter.snapshot()
+    pipeline = classifier_pipeline_stats()
+    rules = rule_stats()
+    return {
+        "counters": {
+            metric_key('classifier_rules_reloads_total'): rules['reloads'],
+            metric_key('classifier_rules_errors_total'): rules['errors'],
+            **{metric_key('classifier_stage_runs_total', stage=name): stats['calls']
+               for name, stats in pipeline['stages'].items()},
+            **{metric_key('classifier_stage_decided_total', stage=name): stats['decided']
+               for name, stats in pipeline['stages'].items()},
+            **{metric_key('classifier_stage_cost_seconds_total', stage=name): stats['seconds']
+               for name, stats in pipeline['stages'].items()},
+            metric_key('classifier_cache_requests_total', result='hit'): cache['hits'],
+            metric_key('classifier_cache_requests_total', result='miss'): cache['misses'],
+            **{metric_key('gemini_breaker_events_total', event=event): breaker[event]
+               for event in ('calls', 'failures', 'slow_calls', 'rejected', 'opened')},
+            metric_key('gemini_rate_limiter_total', result='granted'): limiter['granted'],
+            metric_key('gemini_rate_limiter_total', result='throttled'): limiter['throttled'],
+        },
+        "gauges": {
+            metric_key('classifier_cache_size'): cache['size'],
+            metric_key('classifier_rules_info', version=rules['version'], source=rules['source']): 1,
+            **{metric_key('classifier_stage_position', stage=name): position
+               for position, name in enumerate(pipeline['order'])},
+            **{metric_key('gemini_breaker_state', state=state): int(breaker['state'] == state)
+               for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)},
+            metric_key('gemini_rate_limiter_tokens'): limiter['tokens'],
+        },
+    }
+
+register_collector(_metrics_collector)
+
+def rule_stats() -> dict:
+    """Active rules version and source, and how often RULES_FILE was checked, reloaded or failed"""
+    return RULE_STORE.stats()
+
+def clear_classification_cache():
+    """
+    Drop every cached verdict, e.g. after editing the rule lists; the hit/miss
+    counters are lifetime totals (exported as Prometheus counters) and are kept
+    """
+    with _classification_cache_lock:
+        _classification_cache.clear()
+
+def is_job_requirement(message: str) -> bool:
+    """
+    Memory-efficient job requirement checker
+    Uses pattern matching first, Gemini only as fallback for edge cases
+    """
+    return classify_message(message)["is_job"]
 
 # Keep the old function name for backward compatibility
 def is_relevant_message(msg: str) -> bool:
     """Check if message is a job requirement (backward compatibility)"""
     return is_job_requirement(msg)
 
+# Sample messages with the verdict they should get; also training data for the local model
+CLASSIFIER_TEST_CASES = [
+    # Should be TRUE (Job Requirements)
+    ("Hey everyone, I am looking for a n8n developer", True),
+    ("Looking for Poster Designers! Need creative designers", True),
+    ("Hello, I'm looking for freelance videographers", True),
+    ("Need digital marketer who has experience in lead generation", True),
+    ("Any Figma designers freelancers kindly DM me", True),
+    ("Hi looking for a video editor to edit AI videos", True),
+    ("Hey guys, I am looking for experienced appointment setters for my agency", True),
+    ("Any freelance Shopify Website developer available? DM me", True),
+    ("Hi\n\nAny freelance Shopify Website developer available?\n\nDM me, I will share the contact person\n#Hiring\n\nNeed to build a Shopify site similar to this.", True),
+
+    # Should be FALSE (Recent Company Job Postings)
+    ("Urgent requirement • MNC COMPANY • Male & female Education 10th 12th ITI salary 15000 TO 17,000", False),
+    ("•Urgently Requirement• •Tomorrow• company Name:-( MNC ) •Only/FEMALE• •Age limit•:- 18-30 years", False),
+    ("Please Help To Forward In Job Groups Urgently Required Post : 7 PSR Project : - Biotique Company", False),
+    ("FlutterFlow Now Available in Steel Deal! Get access to FlutterFlow – the powerful no-code app builder", False),
+    ("Urgent requirement Male & female Education : 10th 12th ITI Salary : 17000 in hand 8 hours duty", False),
+    ("MNC COMPANY Male & female Education : BA B COM BSC Salary : 15500 in hand", False),
+    ("Urgent requirement ON ROLL JOB Production supervisor 04 Store supervisor 05", False),
+    ("Immediate Hiring - Female Candidate With Mechanical Diploma Requirements", False),
+
+    # Should be FALSE (Freelancer Offers)
+    ("Just Edited this New Videos for my Client. DM me for Video Projects", False),
+    ("I'm a passionate freelance developer actively looking for projects", False),
+    ("Get Your Own Business Portfolio Website for Just ₹1999!", False),
+    ("Kindly share portfolio with relevant projects", False),
+    ("Drop a 'Interested' if you're the right fit or DM me directly", False),
+    ("VedaTechX Looking for an expert Odoo developer? What We Offer: Custom Odoo Modules DM me to get started!", False),
+
+    # Should be FALSE (Model/Other Requirements)
+    ("Hair Show Model Requirement – Schwarzkopf Professional Academy Location: Saket", False),
+    ("We need 5 Female Models for a 2-Day Hair Show Send profiles ASAP!", False),
+]
+
 # Test function to validate the classifier
 def test_classifier():
     """Test the classifier with sample messages"""
-    test_messages = [
-        # Should be TRUE (Job Requirements)
-        "Hey everyone, I am looking for a n8n developer",
-        "Looking for Poster Designers! Need creative designers",
-        "Hello, I'm looking for freelance videographers",
-        "Need digital marketer who has experience in lead generation",
-        "Any Figma designers freelancers kindly DM me",
-        "Hi looking for a video editor to edit AI videos",
-        "Hey guys, I am looking for experienced appointment setters for my agency",
-        "Any freelance Shopify Website developer available? DM me",
-        "Hi\n\nAny freelance Shopify Website developer available?\n\nDM me, I will share the contact person\n#Hiring\n\nNeed to build a Shopify site similar to this.",
-
-        # Should be FALSE (Recent Company Job Postings)
-        "Urgent requirement • MNC COMPANY • Male & female Education 10th 12th ITI salary 15000 TO 17,000",
-        "•Urgently Requirement• •Tomorrow• company Name:-( MNC ) •Only/FEMALE• •Age limit•:- 18-30 years",
-        "Please Help To Forward In Job Groups Urgently Required Post : 7 PSR Project : - Biotique Company",
-        "FlutterFlow Now Available in Steel Deal! Get access to FlutterFlow – the powerful no-code app builder",
-        "Urgent requirement Male & female Education : 10th 12th ITI Salary : 17000 in hand 8 hours duty",
-        "MNC COMPANY Male & female Education : BA B COM BSC Salary : 15500 in hand",
-        "Urgent requirement ON ROLL JOB Production supervisor 04 Store supervisor 05",
-        "Immediate Hiring - Female Candidate With Mechanical Diploma Requirements",
-
-        # Should be FALSE (Freelancer Offers)
-        "Just Edited this New Videos for my Client. DM me for Video Projects",
-        "I'm a passionate freelance developer actively looking for projects",
-        "Get Your Own Business Portfolio Website for Just ₹1999!",
-        "Kindly share portfolio with relevant projects",
-        "Drop a 'Interested' if you're the right fit or DM me directly",
-        "VedaTechX Looking for an expert Odoo developer? What We Offer: Custom Odoo Modules DM me to get started!",
-
-        # Should be FALSE (Model/Other Requirements)
-        "Hair Show Model Requirement – Schwarzkopf Professional Academy Location: Saket",
-        "We need 5 Female Models for a 2-Day Hair Show Send profiles ASAP!"
-    ]
-
     print("🧪 Testing Classifier with Shopify Messages:")
     print("=" * 60)
 
-    for i, message in enumerate(test_messages, 1):
+    for i, (message, expected) in enumerate(CLASSIFIER_TEST_CASES, 1):
         result = is_job_requirement(message)
         status = "✅ PASS" if result else "❌ FILTER"
-        print(f"{i:2d}. {status}: {message[:50]}...")
+        mismatch = "" if result == expected else "  ⚠️ expected " + ("PASS" if expected else "FILTER")
+        print(f"{i:2d}. {status}: {message[:50]}...{mismatch}")
 
     print("=" * 60)
 
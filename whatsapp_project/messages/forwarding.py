@@ -0,0 +1,414 @@
+"""
+Forwarding of relevant messages to Telegram through a transactional outbox.
+
+A relevant message gets a TelegramOutbox row in the same transaction as its
+MessageLog, so a crash or a Telegram outage can no longer lose it. Rows are
+delivered at least once: by the web worker's OutboxSweeper thread, which a
+commit wakes right away, or by the dispatch_outbox command when
+TELEGRAM_OUTBOX_ASYNC is set. Failed and rate-limited attempts are retried
+with backoff when the sweeper next finds them due. In digest mode (see
+digest.py) queued rows are sent several to a message. Every process sending
+to a chat paces itself on that chat's TelegramChatRate row, so the configured
+rate holds however many workers there are.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from decouple import config
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .claims import claim_batch
+from .dedup import get_near_duplicate_index, signature_to_bytes
+from .digest import DIGEST_MAX_ITEMS, DIGEST_WINDOW_SECONDS, TELEGRAM_DIGEST, get_digest_buffer, pack_digest
+from .models import MessageLog, TelegramChatRate, TelegramOutbox
+from .telegram import (
+    CHAT_ID, TELEGRAM_CHAT_BURST, TELEGRAM_CHAT_RATE_PER_MINUTE, format_telegram_message, get_async_telegram_client,
+    get_telegram_client,
+)
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_MAX_ATTEMPTS = config('OUTBOX_MAX_ATTEMPTS', default=8, cast=int)
+OUTBOX_MAX_BACKOFF = config('OUTBOX_MAX_BACKOFF', default=600, cast=float)
+# How often a web worker looks for due retries; 0 leaves them to dispatch_outbox
+OUTBOX_SWEEP_SECONDS = config('OUTBOX_SWEEP_SECONDS', default=15.0, cast=float)
+OUTBOX_STALE_SECONDS = config('OUTBOX_STALE_SECONDS', default=300, cast=int)
+
+
+def reserve_chat_slot(chat_id, rate_per_minute: float = TELEGRAM_CHAT_RATE_PER_MINUTE,
+                      burst: int = TELEGRAM_CHAT_BURST) -> float:
+    """
+    Take a send slot from the chat's rate, shared by every worker through its
+    TelegramChatRate row (a generic cell rate algorithm: next_send_at moves one
+    interval per send, and a send is allowed while it is less than a burst ahead).
+    Returns 0 when a slot was taken, else seconds until one frees up.
+    """
+    interval = timedelta(seconds=60 / rate_per_minute)
+    tolerance = interval * max(burst - 1, 0)
+    for _ in range(3):
+        now = timezone.now()
+        scheduled = TelegramChatRate.objects.filter(chat_id=chat_id).values_list('next_send_at', flat=True).first()
+        if scheduled is None:
+            TelegramChatRate.objects.bulk_create([TelegramChatRate(chat_id=chat_id, next_send_at=now)],
+                                                 ignore_conflicts=True)
+            continue
+        wait = (scheduled - tolerance - now).total_seconds()
+        if wait > 0:
+            return wait
+        # Compare-and-set, so two workers can't both take the last slot
+        if TelegramChatRate.objects.filter(chat_id=chat_id, next_send_at=scheduled).update(
+                next_send_at=max(scheduled, now) + interval):
+            return 0.0
+    # Lost every race to other senders: the chat is busy, look again shortly
+    return interval.total_seconds()
+
+
+def forward_opportunity(message_log, signature: tuple = ()) -> TelegramOutbox:
+    """
+    Queue a relevant message for Telegram. Call it inside the transaction that
+    saves message_log; unless a dispatcher owns delivery it is sent after commit.
+    """
+    with transaction.atomic():
+        if signature:
+            message_log.minhash = signature_to_bytes(signature)
+            message_log.save(update_fields=['minhash'])
+        return queue_forwards([(message_log, signature)])[0]
+
+
+def queue_forwards(items: list, deliver: bool = True) -> list:
+    """
+    Bulk-create outbox rows for saved (message_log, signature) pairs, inside the
+    caller's transaction; delivery is dispatched once it commits unless deliver
+    is False (the caller delivers them itself)
+    """
+    if not items:
+        return []
+
+    with transaction.atomic():
+        entries = TelegramOutbox.objects.bulk_create([
+            TelegramOutbox(
+                message_log=message_log,
+                chat_id=CHAT_ID,
+                text=format_telegram_message(message_log.raw_text, message_log.sender_info)
+            )
+            for message_log, _ in items
+        ])
+
+    # Reposts are suppressed as near-duplicates as soon as the original is queued
+    near_duplicates = get_near_duplicate_index()
+    if near_duplicates is not None:
+        signatures = [(message_log.id, signature) for message_log, signature in items if signature]
+        transaction.on_commit(lambda: _index_forwards(near_duplicates, signatures))
+
+    if deliver and not settings.TELEGRAM_OUTBOX_ASYNC:
+        if TELEGRAM_DIGEST:
+            transaction.on_commit(lambda: buffer_digest(entries))
+        elif _outbox_sweeper is not None:
+            # The request only enqueues; the sweeper thread does the sending
+            transaction.on_commit(_outbox_sweeper.wake)
+        else:
+            # No sweeper in this process (a management command): one attempt each, retries left to a sweeper
+            transaction.on_commit(lambda: deliver_now([entry.pk for entry in entries]))
+
+    for message_log, _ in items:
+        logger.info(f"Opportunity queued for Telegram: {message_log.raw_text[:50]}...")
+    return entries
+
+
+def _index_forwards(near_duplicates, signatures: list):
+    for message_id, signature in signatures:
+        near_duplicates.add(message_id, signature)
+
+
+def buffer_digest(entries: list):
+    digest_buffer = get_digest_buffer(deliver_digest_now)
+    for entry in entries:
+        digest_buffer.add(entry.chat_id, entry.pk)
+
+
+def due_entries():
+    return TelegramOutbox.objects.filter(
+        status=TelegramOutbox.PENDING, next_attempt_at__lte=timezone.now()
+    ).order_by('id')
+
+
+def claim_due_entries(limit: int) -> list:
+    """Claim up to limit outbox rows that are due for delivery"""
+    return claim_batch(due_entries(), limit, status=TelegramOutbox.SENDING, claimed_at=timezone.now())
+
+
+def deliver_now(pks: list) -> int:
+    """Deliver freshly queued rows that no dispatcher has taken yet; returns how many were sent"""
+    try:
+        claimed = claim_batch(TelegramOutbox.objects.filter(pk__in=pks, status=TelegramOutbox.PENDING),
+                              len(pks), status=TelegramOutbox.SENDING, claimed_at=timezone.now())
+        return deliver_entries(claimed)
+    except Exception as e:
+        logger.error(f"Failed to send to Telegram: {e}")
+        return 0
+
+
+async def adeliver_now(pks: list) -> int:
+    """
+    deliver_now for the async webhook: chats are served concurrently, each
+    chat's rows in order; returns how many were sent
+    """
+    claimed = await sync_to_async(claim_batch)(
+        TelegramOutbox.objects.filter(pk__in=pks, status=TelegramOutbox.PENDING),
+        len(pks), status=TelegramOutbox.SENDING, claimed_at=timezone.now()
+    )
+    by_chat = {}
+    async for entry in TelegramOutbox.objects.filter(pk__in=claimed).order_by('id'):
+        by_chat.setdefault(entry.chat_id, []).append(entry)
+
+    async def deliver_chat(entries):
+        return sum([await adeliver_entry(entry) for entry in entries])
+
+    return sum(await asyncio.gather(*(deliver_chat(entries) for entries in by_chat.values())))
+
+
+async def adeliver_entry(entry: TelegramOutbox) -> bool:
+    """deliver_entry for async callers"""
+    client = get_async_telegram_client()
+
+    wait = await sync_to_async(reserve_chat_slot)(entry.chat_id)
+    if wait:
+        await sync_to_async(release_entries)([entry], retry_in=wait)
+        return False
+
+    started = time.monotonic()
+    result = await client.post_message(entry.chat_id, entry.text)
+    latency_ms = round((time.monotonic() - started) * 1000, 1)
+    return await sync_to_async(record_attempt)(entry, result, latency_ms)
+
+
+def deliver_entries(pks: list) -> int:
+    """Attempt delivery of claimed outbox rows in order; returns how many were sent"""
+    return sum(
+        1 for entry in TelegramOutbox.objects.filter(pk__in=pks).order_by('id')
+        if deliver_entry(entry)
+    )
+
+
+def deliver_entry(entry: TelegramOutbox) -> bool:
+    """Make one delivery attempt for a claimed outbox row and record how it went"""
+    client = get_telegram_client()
+
+    wait = reserve_chat_slot(entry.chat_id)
+    if wait:
+        # Chat is at its send rate: schedule the row for when it has a slot, without using an attempt
+        release_entries([entry], retry_in=wait)
+        return False
+
+    started = time.monotonic()
+    result = client.post_message(entry.chat_id, entry.text)
+    latency_ms = round((time.monotonic() - started) * 1000, 1)
+    return record_attempt(entry, result, latency_ms)
+
+
+def deliver_digest(entries: list) -> int:
+    """Send claimed outbox rows for one chat as digest messages; returns how many were sent"""
+    client = get_telegram_client()
+    sent = 0
+    groups = pack_digest(entries)
+
+    for index, (texts, group_entries) in enumerate(groups):
+        for text in texts:
+            wait = reserve_chat_slot(group_entries[0].chat_id)
+            if wait:
+                release_entries([entry for _, later in groups[index:] for entry in later], retry_in=wait)
+                return sent
+
+            started = time.monotonic()
+            result = client.post_message(group_entries[0].chat_id, text)
+            latency_ms = round((time.monotonic() - started) * 1000, 1)
+            if not result["ok"]:
+                # This group and everything after it is retried later
+                for _, later in groups[index:]:
+                    for entry in later:
+                        record_attempt(entry, result, latency_ms)
+                return sent
+
+        for entry in group_entries:
+            record_attempt(entry, result, latency_ms)
+        sent += len(group_entries)
+        logger.info(f"Digest of {len(group_entries)} opportunities sent to Telegram")
+
+    return sent
+
+
+def deliver_digest_now(pks: list) -> int:
+    """Flush a digest buffer: claim its rows that are still queued and send them per chat"""
+    try:
+        claimed = claim_batch(TelegramOutbox.objects.filter(pk__in=pks, status=TelegramOutbox.PENDING),
+                              len(pks), status=TelegramOutbox.SENDING, claimed_at=timezone.now())
+        return deliver_claimed(claimed, digest=True)
+    finally:
+        # Flushes run on timer threads, which must not keep their own connection open
+        connection.close()
+
+
+def deliver_claimed(pks: list, digest: bool = TELEGRAM_DIGEST) -> int:
+    """Deliver claimed rows one by one, or as one digest per chat; returns how many were sent"""
+    if not digest:
+        return deliver_entries(pks)
+    by_chat = {}
+    for entry in TelegramOutbox.objects.filter(pk__in=pks).order_by('id'):
+        by_chat.setdefault(entry.chat_id, []).append(entry)
+    return sum(deliver_digest(entries) for entries in by_chat.values())
+
+
+def digest_ready(window_seconds: float, max_items: int) -> bool:
+    """Whether the due rows are enough, or old enough, to be worth a digest"""
+    due = due_entries()
+    oldest = due.values_list('created_at', flat=True).first()
+    if oldest is None:
+        return False
+    return (timezone.now() - oldest).total_seconds() >= window_seconds or due.count() >= max_items
+
+
+def release_entries(entries: list, retry_in: float = 0):
+    """Hand claimed rows back to the queue, due again in retry_in seconds, without using an attempt"""
+    TelegramOutbox.objects.filter(pk__in=[entry.pk for entry in entries]).update(
+        status=TelegramOutbox.PENDING, claimed_at=None,
+        next_attempt_at=timezone.now() + timedelta(seconds=min(retry_in, OUTBOX_MAX_BACKOFF))
+    )
+
+
+def record_attempt(entry: TelegramOutbox, result: dict, latency_ms: float) -> bool:
+    """Store the outcome of a sendMessage attempt on an outbox row and schedule any retry"""
+    client = get_telegram_client()
+    now = timezone.now()
+    entry.claimed_at = None
+    entry.attempts += 1
+    entry.attempt_log = entry.attempt_log + [{
+        "at": now.isoformat(),
+        "status": result["status"],
+        "latency_ms": latency_ms,
+        "error": result["error"][:200]
+    }]
+
+    if result["ok"]:
+        entry.status = TelegramOutbox.SENT
+        entry.sent_at = now
+        entry.last_error = ''
+        entry.save(update_fields=['status', 'sent_at', 'last_error', 'attempts', 'attempt_log', 'claimed_at'])
+        if entry.message_log_id:
+            MessageLog.objects.filter(pk=entry.message_log_id).update(forwarded_to_telegram=True)
+        logger.info(f"Message sent to Telegram successfully ({latency_ms}ms, attempt {entry.attempts})")
+        return True
+
+    entry.last_error = result["error"][:500]
+    if not client.is_retryable(result) or entry.attempts >= OUTBOX_MAX_ATTEMPTS:
+        logger.error(f"Giving up on Telegram delivery #{entry.pk} after {entry.attempts} attempts: "
+                     f"{result['status']} - {result['error'][:200]}")
+        entry.status = TelegramOutbox.FAILED
+    else:
+        delay = client.backoff_delay(entry.attempts, result, cap=OUTBOX_MAX_BACKOFF)
+        logger.warning(f"Telegram delivery #{entry.pk} failed ({result['status']}), retrying in {delay:.0f}s")
+        entry.status = TelegramOutbox.PENDING
+        entry.next_attempt_at = now + timedelta(seconds=delay)
+    entry.save(update_fields=['status', 'next_attempt_at', 'last_error', 'attempts', 'attempt_log', 'claimed_at'])
+    return False
+
+
+def requeue_stale_entries(stale_after: int) -> int:
+    """Hand rows claimed by a dispatcher that died mid-send back to the queue"""
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    return TelegramOutbox.objects.filter(
+        status=TelegramOutbox.SENDING, claimed_at__lt=cutoff
+    ).update(status=TelegramOutbox.PENDING, claimed_at=None)
+
+
+class OutboxSweeper:
+    """
+    Background thread of a web worker that delivers due outbox rows: fresh
+    forwards as soon as a commit wakes it, and retries whenever their backoff
+    has run out, checking every `interval` seconds. Claims keep the sweepers
+    of several workers (and any dispatch_outbox) from sending a row twice.
+    """
+
+    def __init__(self, interval: float = OUTBOX_SWEEP_SECONDS, batch_size: int = 20,
+                 stale_after: int = OUTBOX_STALE_SECONDS, digest: bool = TELEGRAM_DIGEST):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.stale_after = stale_after
+        self.digest = digest
+        self._wake = threading.Event()
+        self._thread = None
+        self.sweeps = 0
+        self.sent = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='outbox-sweeper', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.sent += self.sweep()
+            except Exception as e:
+                logger.error(f"❌ Outbox sweep failed: {e}")
+            finally:
+                # Don't hold a connection open between sweeps
+                connection.close()
+
+    def sweep(self) -> int:
+        """Deliver everything currently due; returns how many were sent"""
+        self.sweeps += 1
+        requeue_stale_entries(self.stale_after)
+        sent = 0
+        while not self.digest or digest_ready(DIGEST_WINDOW_SECONDS, DIGEST_MAX_ITEMS):
+            claimed = claim_due_entries(max(self.batch_size, DIGEST_MAX_ITEMS) if self.digest else self.batch_size)
+            if not claimed:
+                break
+            delivered = deliver_claimed(claimed, digest=self.digest)
+            sent += delivered
+            # Nothing went out: the rows are rescheduled, so stop until they're due
+            if not delivered:
+                break
+        return sent
+
+
+_outbox_sweeper = None
+_outbox_sweeper_lock = threading.Lock()
+
+
+def start_outbox_sweeper():
+    """
+    Start this worker's OutboxSweeper (from wsgi.py / asgi.py), unless
+    dispatch_outbox owns delivery or sweeping is disabled
+    """
+    global _outbox_sweeper
+    if settings.TELEGRAM_OUTBOX_ASYNC or OUTBOX_SWEEP_SECONDS <= 0:
+        return None
+    if _outbox_sweeper is None:
+        with _outbox_sweeper_lock:
+            if _outbox_sweeper is None:
+                sweeper = OutboxSweeper()
+                sweeper.start()
+                _outbox_sweeper = sweeper
+    return _outbox_sweeper
+
+
+def _restart_sweeper_in_child():
+    # A forked worker (gunicorn --preload) inherits the sweeper but not its thread
+    global _outbox_sweeper
+    if _outbox_sweeper is not None:
+        _outbox_sweeper = None
+        start_outbox_sweeper()
+
+
+os.register_at_fork(after_in_child=_restart_sweeper_in_child)
@@ -0,0 +1,415 @@
+"""
+Ingestion of messages.upsert payloads in three stages: extract the messages,
+classify them, then persist every row with one bulk insert in a single
+transaction. A history-sync upsert with hundreds of messages costs a handful
+of queries instead of one or two per message; Telegram delivery starts after
+commit. Gateway redeliveries are dropped by WhatsApp message id before any of
+that work is done, and bodies too large to decode at once are streamed in
+fixed-size chunks. With WEBHOOK_INGEST_QUEUE the stages run on the worker
+threads of work_queue.py instead of in the request.
+"""
+import asyncio
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from cachetools import TTLCache
+from decouple import config
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .dedup import NearDuplicateIndex, get_near_duplicate_index, minhash_signature, signature_to_bytes
+from .events import UPSERT_EVENT, sniff_event_type
+from .digest import TELEGRAM_DIGEST
+from .filter import aclassify_message, classify_message_batch, complete_verdict
+from .forwarding import adeliver_now, buffer_digest, queue_forwards
+from .metrics import metric_key, register_collector, timed
+from .models import MessageLog, TelegramOutbox
+from .streaming import StreamingJSONArray
+from .work_queue import get_ingest_queue
+
+logger = logging.getLogger(__name__)
+
+# Message keys stored recently by this worker, so retry storms rarely reach the database
+RECENT_MESSAGE_IDS_SIZE = config('RECENT_MESSAGE_IDS_SIZE', default=10000, cast=int)
+RECENT_MESSAGE_IDS_TTL = config('RECENT_MESSAGE_IDS_TTL', default=3600, cast=int)
+
+# Large bodies are ingested from the request stream this many messages at a time
+STREAM_CHUNK_MESSAGES = config('STREAM_CHUNK_MESSAGES', default=200, cast=int)
+EVENT_PATH = ('data', 'event')
+
+_recent_message_ids = TTLCache(maxsize=RECENT_MESSAGE_IDS_SIZE, ttl=RECENT_MESSAGE_IDS_TTL)
+_recent_message_ids_lock = threading.Lock()
+_ingest_counters = {"received": 0, "redelivered_memory": 0, "redelivered_db": 0, "stored": 0, "shed": 0}
+
+
+def extract_messages(messages: list) -> list:
+    """Stage 1: text and essential sender info of every message with text in an upsert"""
+    extracted = []
+
+    for msg_data in messages:
+        # Extract message text
+        message_text = ""
+        if 'message' in msg_data:
+            msg_obj = msg_data['message']
+
+            if 'conversation' in msg_obj:
+                message_text = msg_obj['conversation']
+            elif 'extendedTextMessage' in msg_obj:
+                message_text = msg_obj['extendedTextMessage'].get('text', '')
+            elif 'imageMessage' in msg_obj:
+                message_text = msg_obj['imageMessage'].get('caption', '')
+            elif 'videoMessage' in msg_obj:
+                message_text = msg_obj['videoMessage'].get('caption', '')
+
+        # Extract only essential sender info (name and contact)
+        sender_info = {}
+
+        # Get sender name
+        if 'pushName' in msg_data:
+            sender_info['name'] = msg_data['pushName']
+
+        key = msg_data.get('key', {})
+
+        # Get contact number
+        if 'key' in msg_data and 'remoteJid' in msg_data['key']:
+            remote_jid = msg_data['key']['remoteJid']
+            if '@g.us' in remote_jid:
+                # Group message - try to get participant
+                if 'participant' in msg_data.get('key', {}):
+                    sender_info['participant'] = msg_data['key']['participant']
+            else:
+                # Direct message
+                sender_info['number'] = remote_jid
+
+        # Process the message if we found text
+        if message_text.strip():
+            extracted.append({
+                "text": message_text,
+                "sender_info": sender_info,
+                "message_id": key.get('id') or '',
+                "remote_jid": key.get('remoteJid') or ''
+            })
+
+    return extracted
+
+
+def message_key(item: dict):
+    """(remote_jid, message id) of an extracted message, or None when the gateway sent no id"""
+    return (item['remote_jid'], item['message_id']) if item['message_id'] else None
+
+
+def drop_seen_messages(extracted: list) -> list:
+    """
+    Drop messages already stored (gateway redeliveries) and repeats within the
+    batch: the worker's recent-ids cache first, then one query for the rest
+    """
+    fresh, batch_keys = _drop_recent(extracted)
+    if not batch_keys:
+        return fresh
+    return _drop_stored(fresh, batch_keys, set(_stored_keys(batch_keys)))
+
+
+async def adrop_seen_messages(extracted: list) -> list:
+    """drop_seen_messages for async callers, querying with the async ORM"""
+    fresh, batch_keys = _drop_recent(extracted)
+    if not batch_keys:
+        return fresh
+    return _drop_stored(fresh, batch_keys, {key async for key in _stored_keys(batch_keys)})
+
+
+def _drop_recent(extracted: list) -> tuple:
+    fresh = []
+    batch_keys = set()
+    with _recent_message_ids_lock:
+        _ingest_counters["received"] += len(extracted)
+        for item in extracted:
+            key = message_key(item)
+            if key is not None:
+                if key in batch_keys or key in _recent_message_ids:
+                    _ingest_counters["redelivered_memory"] += 1
+                    continue
+                batch_keys.add(key)
+            fresh.append(item)
+    return fresh, batch_keys
+
+
+def _stored_keys(batch_keys: set):
+    return (
+        MessageLog.objects
+        .filter(wa_message_id__in={message_id for _, message_id in batch_keys})
+        .values_list('remote_jid', 'wa_message_id')
+    )
+
+
+def _drop_stored(fresh: list, batch_keys: set, stored: set) -> list:
+    if not stored:
+        return fresh
+
+    with _recent_message_ids_lock:
+        _ingest_counters["redelivered_db"] += len(stored & batch_keys)
+        for key in stored:
+            _recent_message_ids[key] = True
+    return [item for item in fresh if message_key(item) not in stored]
+
+
+def remember_messages(logs: list):
+    """Mark stored messages as seen in this worker's recent-ids cache"""
+    with _recent_message_ids_lock:
+        _ingest_counters["stored"] += len(logs)
+        for log in logs:
+            if log.wa_message_id:
+                _recent_message_ids[(log.remote_jid, log.wa_message_id)] = True
+
+
+def ingest_stats() -> dict:
+    """Message counters and size of the recent-ids cache for this worker"""
+    with _recent_message_ids_lock:
+        return {**_ingest_counters, "recent_ids": len(_recent_message_ids)}
+
+
+def _metrics_collector() -> dict:
+    stats = ingest_stats()
+    return {
+        "counters": {metric_key('ingest_messages_total', outcome=outcome): count
+                     for outcome, count in stats.items() if outcome != 'recent_ids'},
+        "gauges": {metric_key('ingest_recent_ids'): stats['recent_ids']},
+    }
+
+
+register_collector(_metrics_collector)
+
+
+def classify_messages(extracted: list, verdicts: dict = None) -> list:
+    """
+    Stage 2: classify messages and build their unsaved log rows. Each plan is
+    {"log", "signature", "forward", "duplicate_of"}, where duplicate_of is the
+    position of an earlier message of the same batch that this one repeats.
+    verdicts maps message text to a classification obtained beforehand.
+    """
+    near_duplicates = get_near_duplicate_index()
+    # Reposts inside one upsert can't be found in the shared index before it commits
+    batch_index = NearDuplicateIndex() if near_duplicates is not None else None
+    plans = []
+
+    signatures = [
+        minhash_signature(item['text']) if near_duplicates is not None else () for item in extracted
+    ]
+    original_ids = [
+        near_duplicates.find(signature) if near_duplicates is not None else None for signature in signatures
+    ]
+
+    # Everything not already known as a repost runs through the rules and the local model as one
+    # batch; Gemini is only asked below, about messages that turn out not to repeat this batch
+    verdicts = dict(verdicts or {})
+    texts = list(dict.fromkeys(
+        item['text'] for item, original_id in zip(extracted, original_ids)
+        if not original_id and item['text'] not in verdicts
+    ))
+    verdicts.update(zip(texts, classify_message_batch(texts, defer_gemini=True)))
+
+    for item, signature, original_id in zip(extracted, signatures, original_ids):
+        message_text = item['text']
+
+        # Reposts of an already forwarded opportunity skip the classifier and Telegram
+        batch_original = batch_index.find(signature) if batch_index is not None and not original_id else None
+        if original_id or batch_original is not None:
+            plans.append({
+                "log": MessageLog(
+                    raw_text=message_text,
+                    is_relevant=True,
+                    forwarded_to_telegram=False,
+                    sender_info=item['sender_info'],
+                    classification_rule='near_duplicate',
+                    duplicate_of_id=original_id,
+                    wa_message_id=item['message_id'],
+                    remote_jid=item['remote_jid']
+                ),
+                "signature": (),
+                "forward": False,
+                "duplicate_of": batch_original
+            })
+            logger.info(f"Near-duplicate of message #{original_id or 'in this batch'}, not forwarded: {message_text[:50]}...")
+            continue
+
+        # With GEMINI_ASYNC borderline messages are left for the background workers
+        classification = verdicts[message_text]
+        if not settings.GEMINI_ASYNC:
+            classification = verdicts[message_text] = complete_verdict(message_text, classification)
+        is_relevant = bool(classification['is_job'])
+        is_pending = classification['rule'] == 'gemini_pending'
+
+        log = MessageLog(
+            raw_text=message_text,
+            is_relevant=is_relevant,
+            forwarded_to_telegram=False,
+            sender_info=item['sender_info'],
+            classification_rule=classification['rule'],
+            rules_version=classification.get('rules_version', ''),
+            classification_status=MessageLog.PENDING if is_pending else MessageLog.CLASSIFIED,
+            wa_message_id=item['message_id'],
+            remote_jid=item['remote_jid']
+        )
+        if is_relevant and signature:
+            log.minhash = signature_to_bytes(signature)
+            batch_index.add(len(plans), signature)
+
+        plans.append({"log": log, "signature": signature, "forward": is_relevant, "duplicate_of": None})
+
+    return plans
+
+
+def persist_messages(plans: list, deliver: bool = True) -> list:
+    """
+    Stage 3: insert all rows and queue the relevant ones for Telegram in one
+    transaction; with deliver=False the caller delivers the queued rows itself
+    """
+    if not plans:
+        return []
+
+    with transaction.atomic():
+        logs = MessageLog.objects.bulk_create([plan['log'] for plan in plans])
+
+        # Rows repeating an earlier message of the batch can only point at it once it has an id
+        linked = []
+        for plan in plans:
+            if plan['duplicate_of'] is not None:
+                plan['log'].duplicate_of = plans[plan['duplicate_of']]['log']
+                linked.append(plan['log'])
+        if linked:
+            MessageLog.objects.bulk_update(linked, ['duplicate_of'])
+
+        queue_forwards([(plan['log'], plan['signature']) for plan in plans if plan['forward']], deliver=deliver)
+        transaction.on_commit(lambda: remember_messages(logs))
+
+    return logs
+
+
+def ingest_messages(webhook_data: dict) -> list:
+    """Run a parsed messages.upsert payload through the ingest stages"""
+    return ingest_message_list(webhook_data.get('data', {}).get('data', {}).get('messages', []))
+
+
+def ingest_message_list(messages: list) -> list:
+    """Extract, skip redeliveries, classify and persist a list of gateway messages"""
+    with timed('webhook_stage_seconds', stage='extract'):
+        extracted = extract_messages(messages)
+    with timed('webhook_stage_seconds', stage='dedup'):
+        fresh = drop_seen_messages(extracted)
+    return classify_and_persist(fresh)
+
+
+def shed_messages(messages: list) -> int:
+    """
+    Store a batch unclassified (status QUEUED) in one insert, for
+    process_pending_messages to classify later; redeliveries are left to the
+    unique constraint. Returns the number of messages in the batch.
+    """
+    extracted = extract_messages(messages)
+    MessageLog.objects.bulk_create([
+        MessageLog(
+            raw_text=item['text'],
+            sender_info=item['sender_info'],
+            classification_status=MessageLog.QUEUED,
+            wa_message_id=item['message_id'],
+            remote_jid=item['remote_jid']
+        )
+        for item in extracted
+    ], ignore_conflicts=True)
+    with _recent_message_ids_lock:
+        _ingest_counters["shed"] += len(extracted)
+    return len(extracted)
+
+
+def enqueue_messages(webhook_data: dict) -> bool:
+    """
+    Hand an upsert to the worker's ingest queue, or shed it when the queue is
+    full; True if it was queued
+    """
+    messages = webhook_data.get('data', {}).get('data', {}).get('messages', [])
+    if get_ingest_queue(ingest_message_list, shed_messages).submit(messages):
+        return True
+    logger.warning(f"⚠️ Ingest queue full, storing {len(messages)} messages for background classification")
+    shed_messages(messages)
+    return False
+
+
+def classify_and_persist(extracted: list, verdicts: dict = None, deliver: bool = True) -> list:
+    """Stages 2 and 3 for messages already checked against stored ids"""
+    try:
+        with timed('webhook_stage_seconds', stage='classify'):
+            plans = classify_messages(extracted, verdicts)
+        with timed('webhook_stage_seconds', stage='persist'):
+            return persist_messages(plans, deliver)
+    except IntegrityError:
+        # A concurrent redelivery stored some of these first; redo the batch without them
+        logger.info("Concurrent redelivery detected, storing only unseen messages")
+        return persist_messages(classify_messages(drop_seen_messages(extracted), verdicts), deliver)
+
+
+async def aingest_messages(webhook_data: dict, timeout: float = None) -> int:
+    """
+    ingest_messages for the async webhook: Gemini calls for the batch's
+    borderline messages and the Telegram sends run concurrently.
+    Returns the number of messages stored.
+    """
+    messages = webhook_data.get('data', {}).get('data', {}).get('messages', [])
+    extracted = await adrop_seen_messages(extract_messages(messages))
+    if not extracted:
+        return 0
+
+    # Classify each distinct text up front so Gemini is awaited, never called in a blocking thread;
+    # reposts of forwarded messages are skipped as near-duplicates and need no verdict
+    verdicts = None
+    if not settings.GEMINI_ASYNC:
+        near_duplicates = await sync_to_async(get_near_duplicate_index)()
+        texts = [
+            text for text in dict.fromkeys(item['text'] for item in extracted)
+            if near_duplicates is None or not near_duplicates.find(minhash_signature(text))
+        ]
+        results = await asyncio.gather(*(aclassify_message(text, timeout) for text in texts))
+        verdicts = dict(zip(texts, results))
+
+    logs = await sync_to_async(classify_and_persist)(extracted, verdicts, deliver=False)
+
+    if logs and not settings.TELEGRAM_OUTBOX_ASYNC:
+        entries = [
+            entry async for entry in
+            TelegramOutbox.objects.filter(message_log__in=logs, status=TelegramOutbox.PENDING).order_by('id')
+        ]
+        if TELEGRAM_DIGEST:
+            await sync_to_async(buffer_digest)(entries)
+        elif entries:
+            await adeliver_now([entry.pk for entry in entries])
+    return len(logs)
+
+
+def ingest_stream(stream, chunk_size: int = STREAM_CHUNK_MESSAGES) -> tuple:
+    """
+    Ingest a webhook body straight from its stream, chunk_size messages per
+    transaction, so peak memory doesn't grow with the payload.
+    Returns (event type, number of messages stored).
+    """
+    reader = StreamingJSONArray(stream, ('data', 'data', 'messages'))
+    # The gateway may serialize "event" after "data"; its first block usually names the event anyway
+    sniffed_event = sniff_event_type(reader.head())
+    chunk = []
+    stored = 0
+
+    for message in reader:
+        event_type = reader.values.get(EVENT_PATH, sniffed_event)
+        if event_type is not None and event_type != UPSERT_EVENT:
+            return event_type, 0
+        chunk.append(message)
+        if len(chunk) >= chunk_size:
+            # Holding messages until the event type turns up would buffer the whole body
+            if event_type is None:
+                raise ValueError(f"No event type in the first {reader.bytes_read} bytes of a streamed body")
+            stored += len(ingest_message_list(chunk))
+            chunk = []
+
+    event_type = reader.values.get(EVENT_PATH, sniffed_event)
+    if event_type == UPSERT_EVENT and chunk:
+        stored += len(ingest_message_list(chunk))
+    logger.info(f"Streamed {reader.bytes_read} bytes, stored {stored} messages")
+    return event_type, stored
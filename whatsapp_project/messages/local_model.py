@@ -0,0 +1,187 @@
+"""
+Local classifier for borderline messages, consulted before Gemini.
+
+Messages become hashed word and character n-grams, and a logistic regression
+over those features is stored as a single NumPy weight vector. It is trained
+offline by `python manage.py train_local_classifier`, from labelled MessageLog
+rows and the classifier test cases, into a compressed .npz artifact. Only
+predictions between the reject and accept thresholds escalate to Gemini.
+
+NumPy is optional: without it, or without an artifact, every borderline
+message goes to Gemini as before.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+
+from decouple import config
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+LOCAL_MODEL_ENABLED = config('LOCAL_MODEL_ENABLED', default=True, cast=bool)
+LOCAL_MODEL_PATH = config('LOCAL_MODEL_PATH', default=os.path.join(os.path.dirname(__file__), 'local_model.npz'))
+# Probabilities at or above accept are job requirements, at or below reject are not; the rest ask Gemini
+LOCAL_MODEL_ACCEPT = config('LOCAL_MODEL_ACCEPT', default=0.9, cast=float)
+LOCAL_MODEL_REJECT = config('LOCAL_MODEL_REJECT', default=0.1, cast=float)
+
+FEATURE_BITS = 16
+CHAR_NGRAM = 4
+WORD_PATTERN = re.compile(r'[a-z0-9@+#.]+')
+
+
+def ngram_features(message: str, bits: int = FEATURE_BITS) -> list:
+    """Distinct hashed feature indices: words, word bigrams and character 4-grams of each word"""
+    words = WORD_PATTERN.findall(message.lower())
+    grams = set(words)
+    grams.update(f"{first} {second}" for first, second in zip(words, words[1:]))
+    for word in words:
+        padded = f"<{word}>"
+        grams.update(f"#{padded[start:start + CHAR_NGRAM]}" for start in range(max(1, len(padded) - CHAR_NGRAM + 1)))
+    mask = (1 << bits) - 1
+    return sorted({zlib.crc32(gram.encode('utf-8')) & mask for gram in grams})
+
+
+def feature_matrix(messages: list, bits: int = FEATURE_BITS) -> tuple:
+    """
+    Sparse rows as flat arrays (row of each entry, feature index, value); each
+    message's values are scaled to unit length
+    """
+    rows, columns, values = [], [], []
+    for row, message in enumerate(messages):
+        features = ngram_features(message, bits)
+        rows.extend([row] * len(features))
+        columns.extend(features)
+        values.extend([1.0 / max(1, len(features)) ** 0.5] * len(features))
+    return (np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64),
+            np.asarray(values, dtype=np.float32))
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class LocalClassifier:
+    """Logistic regression over hashed n-grams"""
+
+    def __init__(self, weights, bias: float, bits: int = FEATURE_BITS, version: str = ''):
+        self.weights = weights
+        self.bias = float(bias)
+        self.bits = bits
+        self.version = version
+
+    def _logits(self, matrix: tuple, count: int):
+        rows, columns, values = matrix
+        return np.bincount(rows, weights=self.weights[columns] * values, minlength=count) + self.bias
+
+    def predict_proba(self, messages: list):
+        """Probability that each message is a job requirement, scored as one batch"""
+        if not messages:
+            return np.zeros(0)
+        return _sigmoid(self._logits(feature_matrix(messages, self.bits), len(messages)))
+
+    @classmethod
+    def train(cls, messages: list, labels: list, epochs: int = 300, learning_rate: float = 2.0,
+              l2: float = 1e-4, bits: int = FEATURE_BITS) -> 'LocalClassifier':
+        """Full-batch gradient descent, classes weighted so the rarer one isn't ignored"""
+        targets = np.asarray(labels, dtype=np.float64)
+        positives = targets.sum()
+        sample_weights = np.where(
+            targets == 1, len(targets) / (2 * max(positives, 1)), len(targets) / (2 * max(len(targets) - positives, 1))
+        )
+        matrix = feature_matrix(messages, bits)
+        rows, columns, values = matrix
+        model = cls(np.zeros(1 << bits), 0.0, bits, version=time.strftime('%Y%m%d%H%M%S'))
+
+        for _ in range(epochs):
+            errors = (_sigmoid(model._logits(matrix, len(messages))) - targets) * sample_weights / len(messages)
+            gradient = np.bincount(columns, weights=errors[rows] * values, minlength=1 << bits)
+            model.weights -= learning_rate * (gradient + l2 * model.weights)
+            model.bias -= learning_rate * errors.sum()
+
+        model.weights = model.weights.astype(np.float32)
+        return model
+
+    def save(self, path: str):
+        np.savez_compressed(path, weights=self.weights.astype(np.float32), bias=np.float32(self.bias),
+                            bits=np.int32(self.bits), version=np.str_(self.version))
+
+    @classmethod
+    def load(cls, path: str) -> 'LocalClassifier':
+        with np.load(path) as artifact:
+            return cls(artifact['weights'], float(artifact['bias']), int(artifact['bits']), str(artifact['version']))
+
+
+def evaluate(model: LocalClassifier, messages: list, labels: list,
+             accept: float = LOCAL_MODEL_ACCEPT, reject: float = LOCAL_MODEL_REJECT) -> dict:
+    """Accuracy of plain predictions, and how many would be decided without Gemini at the thresholds"""
+    probabilities = model.predict_proba(messages)
+    targets = np.asarray(labels, dtype=bool)
+    predicted = probabilities >= 0.5
+    decided = (probabilities >= accept) | (probabilities <= reject)
+    true_positives = int((predicted & targets).sum())
+    return {
+        "samples": len(messages),
+        "accuracy": float((predicted == targets).mean()) if len(messages) else 0.0,
+        "precision": true_positives / max(1, int(predicted.sum())),
+        "recall": true_positives / max(1, int(targets.sum())),
+        "coverage": float(decided.mean()) if len(messages) else 0.0,
+        "decided_accuracy": float((predicted == targets)[decided].mean()) if decided.any() else 0.0,
+    }
+
+
+_local_classifier = None
+_local_classifier_lock = threading.Lock()
+
+
+def get_local_classifier():
+    """The worker's trained classifier, or None when disabled, NumPy is missing or nothing was trained"""
+    global _local_classifier
+    if _local_classifier is None:
+        with _local_classifier_lock:
+            if _local_classifier is None:
+                _local_classifier = False
+                if LOCAL_MODEL_ENABLED and np is not None and os.path.exists(LOCAL_MODEL_PATH):
+                    try:
+                        _local_classifier = LocalClassifier.load(LOCAL_MODEL_PATH)
+                        logger.info(f"✅ Local classifier {_local_classifier.version} loaded from {LOCAL_MODEL_PATH}")
+                    except Exception as e:
+                        logger.error(f"❌ Could not load local classifier: {e}")
+    return _local_classifier or None
+
+
+def local_model_version() -> str:
+    """Version of the loaded classifier ('' without one); verdicts it decided are cached under it"""
+    model = get_local_classifier()
+    return model.version if model is not None else ''
+
+
+def local_verdicts(messages: list) -> list:
+    """
+    local_verdict for a batch, scored with a single predict_proba call:
+    one (is_job, probability) pair per message
+    """
+    model = get_local_classifier()
+    if model is None:
+        return [(None, None)] * len(messages)
+    verdicts = []
+    for probability in model.predict_proba(messages).tolist():
+        if probability >= LOCAL_MODEL_ACCEPT:
+            verdicts.append((True, probability))
+        elif probability <= LOCAL_MODEL_REJECT:
+            verdicts.append((False, probability))
+        else:
+            verdicts.append((None, probability))
+    return verdicts
+
+
+def local_verdict(message: str):
+    """(is_job, probability) when the local classifier is confident, otherwise (None, probability or None)"""
+    return local_verdicts([message])[0]
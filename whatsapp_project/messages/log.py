@@ -0,0 +1,174 @@
+"""
+Logging that stays off the request path.
+
+Request threads only put records on a bounded queue (QueueListenerHandler);
+one listener thread formats them and does the file and console I/O. When the
+queue is full, records are dropped and counted rather than making a request
+wait on the disk. RateLimitFilter caps how often any single log call site
+can emit, so the per-message lines of a traffic burst collapse into a few
+records carrying the number suppressed. Payload dumps are sampled and
+truncated by log_payload.
+"""
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from logging.config import ConvertingList
+from logging.handlers import QueueHandler, QueueListener
+
+from .metrics import metric_key, register_collector
+
+# Attributes every LogRecord has; anything else on a record came from `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_counters = {"dropped": 0, "suppressed": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(name: str, amount: int = 1):
+    with _counters_lock:
+        _counters[name] += amount
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, call site and any `extra` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "where": f"{record.module}:{record.lineno}",
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    At most `rate` records per `per` seconds from each call site (logger, line);
+    WARNING and above always pass. The next record let through from a throttled
+    site carries `suppressed`, the number dropped in between.
+    """
+
+    def __init__(self, rate: int = 20, per: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self._windows = {}  # (logger, line) -> [window start, records in window, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        site = (record.name, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(site)
+            if window is None or now - window[0] >= self.per:
+                suppressed = window[2] if window else 0
+                self._windows[site] = [now, 1, 0]
+            elif window[1] < self.rate:
+                window[1] += 1
+                suppressed = window[2]
+                window[2] = 0
+            else:
+                window[2] += 1
+                _count("suppressed")
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+def _resolve_handlers(handlers) -> list:
+    # dictConfig hands over a ConvertingList; indexing it turns 'cfg://handlers.x' into the handler
+    if isinstance(handlers, ConvertingList):
+        return [handlers[index] for index in range(len(handlers))]
+    return list(handlers)
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    QueueHandler that owns the QueueListener feeding `handlers` (Python 3.11's
+    dictConfig can't attach a listener itself). The queue holds at most
+    `maxsize` records; past that, records are dropped instead of blocking.
+    """
+
+    def __init__(self, handlers, maxsize: int = 10000, respect_handler_level: bool = True):
+        super().__init__(queue.Queue(maxsize))
+        self._handlers = _resolve_handlers(handlers)
+        self._respect_handler_level = respect_handler_level
+        self._listener = None
+        self.start()
+        # A forked worker inherits the queue but not the listener thread
+        os.register_at_fork(after_in_child=self._restart_in_child)
+
+    def start(self):
+        self._listener = QueueListener(self.queue, *self._handlers,
+                                       respect_handler_level=self._respect_handler_level)
+        self._listener.start()
+
+    def stop(self):
+        """Flush queued records and stop the listener thread"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def close(self):
+        # logging.shutdown() closes this before the handlers it feeds, so they receive everything queued
+        self.stop()
+        super().close()
+
+    def _restart_in_child(self):
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.start()
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _count("dropped")
+
+
+def log_payload(logger: logging.Logger, body: bytes, headers: dict = None,
+                sample_rate: float = 0.01, max_chars: int = 2048):
+    """
+    Log a sampled, truncated copy of a webhook body (and its headers at DEBUG);
+    most requests skip the formatting entirely
+    """
+    if not logger.isEnabledFor(logging.INFO) or random.random() >= sample_rate:
+        return
+    # Only the kept prefix is decoded, so a history sync never gets copied whole
+    truncated = len(body) > max_chars
+    text = body[:max_chars].decode('utf-8', errors='replace') if isinstance(body, bytes) else str(body)[:max_chars]
+    logger.info(
+        f"Webhook payload sample ({len(body)} bytes): {text}{'…' if truncated else ''}",
+        extra={"payload_bytes": len(body), "payload_truncated": truncated}
+    )
+    if headers is not None and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Webhook headers: {dict(headers)}")
+
+
+def logging_stats() -> dict:
+    with _counters_lock:
+        return dict(_counters)
+
+
+def _metrics_collector() -> dict:
+    return {"counters": {metric_key('log_records_discarded_total', reason=reason): count
+                         for reason, count in logging_stats().items()}}
+
+
+register_collector(_metrics_collector)
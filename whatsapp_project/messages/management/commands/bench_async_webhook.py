@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory, RequestFactory
+
+from messages.filter import clear_classification_cache, message_fingerprint
+from messages.models import GeminiVerdict, MessageLog
+from messages.stubs import StubGeminiModel, StubTelegramServer, stubbed_services
+from messages.views import whatsapp_webhook, whatsapp_webhook_async
+
+NEUTRAL_WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel',
+                 'juliet', 'kilo', 'lima', 'mike', 'oscar', 'papa', 'quebec', 'romeo']
+
+
+def borderline_payload(run_id: str, number: int, rng: random.Random) -> bytes:
+    """A one-message upsert that passes the rules and needs Gemini, then Telegram"""
+    words = ' '.join(rng.choice(NEUTRAL_WORDS) for _ in range(6))
+    return json.dumps({"data": {"event": "messages.upsert", "data": {"messages": [{
+        "key": {"remoteJid": "120363000000000000@g.us", "participant": f"91987650{number:04d}@s.whatsapp.net",
+                "id": f"bench-{run_id}-{number}"},
+        "pushName": "Bench",
+        "message": {"conversation": f"Anyone hiring python developer? ping {run_id} {number} {words}"}
+    }]}}}).encode()
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+class Command(BaseCommand):
+    help = "Compare sync and async webhook throughput against local Gemini and Telegram stubs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help='Webhook requests per mode')
+        parser.add_argument('--concurrency', type=int, default=50, help='In-flight requests for the async view')
+        parser.add_argument('--gemini-latency', type=float, default=0.3, help='Stub Gemini seconds per call')
+        parser.add_argument('--telegram-latency', type=float, default=0.1, help='Stub Telegram seconds per send')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        gemini = StubGeminiModel(latency=options['gemini_latency'], seed=options['seed'])
+        run_id = uuid.uuid4().hex[:8]
+        rng = random.Random(options['seed'])
+        payloads = {
+            mode: [borderline_payload(f"{run_id}{mode}", number, rng) for number in range(options['requests'])]
+            for mode in ('sync', 'async')
+        }
+
+        # Payload logging would drown the report and costs both modes the same
+        logging.disable(logging.WARNING)
+        try:
+            with StubTelegramServer(latency=options['telegram_latency']) as telegram_server, \
+                    stubbed_services(gemini_model=gemini, telegram_server=telegram_server):
+                clear_classification_cache()
+                sync_result = self._run_sync(payloads['sync'])
+                sync_sent = telegram_server.counters['sent']
+
+                clear_classification_cache()
+                async_result = asyncio.run(self._run_async(payloads['async'], options['concurrency']))
+                async_sent = telegram_server.counters['sent'] - sync_sent
+        finally:
+            logging.disable(logging.NOTSET)
+            self._cleanup(run_id)
+
+        self.stdout.write(f"{'mode':<8}{'requests':>10}{'seconds':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'sent':>8}")
+        for mode, (elapsed, latencies), sent in (('sync', sync_result, sync_sent), ('async', async_result, async_sent)):
+            self.stdout.write(
+                f"{mode:<8}{len(latencies):>10}{elapsed:>10.2f}{len(latencies) / elapsed:>10.1f}"
+                f"{percentile(latencies, 0.5) * 1000:>10.0f}{percentile(latencies, 0.95) * 1000:>10.0f}{sent:>8}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Async throughput is {sync_result[0] / async_result[0]:.1f}x sync "
+            f"(Gemini calls: {gemini.counters['calls']})"
+        ))
+
+    def _run_sync(self, payloads: list) -> tuple:
+        """One sync worker handles requests back to back, as under a sync gunicorn worker"""
+        factory = RequestFactory()
+        latencies = []
+        started = time.perf_counter()
+        for body in payloads:
+            request_started = time.perf_counter()
+            whatsapp_webhook(factory.post('/api/whatsapp/webhook/', data=body, content_type='application/json'))
+            latencies.append(time.perf_counter() - request_started)
+        return time.perf_counter() - started, latencies
+
+    async def _run_async(self, payloads: list, concurrency: int) -> tuple:
+        """One event loop serves up to `concurrency` requests at a time"""
+        factory = AsyncRequestFactory()
+        slots = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def send(body):
+            async with slots:
+                request_started = time.perf_counter()
+                await whatsapp_webhook_async(
+                    factory.post('/api/whatsapp/webhook/async/', data=body, content_type='application/json')
+                )
+                latencies.append(time.perf_counter() - request_started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(body) for body in payloads))
+        return time.perf_counter() - started, latencies
+
+    def _cleanup(self, run_id: str):
+        """Remove the rows and stored verdicts the benchmark created"""
+        logs = MessageLog.objects.filter(wa_message_id__startswith=f"bench-{run_id}")
+        hashes = [message_fingerprint(text) for text in logs.values_list('raw_text', flat=True)]
+        GeminiVerdict.objects.filter(text_hash__in=hashes).delete()
+        logs.delete()
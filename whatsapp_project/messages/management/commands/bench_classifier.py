@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import platform
+import random
+import time
+import tracemalloc
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+
+from messages import local_model
+from messages.filter import (
+    CLASSIFIER_PIPELINE, KEYWORD_MATCHER, _classify_uncached, match_reject_rule, message_fingerprint,
+    parse_gemini_response,
+)
+from messages.stubs import StubGeminiModel, stubbed_services
+
+# Next to manage.py; numbers are machine-specific, so record it on the machine that runs the gate
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))),
+    'bench_classifier_baseline.json'
+)
+
+# Seed messages for every way out of is_job_requirement; each is checked to still exit there
+BRANCH_SEEDS = {
+    'regex': [
+        "Urgent requirement Male & female Education : 10th 12th ITI Salary : 17000 in hand",
+        "VedaTechX Looking for an expert Odoo developer? What We Offer: Custom Odoo Modules DM me to get started!",
+    ],
+    'deceptive_offer': [
+        "Looking for a logo designer? Check out my gig, quick delivery",
+        "Looking for a website developer? Our services cover design and hosting",
+    ],
+    'keyword_check': [
+        "Good morning everyone, have a great day",
+        "Thanks for adding me to the group",
+    ],
+    'company_job': [
+        "Hiring React developer for our company, full time role",
+        "Need a python developer intern for our office team",
+    ],
+    'freelancer_offer': [
+        "I'm a freelance developer available for projects",
+        "Hire me as your freelance web developer, portfolio on request",
+    ],
+    'pattern_match': [
+        "Looking for Poster Designers! Need creative designers",
+        "Any freelance Shopify Website developer available? DM me",
+    ],
+    'gemini': [
+        "Anyone hiring python developer?",
+        "Hiring a wordpress developer for a quick landing page",
+    ],
+}
+
+# Words that trigger no rule, used to grow messages to multi-kilobyte size
+FILLER = "lorem ipsum dolor sit amet consectetur adipiscing elit sed eiusmod tempor incididunt ut labore "
+
+# Throughput is better when higher; every other metric is a cost
+HIGHER_IS_BETTER = ('throughput',)
+
+
+def expected_rule(branch: str, rule: str) -> bool:
+    return rule.startswith('regex:') if branch == 'regex' else rule == branch
+
+
+def build_corpus(count: int, long_size: int, seed: int) -> dict:
+    """{(branch, size class): messages}, each message made unique so no cache can help"""
+    rng = random.Random(seed)
+    corpus = {}
+    for branch, seeds in BRANCH_SEEDS.items():
+        for size in ('short', 'long'):
+            messages = []
+            for number in range(count):
+                message = f"{rng.choice(seeds)} ref {number}"
+                if size == 'long':
+                    message += ' ' + FILLER * (long_size // len(FILLER))
+                messages.append(message)
+            corpus[(branch, size)] = messages
+    return corpus
+
+
+class Command(BaseCommand):
+    help = ("Benchmark every branch of the classifier on short and multi-kilobyte messages "
+            "and fail when a metric regresses past the stored baseline")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200, help='Messages per branch and size')
+        parser.add_argument('--long-size', type=int, default=4096, help='Characters in a long message')
+        parser.add_argument('--repeat', type=int, default=5, help='Timing runs; the fastest is kept')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed fractional slowdown (or allocation growth) before failing')
+        parser.add_argument('--save-baseline', action='store_true', help='Write these results as the new baseline')
+        parser.add_argument('--require-baseline', action='store_true',
+                            help='Fail when there is no baseline to compare against (use this in CI)')
+
+    def handle(self, *args, **options):
+        # A gate without a baseline compares nothing; fail before spending time on the run
+        if options['require_baseline'] and not options['save_baseline'] and not os.path.exists(options['baseline']):
+            raise CommandError(f"No baseline at {options['baseline']}; record one on this machine with --save-baseline")
+
+        corpus = build_corpus(options['messages'], options['long_size'], options['seed'])
+
+        # Per-message INFO lines would dominate the numbers; the trained model is left out and
+        # the stage order pinned so every message keeps exiting through its branch
+        logging.disable(logging.INFO)
+        CLASSIFIER_PIPELINE.reset_order()
+        try:
+            with stubbed_services(gemini_model=StubGeminiModel(seed=options['seed']), verdict_store=False), \
+                    mock.patch.object(local_model, '_local_classifier', False), \
+                    mock.patch.object(CLASSIFIER_PIPELINE, 'adaptive', False):
+                self._check_branches(corpus)
+                metrics = self._measure(corpus, options['repeat'])
+        finally:
+            logging.disable(logging.NOTSET)
+
+        self._report(metrics)
+
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as baseline_file:
+                json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                           "metrics": metrics}, baseline_file, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline to {options['baseline']}"))
+            return
+
+        self._compare(metrics, options['baseline'], options['tolerance'])
+
+    def _check_branches(self, corpus: dict):
+        """Every corpus message must still leave the classifier through its branch"""
+        for (branch, size), messages in corpus.items():
+            for message in messages:
+                rule = _classify_uncached(message)['rule']
+                if not expected_rule(branch, rule):
+                    raise CommandError(f"Corpus message for {branch} ({size}) now ends in {rule}: {message[:60]!r}")
+
+    def _time_ns(self, function, messages: list, repeat: int) -> float:
+        """Best-of-repeat nanoseconds per message"""
+        for message in messages[:10]:
+            function(message)
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter_ns()
+            for message in messages:
+                function(message)
+            elapsed = time.perf_counter_ns() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best / len(messages)
+
+    def _allocated_bytes(self, function, messages: list) -> float:
+        """Mean peak bytes traced while classifying one message"""
+        total = 0
+        tracemalloc.start()
+        try:
+            for message in messages:
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                function(message)
+                total += tracemalloc.get_traced_memory()[1] - baseline
+        finally:
+            tracemalloc.stop()
+        return total / len(messages)
+
+    def _measure(self, corpus: dict, repeat: int) -> dict:
+        metrics = {}
+        stages = {
+            'lowercase': str.lower,
+            'reject_regex': lambda message: match_reject_rule(message.lower()),
+            'keyword_scan': lambda message: KEYWORD_MATCHER.scan(message.lower()),
+            'fingerprint': message_fingerprint,
+        }
+        for size in ('short', 'long'):
+            mixed = [message for (_, message_size), messages in corpus.items() if message_size == size
+                     for message in messages]
+            for stage, function in stages.items():
+                metrics[f"stage:{stage}:{size}"] = self._time_ns(function, mixed, repeat)
+
+        answer = "Category: Client looking to hire freelancer\nConfidence: 0.92\nExplanation: Stub verdict"
+        metrics["stage:gemini_parse"] = self._time_ns(parse_gemini_response, [answer] * 100, repeat)
+
+        for (branch, size), messages in corpus.items():
+            metrics[f"branch:{branch}:{size}"] = self._time_ns(_classify_uncached, messages, repeat)
+            metrics[f"alloc:{branch}:{size}"] = self._allocated_bytes(_classify_uncached, messages[:50])
+
+        mixed = [message for messages in corpus.values() for message in messages]
+        random.Random(0).shuffle(mixed)
+        metrics["throughput"] = 1e9 / self._time_ns(_classify_uncached, mixed, max(1, repeat // 2))
+        return metrics
+
+    def _report(self, metrics: dict):
+        self.stdout.write(f"{'stage':<32}{'ns/msg':>14}")
+        for name, value in metrics.items():
+            if name.startswith('stage:'):
+                self.stdout.write(f"{name[6:]:<32}{value:>14,.0f}")
+
+        self.stdout.write(f"\n{'branch':<32}{'ns/msg':>14}{'msgs/sec':>14}{'bytes/msg':>12}")
+        for name, value in metrics.items():
+            if name.startswith('branch:'):
+                key = name[7:]
+                self.stdout.write(
+                    f"{key:<32}{value:>14,.0f}{1e9 / value:>14,.0f}{metrics['alloc:' + key]:>12,.0f}"
+                )
+        self.stdout.write(f"\nMixed corpus throughput: {metrics['throughput']:,.0f} msgs/sec")
+
+    def _compare(self, metrics: dict, path: str, tolerance: float):
+        if not os.path.exists(path):
+            self.stdout.write(f"No baseline at {path}; run with --save-baseline to record one")
+            return
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)['metrics']
+
+        regressions = []
+        for name, value in metrics.items():
+            previous = baseline.get(name)
+            if not previous:
+                continue
+            if name in HIGHER_IS_BETTER:
+                worse = value < previous / (1 + tolerance)
+            else:
+                worse = value > previous * (1 + tolerance)
+            if worse:
+                regressions.append(f"{name}: {previous:,.0f} -> {value:,.0f}")
+
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} metrics regressed more than {tolerance:.0%} past {path}:\n  " +
+                "\n  ".join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS(f"No metric regressed more than {tolerance:.0%} against {path}"))
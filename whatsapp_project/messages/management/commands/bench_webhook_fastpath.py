@@ -0,0 +1,108 @@
+import io
+import json
+import logging
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+
+from messages.views import whatsapp_webhook
+
+
+def ignored_event_payloads(message_count: int) -> dict:
+    """Typical events the webhook ignores, shaped like the gateway's payloads"""
+    receipts = [
+        {"key": {"remoteJid": f"9198765{i:05d}@s.whatsapp.net", "id": f"3EB0{i:016X}", "fromMe": True},
+         "update": {"status": 3 + i % 2}}
+        for i in range(message_count)
+    ]
+    return {
+        "presence.update": {"data": {"event": "presence.update", "instance": "main", "data": {
+            "id": "120363000000000000@g.us",
+            "presences": {f"9198765{i:05d}@s.whatsapp.net": {"lastKnownPresence": "composing"} for i in range(10)}
+        }}},
+        "messages.update": {"data": {"event": "messages.update", "instance": "main", "data": receipts}},
+        "chats.update": {"data": {"event": "chats.update", "instance": "main", "data": [
+            {"id": f"1203630000{i:08d}@g.us", "unreadCount": i % 7, "conversationTimestamp": 1700000000 + i}
+            for i in range(message_count)
+        ]}},
+        "connection.update": {"data": {"event": "connection.update", "instance": "main", "data": {
+            "state": "open", "statusReason": 200
+        }}},
+    }
+
+
+class Command(BaseCommand):
+    help = "Measure per-request CPU time and allocations for ignored webhook events with and without the fast path"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per event type and mode')
+        parser.add_argument('--messages', type=int, default=50, help='Entries in list-shaped payloads')
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        payloads = {
+            event_type: json.dumps(payload).encode()
+            for event_type, payload in ignored_event_payloads(options['messages']).items()
+        }
+
+        # Keep the view's payload logging in the measurement, but out of the terminal and log file
+        views_logger = logging.getLogger('messages.views')
+        saved_handlers, saved_propagate = views_logger.handlers, views_logger.propagate
+        views_logger.handlers = [logging.StreamHandler(io.StringIO())]
+        views_logger.propagate = False
+
+        try:
+            self.stdout.write(f"{'event':<20}{'bytes':>8}{'full µs':>10}{'fast µs':>10}{'full KiB':>10}{'fast KiB':>10}")
+            totals = {True: [0.0, 0.0], False: [0.0, 0.0]}
+            for event_type, body in payloads.items():
+                row = {}
+                for fast_path in (False, True):
+                    with override_settings(WEBHOOK_FAST_PATH=fast_path):
+                        cpu_us, peak_kib = self._measure(factory, body, options['requests'])
+                    row[fast_path] = (cpu_us, peak_kib)
+                    totals[fast_path][0] += cpu_us
+                    totals[fast_path][1] += peak_kib
+                self.stdout.write(
+                    f"{event_type:<20}{len(body):>8}{row[False][0]:>10.1f}{row[True][0]:>10.1f}"
+                    f"{row[False][1]:>10.1f}{row[True][1]:>10.1f}"
+                )
+        finally:
+            views_logger.handlers, views_logger.propagate = saved_handlers, saved_propagate
+
+        cpu_saving = 1 - totals[True][0] / totals[False][0]
+        memory_saving = 1 - totals[True][1] / totals[False][1]
+        self.stdout.write(self.style.SUCCESS(
+            f"Fast path saves {cpu_saving:.0%} CPU and {memory_saving:.0%} peak allocation per ignored event"
+        ))
+
+    def _measure(self, factory, body: bytes, requests: int) -> tuple:
+        """Mean CPU microseconds and mean peak traced KiB per request"""
+        def make_request():
+            return factory.post('/api/whatsapp/webhook/', data=body, content_type='application/json')
+
+        for _ in range(min(20, requests)):
+            whatsapp_webhook(make_request())
+
+        cpu = 0.0
+        for _ in range(requests):
+            request = make_request()
+            started = time.process_time()
+            whatsapp_webhook(request)
+            cpu += time.process_time() - started
+
+        # Allocations are traced separately so tracing overhead doesn't skew the CPU numbers
+        peak = 0
+        tracemalloc.start()
+        try:
+            for _ in range(min(100, requests)):
+                request = make_request()
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                whatsapp_webhook(request)
+                peak += tracemalloc.get_traced_memory()[1] - baseline
+        finally:
+            tracemalloc.stop()
+
+        return cpu / requests * 1e6, peak / min(100, requests) / 1024
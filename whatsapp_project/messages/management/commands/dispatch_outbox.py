@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from messages.digest import DIGEST_MAX_ITEMS, DIGEST_WINDOW_SECONDS, TELEGRAM_DIGEST
+from messages.forwarding import claim_due_entries, deliver_claimed, digest_ready, requeue_stale_entries
+
+
+class Command(BaseCommand):
+    help = "Deliver queued Telegram forwards from the outbox, retrying failures with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='Outbox rows claimed per poll')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when nothing is due')
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help='Requeue rows claimed longer than this many seconds ago (crashed dispatcher)')
+        parser.add_argument('--once', action='store_true', help='Deliver everything currently due and exit')
+        parser.add_argument('--digest', action='store_true', default=TELEGRAM_DIGEST,
+                            help='Send queued forwards several to a message (default: TELEGRAM_DIGEST)')
+        parser.add_argument('--digest-window', type=float, default=DIGEST_WINDOW_SECONDS,
+                            help='Seconds the oldest queued forward may wait for a digest to fill')
+        parser.add_argument('--digest-max-items', type=int, default=DIGEST_MAX_ITEMS,
+                            help='Queued forwards that trigger a digest without waiting')
+
+    def handle(self, *args, **options):
+        attempted = sent = 0
+        self.stdout.write("Dispatching Telegram outbox")
+
+        while True:
+            requeue_stale_entries(options['stale_after'])
+
+            # A digest waits for its window or item count, except when draining with --once
+            if (options['digest'] and not options['once']
+                    and not digest_ready(options['digest_window'], options['digest_max_items'])):
+                connection.close()
+                time.sleep(options['poll_interval'])
+                continue
+
+            batch_size = max(options['batch_size'], options['digest_max_items']) if options['digest'] else options['batch_size']
+            claimed = claim_due_entries(batch_size)
+
+            if not claimed:
+                if options['once']:
+                    break
+                # Don't hold a connection open while idle
+                connection.close()
+                time.sleep(options['poll_interval'])
+                continue
+
+            sent += deliver_claimed(claimed, digest=options['digest'])
+            attempted += len(claimed)
+
+        self.stdout.write(self.style.SUCCESS(f"Attempted {attempted} deliveries, {sent} sent"))
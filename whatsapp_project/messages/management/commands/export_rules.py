@@ -0,0 +1,63 @@
+import json
+import os
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from messages.filter import BUILTIN_RULES, RULE_STORE, current_rules
+from messages.management.commands.fuzz_reject_rules import adversarial_messages
+
+
+class Command(BaseCommand):
+    help = ("Write the classifier rules as a JSON rules file (a starting point for RULES_FILE), "
+            "or validate an edited one with --check")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Rules file to write (or to validate with --check)')
+        parser.add_argument('--builtin', action='store_true', help='Export the built-in rules, not the active ones')
+        parser.add_argument('--set-version', help='Declared version to write into the file')
+        parser.add_argument('--check', action='store_true',
+                            help='Only load, compile and fuzz PATH (as fuzz_reject_rules does) and report its version')
+        parser.add_argument('--max-ms', type=float, default=25.0,
+                            help='With --check, fail if any adversarial message takes longer than this (milliseconds)')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            try:
+                rules = RULE_STORE.load(options['path'])
+            except (OSError, ValueError, TypeError, re.error) as e:
+                raise CommandError(f"{options['path']} is not a usable rules file: {e}")
+            worst = self._worst_case_ms(rules)
+            if worst > options['max_ms']:
+                raise CommandError(f"{options['path']} is too slow on adversarial input: worst case {worst:.3f} ms, "
+                                   f"budget {options['max_ms']:.1f} ms (see `manage.py fuzz_reject_rules`)")
+            self.stdout.write(self.style.SUCCESS(
+                f"{options['path']} is valid: version {rules.version}, "
+                f"{sum(len(words) for words in rules.keywords.values())} keywords, "
+                f"{len(rules.reject_rules)} reject rules, worst case {worst:.3f} ms"
+            ))
+            return
+
+        rules = BUILTIN_RULES if options['builtin'] else current_rules()
+        data = rules.to_dict()
+        if options['set_version']:
+            data['version'] = options['set_version']
+
+        # Written beside the target and renamed: workers watching the file never read half of it
+        temporary = f"{options['path']}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as rules_file:
+            json.dump(data, rules_file, indent=2, ensure_ascii=False)
+        os.replace(temporary, options['path'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote rules version {data['version']} to {options['path']}"))
+
+    def _worst_case_ms(self, rules) -> float:
+        """Slowest adversarial message through the file's reject rules and keyword scan"""
+        worst = 0.0
+        for message in adversarial_messages(200, 8000, 1):
+            message_lower = message.lower()
+            started = time.perf_counter()
+            rules.match_reject_rule(message_lower)
+            rules.matcher.scan(message_lower)
+            worst = max(worst, (time.perf_counter() - started) * 1000)
+        return worst
@@ -0,0 +1,78 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from messages.filter import COMPILED_REJECT_RULES, KEYWORD_MATCHER, match_reject_rule
+
+# Fragments of the rejection rules arranged so most rules almost match: these are
+# the inputs that make unbounded `.*` patterns backtrack the hardest
+ADVERSARIAL_FRAGMENTS = [
+    '1', '12', '15000', ' ', '  ', 'to', 'in', 'hand', 'salary', '₹', 'education', ':',
+    '10th', 'th', 'male', '&', 'female', 'bus', 'canteen', 'urgent', 'requirement',
+    'mnc', 'company', 'send', 'resume', 'what', 'we', 'offer', 'fiverr', '.com',
+    'explore', 'the', 'gig', 'dm', 'me', 'get', 'started', "you're", 'right', 'place',
+    'merge', 'ancient', 'wisdom', 'transform', 'your', 'operations', 'empowering',
+    'business', '\n', 'x', 'looking for', 'developer',
+]
+
+
+def adversarial_messages(count: int, size: int, seed: int):
+    """Yield multi-kilobyte messages built from near-miss rule fragments"""
+    rng = random.Random(seed)
+
+    # Deterministic worst cases first: long runs of a single near-miss prefix
+    for fragment in ('1' * size, '1 ' * (size // 2), 'dm me to get ' * (size // 13),
+                     "you're in the " * (size // 14), 'education : ' * (size // 12),
+                     'what we ' * (size // 8), 'male & ' * (size // 7),
+                     'urgent requirement ' * (size // 19), 'salary ₹ ' * (size // 9)):
+        yield fragment
+
+    for _ in range(count):
+        parts = []
+        length = 0
+        while length < size:
+            fragment = rng.choice(ADVERSARIAL_FRAGMENTS)
+            parts.append(fragment)
+            length += len(fragment)
+        yield ''.join(parts)
+
+
+class Command(BaseCommand):
+    help = "Fuzz the immediate rejection regexes with adversarial multi-kilobyte messages and enforce a worst-case time"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500, help='Random adversarial messages to generate')
+        parser.add_argument('--size', type=int, default=8000, help='Characters per message')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--max-ms', type=float, default=25.0,
+                            help='Fail if any single message takes longer than this (milliseconds)')
+
+    def handle(self, *args, **options):
+        timings = []
+        worst_message = ''
+
+        for message in adversarial_messages(options['count'], options['size'], options['seed']):
+            message_lower = message.lower()
+            started = time.perf_counter()
+            match_reject_rule(message_lower)
+            KEYWORD_MATCHER.scan(message_lower)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            if not timings or elapsed_ms > max(timings):
+                worst_message = message
+            timings.append(elapsed_ms)
+
+        timings.sort()
+        worst = timings[-1]
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        mean = sum(timings) / len(timings)
+
+        self.stdout.write(f"Rules: {len(COMPILED_REJECT_RULES)} | Messages: {len(timings)} x ~{options['size']} chars")
+        self.stdout.write(f"Mean: {mean:.3f} ms | p99: {p99:.3f} ms | Worst: {worst:.3f} ms")
+        self.stdout.write(f"Worst input starts with: {worst_message[:60]!r}")
+
+        if worst > options['max_ms']:
+            raise CommandError(f"Worst-case {worst:.3f} ms exceeds the {options['max_ms']:.1f} ms budget")
+
+        self.stdout.write(self.style.SUCCESS("All messages classified within budget"))
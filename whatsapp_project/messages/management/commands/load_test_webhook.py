@@ -0,0 +1,199 @@
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+
+from messages.filter import clear_classification_cache, message_fingerprint
+from messages.management.commands.bench_classifier import BRANCH_SEEDS
+from messages.management.commands.bench_webhook_fastpath import ignored_event_payloads
+from messages.models import GeminiVerdict, MessageLog
+from messages.stubs import StubGeminiModel, StubTelegramServer, stubbed_services
+
+MESSAGE_SCENARIOS = ('text_group', 'text_direct', 'extended_text', 'image_caption', 'video_caption')
+# Roughly the size of the jpegThumbnail the gateway inlines in image messages
+THUMBNAIL = 'A' * 2048
+
+
+def message_content(scenario: str, text: str) -> dict:
+    """The `message` object of an upsert, in the shape the gateway sends for each message type"""
+    if scenario == 'extended_text':
+        return {"extendedTextMessage": {"text": text, "contextInfo": {"forwardingScore": 1, "isForwarded": True}}}
+    if scenario == 'image_caption':
+        return {"imageMessage": {"caption": text, "mimetype": "image/jpeg", "jpegThumbnail": THUMBNAIL,
+                                 "url": "https://mmg.whatsapp.net/o1/v/t62.7118-24/example.enc"}}
+    if scenario == 'video_caption':
+        return {"videoMessage": {"caption": text, "mimetype": "video/mp4", "seconds": 12,
+                                 "url": "https://mmg.whatsapp.net/o1/v/t62.7161-24/example.enc"}}
+    return {"conversation": text}
+
+
+def upsert_payload(scenario: str, message_id: str, number: int, text: str) -> dict:
+    if scenario == 'text_direct':
+        key = {"remoteJid": f"9198{number % 10 ** 8:08d}@s.whatsapp.net", "fromMe": False, "id": message_id}
+    else:
+        key = {"remoteJid": f"120363{number % 50:012d}@g.us", "fromMe": False, "id": message_id,
+               "participant": f"9197{number % 10 ** 8:08d}@s.whatsapp.net"}
+    return {"data": {"event": "messages.upsert", "instance": "main", "data": {"messages": [{
+        "key": key,
+        "pushName": f"Member {number % 500}",
+        "messageTimestamp": 1700000000 + number,
+        "message": message_content(scenario, text),
+    }]}}}
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = ("Drive the webhook over HTTP at a target request rate with gateway-shaped traffic, against local "
+            "Gemini and Telegram stubs, and report latency percentiles, throughput and errors per scenario")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rps', type=float, default=20.0, help='Target requests per second')
+        parser.add_argument('--duration', type=float, default=15.0, help='Seconds of traffic to send')
+        parser.add_argument('--concurrency', type=int, default=64, help='Maximum requests in flight')
+        parser.add_argument('--noise-ratio', type=float, default=0.5,
+                            help='Share of requests that are presence/receipt/chat/connection events')
+        parser.add_argument('--path', default='/api/whatsapp/webhook/', help='Webhook path to drive')
+        parser.add_argument('--gemini-latency', type=float, default=0.3)
+        parser.add_argument('--gemini-error-rate', type=float, default=0.0)
+        parser.add_argument('--telegram-latency', type=float, default=0.1)
+        parser.add_argument('--telegram-error-rate', type=float, default=0.0)
+        parser.add_argument('--telegram-rate-limit-rate', type=float, default=0.0)
+        parser.add_argument('--near-duplicates', action='store_true', help='Keep near-duplicate suppression on')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep-rows', action='store_true', help="Don't delete the messages the run stored")
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        requests_plan = self._plan(run_id, options)
+
+        gemini = StubGeminiModel(options['gemini_latency'], options['gemini_error_rate'], options['seed'])
+        telegram_server = StubTelegramServer(
+            options['telegram_latency'], options['telegram_error_rate'], options['telegram_rate_limit_rate'],
+            retry_after=0.5, seed=options['seed']
+        )
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+        server.set_app(get_wsgi_application())
+        server.daemon_threads = True
+        url = f"http://127.0.0.1:{server.server_port}{options['path']}"
+
+        logging.disable(logging.INFO)
+        try:
+            with telegram_server, stubbed_services(gemini, telegram_server, near_duplicates=options['near_duplicates']):
+                clear_classification_cache()
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                results, elapsed = self._drive(url, requests_plan, options)
+                server.shutdown()
+        finally:
+            server.server_close()
+            logging.disable(logging.NOTSET)
+            if not options['keep_rows']:
+                self._cleanup(run_id)
+
+        self._report(results, elapsed, options, gemini, telegram_server)
+
+    def _plan(self, run_id: str, options: dict) -> list:
+        """(scenario, body) for every request of the run, in sending order"""
+        rng = random.Random(options['seed'])
+        noise = [(event_type, json.dumps(payload).encode())
+                 for event_type, payload in ignored_event_payloads(20).items()]
+        texts = [text for seeds in BRANCH_SEEDS.values() for text in seeds]
+
+        plan = []
+        for number in range(int(options['rps'] * options['duration'])):
+            if rng.random() < options['noise_ratio']:
+                event_type, body = rng.choice(noise)
+                plan.append((f"noise:{event_type}", body))
+                continue
+            scenario = rng.choice(MESSAGE_SCENARIOS)
+            text = f"{rng.choice(texts)} #{number}"
+            payload = upsert_payload(scenario, f"load-{run_id}-{number}", number, text)
+            plan.append((scenario, json.dumps(payload).encode()))
+        return plan
+
+    def _drive(self, url: str, plan: list, options: dict) -> tuple:
+        """
+        Open-loop load: request i is due at start + i / rps whether or not earlier
+        ones have finished, and its latency is counted from that moment, so a
+        slow server can't hide its queueing delay
+        """
+        sessions = threading.local()
+        results = []
+        results_lock = threading.Lock()
+
+        def send(scenario: str, body: bytes, due: float):
+            session = getattr(sessions, 'session', None)
+            if session is None:
+                session = sessions.session = requests.Session()
+            error = None
+            try:
+                response = session.post(url, data=body, headers={'Content-Type': 'application/json'}, timeout=60)
+                if response.status_code >= 400:
+                    error = f"HTTP {response.status_code}"
+                elif response.json().get('status') == 'error':
+                    error = response.json().get('message', 'error')
+            except requests.RequestException as e:
+                error = type(e).__name__
+            with results_lock:
+                results.append((scenario, time.perf_counter() - due, error))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            for number, (scenario, body) in enumerate(plan):
+                due = started + number / options['rps']
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(send, scenario, body, due)
+        return results, time.perf_counter() - started
+
+    def _report(self, results: list, elapsed: float, options: dict, gemini, telegram_server):
+        by_scenario = {}
+        for scenario, latency, error in results:
+            by_scenario.setdefault(scenario, []).append((latency, error))
+        by_scenario['all'] = [(latency, error) for _, latency, error in results]
+
+        self.stdout.write(
+            f"Sent {len(results)} requests in {elapsed:.1f}s "
+            f"(target {options['rps']:g} rps, achieved {len(results) / elapsed:.1f} rps)\n"
+        )
+        self.stdout.write(f"{'scenario':<28}{'requests':>9}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>9}")
+        for scenario, samples in sorted(by_scenario.items(), key=lambda item: (item[0] == 'all', item[0])):
+            latencies = sorted(latency for latency, _ in samples)
+            errors = sum(1 for _, error in samples if error)
+            self.stdout.write(
+                f"{scenario:<28}{len(samples):>9}{len(samples) / elapsed:>8.1f}"
+                f"{self._percentile(latencies, 0.50):>9.0f}{self._percentile(latencies, 0.95):>9.0f}"
+                f"{self._percentile(latencies, 0.99):>9.0f}{errors / len(samples):>9.1%}"
+            )
+
+        error_kinds = {}
+        for _, _, error in results:
+            if error:
+                error_kinds[error] = error_kinds.get(error, 0) + 1
+        for error, count in sorted(error_kinds.items(), key=lambda item: -item[1])[:5]:
+            self.stdout.write(f"  {count} x {error[:100]}")
+
+        self.stdout.write(f"\nGemini stub: {gemini.counters}")
+        self.stdout.write(f"Telegram stub: {telegram_server.counters}")
+
+    @staticmethod
+    def _percentile(ordered: list, fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000 if ordered else 0.0
+
+    def _cleanup(self, run_id: str):
+        logs = MessageLog.objects.filter(wa_message_id__startswith=f"load-{run_id}")
+        hashes = [message_fingerprint(text) for text in logs.values_list('raw_text', flat=True)]
+        GeminiVerdict.objects.filter(text_hash__in=hashes).delete()
+        logs.delete()
@@ -0,0 +1,104 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.db import connection
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from messages.claims import claim_batch
+from messages.models import MessageLog
+from messages.filter import GEMINI_BATCH_SIZE, gemini_breaker
+from messages.resilience import CircuitBreaker
+from messages.pending import process_pending_batch, process_queued_messages
+
+
+class Command(BaseCommand):
+    help = ("Run background workers that classify messages shed by the ingest queue, "
+            "finish Gemini classification of pending messages and forward them")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent Gemini requests')
+        parser.add_argument('--batch-size', type=int, default=20, help='Messages claimed per poll')
+        parser.add_argument('--gemini-batch-size', type=int, default=GEMINI_BATCH_SIZE,
+                            help='Messages packed into one Gemini prompt')
+        parser.add_argument('--batch-window', type=float, default=1.0,
+                            help='Seconds to wait for a partial batch to fill before sending it')
+        parser.add_argument('--deadline', type=float, default=15.0, help='Per-call Gemini timeout in seconds')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help='Requeue messages claimed longer than this many seconds ago (crashed worker)')
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit')
+
+    def handle(self, *args, **options):
+        processed = 0
+        self.stdout.write(f"Processing pending messages with {options['workers']} workers")
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                self._requeue_stale(options['stale_after'])
+
+                # Shed messages only need the rules (Gemini-bound ones become pending), so run them even with the circuit open
+                queued = self._claim_queued(options['batch_size'])
+                if queued:
+                    process_queued_messages(list(MessageLog.objects.filter(pk__in=queued).order_by('id')))
+                    processed += len(queued)
+                    continue
+
+                # Don't churn through the queue while Gemini is known to be down
+                if gemini_breaker.state == CircuitBreaker.OPEN:
+                    if options['once']:
+                        self.stderr.write("Gemini circuit is open; leaving messages pending")
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                claimed = self._claim(options['batch_size'])
+
+                if not claimed:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                # Flush by size or time: a partial batch waits briefly for bursts to fill it
+                if len(claimed) < options['batch_size'] and options['batch_window'] > 0 and not options['once']:
+                    time.sleep(options['batch_window'])
+                    claimed += self._claim(options['batch_size'] - len(claimed))
+
+                step = max(1, options['gemini_batch_size'])
+                futures = [
+                    pool.submit(self._process, claimed[start:start + step], options['deadline'])
+                    for start in range(0, len(claimed), step)
+                ]
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.stderr.write(f"Pending batch failed: {e}")
+                processed += len(claimed)
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} pending messages"))
+
+    def _claim(self, limit: int) -> list:
+        pending = MessageLog.objects.filter(classification_status=MessageLog.PENDING).order_by('id')
+        return claim_batch(pending, limit, classification_status=MessageLog.PROCESSING, claimed_at=timezone.now())
+
+    def _claim_queued(self, limit: int) -> list:
+        queued = MessageLog.objects.filter(classification_status=MessageLog.QUEUED).order_by('id')
+        return claim_batch(queued, limit, classification_status=MessageLog.PROCESSING, claimed_at=timezone.now())
+
+    def _requeue_stale(self, stale_after: int):
+        cutoff = timezone.now() - timedelta(seconds=stale_after)
+        stale = MessageLog.objects.filter(classification_status=MessageLog.PROCESSING, claimed_at__lt=cutoff)
+        # Shed messages have no rule yet; everything else was waiting on Gemini
+        stale.filter(classification_rule='').update(classification_status=MessageLog.QUEUED, claimed_at=None)
+        stale.update(classification_status=MessageLog.PENDING, claimed_at=None)
+
+    def _process(self, pks: list, deadline: float):
+        try:
+            message_logs = list(MessageLog.objects.filter(pk__in=pks).order_by('id'))
+            process_pending_batch(message_logs, timeout=deadline)
+        finally:
+            # Pool threads keep their own connection; don't leave it open between batches
+            connection.close()
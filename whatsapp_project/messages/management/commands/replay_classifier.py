@@ -0,0 +1,147 @@
+import logging
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from messages.filter import RULE_STORE, current_rules
+from messages.models import MessageLog
+
+# Diffs kept per batch (and in the report) so huge behaviour changes don't fill memory
+SAMPLE_DIFFS = 20
+
+
+def _init_worker(rules_path: str = ''):
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    # Per-message INFO lines would cost more than the classification itself
+    logging.disable(logging.INFO)
+    if rules_path:
+        RULE_STORE.watch(rules_path)
+
+
+def replay_batch(rows: list) -> dict:
+    """Re-classify (id, text, is_relevant, rule) rows in pattern-only mode; only counters come back"""
+    from messages.filter import classify_message
+
+    rules = Counter()
+    transitions = Counter()
+    counts = Counter()
+    diffs = []
+    for pk, raw_text, was_relevant, old_rule in rows:
+        result = classify_message(raw_text, use_gemini=False)
+        rules[result['rule']] += 1
+        if result['rule'] == 'gemini_skipped':
+            # Undecided without Gemini: nothing to compare against
+            counts['needs_gemini'] += 1
+            continue
+        if bool(result['is_job']) == was_relevant:
+            counts['same'] += 1
+            continue
+        counts['now_relevant' if result['is_job'] else 'now_irrelevant'] += 1
+        transitions[(old_rule or '?', result['rule'])] += 1
+        if len(diffs) < SAMPLE_DIFFS:
+            diffs.append((pk, was_relevant, old_rule, result['rule'], raw_text[:80]))
+    return {"rules": rules, "transitions": transitions, "counts": counts, "diffs": diffs, "messages": len(rows)}
+
+
+class Command(BaseCommand):
+    help = "Re-run the rules (no Gemini) over stored messages in parallel and report how verdicts would change"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per database round-trip')
+        parser.add_argument('--batch-size', type=int, default=500, help='Messages per worker task')
+        parser.add_argument('--limit', type=int, default=None, help='Replay at most this many messages')
+        parser.add_argument('--diffs', type=int, default=SAMPLE_DIFFS, help='Changed verdicts to print')
+        parser.add_argument('--rules', default='', help='Replay with this rules file instead of the active rules')
+
+    def handle(self, *args, **options):
+        if options['rules']:
+            try:
+                rules = RULE_STORE.load(options['rules'])
+            except (OSError, ValueError, TypeError, re.error) as e:
+                raise CommandError(f"{options['rules']} is not a usable rules file: {e}")
+        else:
+            rules = current_rules()
+        self.stdout.write(f"Rules version {rules.version}")
+
+        rows = (
+            MessageLog.objects
+            .filter(classification_status=MessageLog.CLASSIFIED)
+            .order_by('id')
+            .values_list('id', 'raw_text', 'is_relevant', 'classification_rule')
+        )
+        if options['limit']:
+            rows = rows[:options['limit']]
+
+        totals = {"rules": Counter(), "transitions": Counter(), "counts": Counter(), "diffs": [], "messages": 0}
+        # At most two batches per worker are in flight, so memory stays flat however many rows there are
+        max_in_flight = options['workers'] * 2
+        in_flight = set()
+
+        # Workers forked while the connection is open would share its socket
+        connection.close()
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker,
+                                 initargs=(options['rules'],)) as pool:
+            for batch in self._batches(rows, options['chunk_size'], options['batch_size']):
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._merge(totals, future.result())
+                in_flight.add(pool.submit(replay_batch, batch))
+            for future in in_flight:
+                self._merge(totals, future.result())
+        elapsed = time.perf_counter() - started
+
+        self._report(totals, elapsed, options)
+
+    def _batches(self, rows, chunk_size: int, batch_size: int):
+        batch = []
+        for row in rows.iterator(chunk_size=chunk_size):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _merge(self, totals: dict, result: dict):
+        for key in ('rules', 'transitions', 'counts'):
+            totals[key].update(result[key])
+        totals['messages'] += result['messages']
+        totals['diffs'].extend(result['diffs'][:SAMPLE_DIFFS - len(totals['diffs'])])
+
+    def _report(self, totals: dict, elapsed: float, options: dict):
+        messages = totals['messages']
+        counts = totals['counts']
+        rate = messages / elapsed if elapsed else 0.0
+        self.stdout.write(
+            f"Replayed {messages} messages in {elapsed:.1f}s ({rate:,.0f} msgs/sec, {options['workers']} workers)"
+        )
+
+        self.stdout.write("\nRule hits:")
+        for rule, hits in totals['rules'].most_common():
+            self.stdout.write(f"  {rule:<40}{hits:>10}{hits / max(1, messages):>9.1%}")
+
+        self.stdout.write(
+            f"\nVerdicts: {counts['same']} unchanged, {counts['now_relevant']} now relevant, "
+            f"{counts['now_irrelevant']} now irrelevant, {counts['needs_gemini']} would need Gemini"
+        )
+        if totals['transitions']:
+            self.stdout.write("Changed verdicts by stored rule -> new rule:")
+            for (old_rule, new_rule), changed in totals['transitions'].most_common(10):
+                self.stdout.write(f"  {old_rule} -> {new_rule}: {changed}")
+        for pk, was_relevant, old_rule, new_rule, text in totals['diffs'][:options['diffs']]:
+            self.stdout.write(f"  #{pk} {was_relevant} -> {not was_relevant} ({old_rule} -> {new_rule}): {text!r}")
+
+        changed = counts['now_relevant'] + counts['now_irrelevant']
+        style = self.style.WARNING if changed else self.style.SUCCESS
+        self.stdout.write(style(f"{changed} verdicts would change"))
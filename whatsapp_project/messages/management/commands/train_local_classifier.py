@@ -0,0 +1,76 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from messages.filter import CLASSIFIER_TEST_CASES
+from messages.local_model import (
+    FEATURE_BITS, LOCAL_MODEL_ACCEPT, LOCAL_MODEL_PATH, LOCAL_MODEL_REJECT, LocalClassifier, evaluate, np
+)
+from messages.models import MessageLog
+
+
+class Command(BaseCommand):
+    help = "Train the local borderline-message classifier, evaluate it on a holdout split and write its artifact"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=LOCAL_MODEL_PATH, help='Where to write the .npz artifact')
+        parser.add_argument('--gemini-verdicts', action='store_true',
+                            help="Also learn from rows Gemini classified (their is_relevant), not only reviewed labels")
+        parser.add_argument('--holdout', type=float, default=0.2, help='Fraction of examples kept back for evaluation')
+        parser.add_argument('--epochs', type=int, default=300)
+        parser.add_argument('--learning-rate', type=float, default=2.0)
+        parser.add_argument('--l2', type=float, default=1e-4)
+        parser.add_argument('--bits', type=int, default=FEATURE_BITS, help='Hash space is 2**bits features')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--dry-run', action='store_true', help='Evaluate without writing the artifact')
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError("NumPy is required to train the local classifier (pip install numpy)")
+
+        examples = self._examples(options['gemini_verdicts'])
+        random.Random(options['seed']).shuffle(examples)
+        labels = [label for _, label in examples]
+        if len(set(labels)) < 2:
+            raise CommandError("Need both relevant and irrelevant examples to train")
+        self.stdout.write(f"Training on {len(examples)} examples ({sum(labels)} relevant)")
+
+        split = int(len(examples) * (1 - options['holdout']))
+        training = dict(
+            epochs=options['epochs'], learning_rate=options['learning_rate'], l2=options['l2'], bits=options['bits']
+        )
+
+        if 0 < split < len(examples):
+            train, test = examples[:split], examples[split:]
+            model = LocalClassifier.train([m for m, _ in train], [l for _, l in train], **training)
+            self._report("holdout", evaluate(model, [m for m, _ in test], [l for _, l in test]))
+
+        # The shipped model learns from every example
+        model = LocalClassifier.train([m for m, _ in examples], labels, **training)
+        self._report("training set", evaluate(model, [m for m, _ in examples], labels))
+
+        if options['dry_run']:
+            return
+        model.save(options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote local classifier {model.version} to {options['output']} "
+            f"(thresholds: reject <= {LOCAL_MODEL_REJECT}, accept >= {LOCAL_MODEL_ACCEPT})"
+        ))
+
+    def _examples(self, gemini_verdicts: bool) -> list:
+        """(text, label) pairs: reviewed rows, optionally Gemini's verdicts, and the classifier test cases"""
+        examples = {}
+        if gemini_verdicts:
+            rows = MessageLog.objects.filter(classification_rule='gemini', classification_status=MessageLog.CLASSIFIED)
+            examples.update(rows.values_list('raw_text', 'is_relevant').iterator())
+        # Reviewed labels override Gemini's answer for the same text
+        examples.update(MessageLog.objects.filter(label__isnull=False).values_list('raw_text', 'label').iterator())
+        examples.update(CLASSIFIER_TEST_CASES)
+        return [(text, bool(label)) for text, label in examples.items()]
+
+    def _report(self, name: str, metrics: dict):
+        self.stdout.write(
+            f"{name}: {metrics['samples']} samples, accuracy {metrics['accuracy']:.1%}, "
+            f"precision {metrics['precision']:.1%}, recall {metrics['recall']:.1%}; "
+            f"decided locally {metrics['coverage']:.1%} at {metrics['decided_accuracy']:.1%} accuracy"
+        )
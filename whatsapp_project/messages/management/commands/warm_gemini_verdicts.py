@@ -0,0 +1,78 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from messages.filter import (
+    GEMINI_PROMPT_VERSION, classify_message, gemini_intent_check, get_gemini_model,
+    message_fingerprint,
+)
+from messages.models import GeminiVerdict, MessageLog
+
+
+class Command(BaseCommand):
+    help = "Pre-fill the shared Gemini verdict store from borderline messages already in MessageLog"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=500, help='Maximum number of Gemini calls to make')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--delay', type=float, default=0.5, help='Seconds to wait between Gemini calls')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the messages that would be sent')
+
+    def handle(self, *args, **options):
+        if not options['dry_run'] and not get_gemini_model():
+            self.stderr.write("Gemini is not configured (GEMINI_API_KEY); nothing to warm")
+            return
+
+        seen = set()
+        scanned = 0
+        calls = 0
+
+        rows = MessageLog.objects.order_by('-created_at').values_list('raw_text', flat=True)
+        chunk = []
+        for raw_text in rows.iterator(chunk_size=options['chunk_size']):
+            scanned += 1
+            text_hash = message_fingerprint(raw_text)
+            if text_hash in seen:
+                continue
+            seen.add(text_hash)
+
+            # Only borderline messages ever reach Gemini
+            if classify_message(raw_text, use_gemini=False)['rule'] != 'gemini_skipped':
+                continue
+            chunk.append((text_hash, raw_text))
+
+            if len(chunk) >= options['chunk_size']:
+                calls += self._warm(chunk, options, options['limit'] - calls)
+                chunk = []
+            if calls >= options['limit']:
+                break
+
+        if chunk and calls < options['limit']:
+            calls += self._warm(chunk, options, options['limit'] - calls)
+
+        verb = "Would call" if options['dry_run'] else "Called"
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {scanned} messages ({len(seen)} distinct). {verb} Gemini for {calls} uncached borderline messages."
+        ))
+
+    def _warm(self, chunk, options, budget):
+        """Call Gemini for the chunk's messages that have no stored verdict yet"""
+        stored = set(GeminiVerdict.objects.filter(
+            prompt_version=GEMINI_PROMPT_VERSION,
+            text_hash__in=[text_hash for text_hash, _ in chunk],
+        ).values_list('text_hash', flat=True))
+
+        calls = 0
+        for text_hash, raw_text in chunk:
+            if calls >= budget:
+                break
+            if text_hash in stored:
+                continue
+            calls += 1
+            if options['dry_run']:
+                continue
+            # gemini_intent_check writes the verdict to the store itself
+            gemini_intent_check(raw_text)
+            time.sleep(options['delay'])
+
+        return calls
@@ -0,0 +1,81 @@
+"""
+Single-pass multi-keyword matcher used by the rule engine in filter.py.
+
+All keyword lists are compiled once into one Aho-Corasick automaton, so a
+message is scanned a single time no matter how many lists or keywords exist.
+"""
+from collections import deque
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over several named keyword categories"""
+
+    def __init__(self, categories: dict):
+        # Trie edges and the (category, keyword) pairs ending at each state
+        self._children = [{}]
+        self._outputs = [()]
+        self.categories = {}
+
+        for category, keywords in categories.items():
+            # dict.fromkeys keeps the original order while dropping duplicates
+            unique_keywords = tuple(dict.fromkeys(k.lower() for k in keywords if k))
+            self.categories[category] = unique_keywords
+            for keyword in unique_keywords:
+                self._add(keyword, category)
+
+        self._transitions = self._compile()
+
+    def _add(self, keyword: str, category: str):
+        state = 0
+        for char in keyword:
+            next_state = self._children[state].get(char)
+            if next_state is None:
+                next_state = len(self._children)
+                self._children.append({})
+                self._outputs.append(())
+                self._children[state][char] = next_state
+            state = next_state
+        self._outputs[state] = self._outputs[state] + ((category, keyword),)
+
+    def _compile(self) -> tuple:
+        """Fold failure links into a complete transition table (one dict lookup per char)"""
+        children = self._children
+        fail = [0] * len(children)
+        transitions = [None] * len(children)
+        transitions[0] = dict(children[0])
+        queue = deque(children[0].values())
+
+        # Breadth-first order guarantees a state's failure target is finished first
+        while queue:
+            state = queue.popleft()
+            table = dict(transitions[fail[state]])
+            table.update(children[state])
+            transitions[state] = table
+
+            for char, child in children[state].items():
+                if state:
+                    fail[child] = transitions[fail[state]].get(char, 0)
+                self._outputs[child] = self._outputs[child] + self._outputs[fail[child]]
+                queue.append(child)
+
+        self._outputs = tuple(self._outputs)
+        self._children = None
+        return tuple(transitions)
+
+    def scan(self, text: str) -> dict:
+        """
+        Return {category: set(matched keywords)} for every keyword found in text.
+        Text is expected to be lowercased already.
+        """
+        transitions = self._transitions
+        outputs = self._outputs
+        hits = {category: set() for category in self.categories}
+        state = 0
+
+        for char in text:
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                for category, keyword in outputs[state]:
+                    hits[category].add(keyword)
+
+        return hits
@@ -0,0 +1,363 @@
+"""
+Stage timings and outcome counters in the Prometheus text format.
+
+Each worker process records into its own in-memory registry: counters and
+fixed-bucket histograms behind one lock, about a microsecond per observation.
+Gunicorn workers don't share memory, so every web worker writes its registry
+to a snapshot file in METRICS_DIR (at most every METRICS_FLUSH_SECONDS, and at
+exit), and the /metrics view merges all snapshot files at scrape time. Only
+processes that call enable_snapshots() write files: the WSGI/ASGI entry points
+do when METRICS_ENABLED is set, so management commands and tests never add
+their runs to the production totals.
+Counters of workers that have exited are folded into one archive file, so
+totals never go backwards when gunicorn recycles a worker.
+
+The counters kept elsewhere (classification cache, Gemini breaker and rate
+limiter, redelivery filter, events, ingest queue, digest buffer) are pulled in
+through collectors registered by their modules.
+"""
+import asyncio
+import atexit
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from decouple import config
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = config('METRICS_DIR', default=os.path.join(tempfile.gettempdir(), 'whatsapp_metrics'))
+METRICS_FLUSH_SECONDS = config('METRICS_FLUSH_SECONDS', default=5.0, cast=float)
+
+# Seconds; spans a regex scan (sub-millisecond) up to a slow Gemini call
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'webhook_requests_total': ('counter', 'Webhook requests by method and HTTP status'),
+    'webhook_request_seconds': ('histogram', 'Webhook request duration by method'),
+    'webhook_events_total': ('counter', 'Webhook events by type, overall (path="all") and answered by the fast path'),
+    'webhook_stage_seconds': ('histogram', 'Time spent in each webhook stage'),
+    'classifier_stage_seconds': ('histogram', 'Time spent in each classifier step'),
+    'classifier_decisions_total': ('counter', 'Classifier verdicts by deciding rule'),
+    'gemini_requests_total': ('counter', 'Gemini calls by outcome'),
+    'gemini_request_seconds': ('histogram', 'Gemini call duration'),
+    'telegram_requests_total': ('counter', 'Telegram sendMessage calls by HTTP status (network for no response)'),
+    'telegram_request_seconds': ('histogram', 'Telegram sendMessage duration'),
+}
+
+ARCHIVE_NAME = 'archive.json'
+LOCK_NAME = '.lock'
+
+
+_snapshot_name = (None, None)
+_snapshots_enabled = False
+
+
+def enable_snapshots():
+    """Write this process's snapshot file every METRICS_FLUSH_SECONDS and at exit"""
+    global _snapshots_enabled
+    _snapshots_enabled = True
+
+
+def snapshot_name() -> str:
+    """
+    This process's snapshot file: pid for liveness checks, a random token so a
+    reused pid never overwrites it. Recomputed after a fork.
+    """
+    global _snapshot_name
+    pid, name = _snapshot_name
+    if pid != os.getpid():
+        _snapshot_name = (os.getpid(), f"worker-{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+    return _snapshot_name[1]
+
+
+def _key(name: str, labels: dict) -> str:
+    """Registry key: metric name and its labels in Prometheus syntax"""
+    if not labels:
+        return name
+    rendered = ','.join(f'{label}="{_escape(value)}"' for label, value in sorted(labels.items()))
+    return f"{name}{{{rendered}}}"
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Registry:
+    """One process's counters and histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}  # key -> [bucket counts..., +Inf count, sum]
+        self._flushed_at = time.monotonic()
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+        self._maybe_flush()
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[index] += 1
+                    break
+            else:
+                histogram[len(BUCKETS)] += 1
+            histogram[-1] += seconds
+        self._maybe_flush()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {key: list(values) for key, values in self.histograms.items()},
+            }
+
+    def _maybe_flush(self):
+        if not _snapshots_enabled or time.monotonic() - self._flushed_at < METRICS_FLUSH_SECONDS:
+            return
+        with self._lock:
+            if time.monotonic() - self._flushed_at < METRICS_FLUSH_SECONDS:
+                return
+            self._flushed_at = time.monotonic()
+        flush()
+
+
+registry = Registry()
+_collectors = []
+
+
+def inc(name: str, amount: float = 1, **labels):
+    registry.inc(name, amount, **labels)
+
+
+def observe(name: str, seconds: float, **labels):
+    registry.observe(name, seconds, **labels)
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """Observe the duration of the with-block into histogram `name`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - started, **labels)
+
+
+def timed_view(view):
+    """Count and time every request to a (sync or async) webhook view"""
+    def record(request, response, started):
+        registry.observe('webhook_request_seconds', time.perf_counter() - started, method=request.method)
+        registry.inc('webhook_requests_total', method=request.method, status=response.status_code)
+
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            started = time.perf_counter()
+            response = await view(request, *args, **kwargs)
+            record(request, response, started)
+            return response
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            started = time.perf_counter()
+            response = view(request, *args, **kwargs)
+            record(request, response, started)
+            return response
+    return wrapper
+
+
+def register_collector(collector):
+    """
+    collector() returns {"counters": {...}, "gauges": {...}} keyed like the
+    registry (use metric_key); it is called whenever the snapshot is written
+    """
+    _collectors.append(collector)
+
+
+def metric_key(name: str, **labels) -> str:
+    return _key(name, labels)
+
+
+def process_snapshot() -> dict:
+    """This process's registry plus its collectors' values"""
+    snapshot = registry.snapshot()
+    snapshot["gauges"] = {}
+    for collector in _collectors:
+        try:
+            collected = collector()
+        except Exception as e:
+            logger.warning(f"Metrics collector {collector.__name__} failed: {e}")
+            continue
+        snapshot["counters"].update(collected.get("counters", {}))
+        snapshot["gauges"].update(collected.get("gauges", {}))
+    return snapshot
+
+
+def _write_json(path: str, data: dict):
+    # Written beside the target and renamed, so a scrape never reads half a file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as snapshot_file:
+        json.dump(data, snapshot_file)
+    os.replace(temporary, path)
+
+
+_flush_lock = threading.Lock()
+
+
+def flush():
+    """Write this process's snapshot file"""
+    with _flush_lock:
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            _write_json(os.path.join(METRICS_DIR, snapshot_name()), {"pid": os.getpid(), **process_snapshot()})
+        except OSError as e:
+            logger.warning(f"Could not write metrics snapshot: {e}")
+
+
+def _flush_at_exit():
+    # Processes that never recorded anything leave no file behind
+    if _snapshots_enabled and (registry.counters or registry.histograms):
+        flush()
+
+
+atexit.register(_flush_at_exit)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge_into(total: dict, snapshot: dict, gauges: bool):
+    for key, value in snapshot.get("counters", {}).items():
+        total["counters"][key] = total["counters"].get(key, 0) + value
+    for key, values in snapshot.get("histograms", {}).items():
+        current = total["histograms"].get(key)
+        total["histograms"][key] = values if current is None else [a + b for a, b in zip(current, values)]
+    if gauges:
+        for key, value in snapshot.get("gauges", {}).items():
+            total["gauges"][key] = total["gauges"].get(key, 0) + value
+
+
+def merged_snapshot() -> dict:
+    """
+    Every worker's metrics summed. Snapshot files of exited workers are folded
+    into the archive (under a file lock when available); their gauges are dropped.
+    A process without snapshots enabled adds its own metrics from memory.
+    """
+    total = {"counters": {}, "histograms": {}, "gauges": {}}
+    if _snapshots_enabled:
+        flush()
+    else:
+        _merge_into(total, process_snapshot(), gauges=True)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    archive_path = os.path.join(METRICS_DIR, ARCHIVE_NAME)
+
+    lock_file = open(os.path.join(METRICS_DIR, LOCK_NAME), 'a')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        archive = {"counters": {}, "histograms": {}}
+        if os.path.exists(archive_path):
+            with open(archive_path) as archive_file:
+                archive = json.load(archive_file)
+
+        archived = []
+        for name in os.listdir(METRICS_DIR):
+            if not (name.startswith('worker-') and name.endswith('.json')):
+                continue
+            path = os.path.join(METRICS_DIR, name)
+            try:
+                with open(path) as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except (OSError, ValueError):
+                continue
+            if name != snapshot_name() and not _pid_alive(snapshot.get("pid", 0)):
+                _merge_into(archive, snapshot, gauges=False)
+                archived.append(path)
+            else:
+                _merge_into(total, snapshot, gauges=True)
+
+        if archived:
+            _write_json(archive_path, {"counters": archive["counters"], "histograms": archive["histograms"]})
+            for path in archived:
+                os.remove(path)
+        _merge_into(total, archive, gauges=False)
+    finally:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+    return total
+
+
+def _family(key: str) -> str:
+    return key.split('{', 1)[0]
+
+
+def _with_label(key: str, label: str, value: str) -> str:
+    name, _, labels = key.partition('{')
+    extra = f'{label}="{value}"'
+    return f"{name}_bucket{{{labels[:-1]},{extra}}}" if labels else f"{name}_bucket{{{extra}}}"
+
+
+def render_prometheus(snapshot: dict, extra_gauges: dict = None) -> str:
+    """Prometheus text exposition of a (merged) snapshot"""
+    lines = []
+    described = set()
+
+    def describe(family: str, kind: str):
+        if family in described:
+            return
+        described.add(family)
+        help_kind, help_text = HELP.get(family, (kind, family.replace('_', ' ')))
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {help_kind}")
+
+    for key in sorted(snapshot["counters"]):
+        describe(_family(key), 'counter')
+        lines.append(f"{key} {snapshot['counters'][key]}")
+
+    for key, value in sorted({**snapshot["gauges"], **(extra_gauges or {})}.items()):
+        describe(_family(key), 'gauge')
+        lines.append(f"{key} {value}")
+
+    for key in sorted(snapshot["histograms"]):
+        values = snapshot["histograms"][key]
+        describe(_family(key), 'histogram')
+        cumulative = 0
+        for bound, count in zip(BUCKETS, values):
+            cumulative += count
+            lines.append(f"{_with_label(key, 'le', repr(bound))} {cumulative}")
+        cumulative += values[len(BUCKETS)]
+        lines.append(f"{_with_label(key, 'le', '+Inf')} {cumulative}")
+        name, brace, labels = key.partition('{')
+        lines.append(f"{name}_sum{brace}{labels} {values[-1]}")
+        lines.append(f"{name}_count{brace}{labels} {cumulative}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_messages', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeminiVerdict',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text_hash', models.CharField(max_length=64)),
+                ('prompt_version', models.CharField(max_length=20)),
+                ('category', models.CharField(max_length=100)),
+                ('confidence', models.FloatField(default=0.0)),
+                ('explanation', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'whatsapp_messages_geminiverdict',
+                'constraints': [models.UniqueConstraint(fields=('text_hash', 'prompt_version'), name='unique_gemini_verdict')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_messages', '0002_geminiverdict'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagelog',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='whatsapp_messages.messagelog'),
+        ),
+        migrations.AddField(
+            model_name='messagelog',
+            name='minhash',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_messages', '0003_messagelog_near_duplicates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagelog',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='messagelog',
+            name='classification_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='messagelog',
+            name='classification_rule',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='messagelog',
+            name='classification_status',
+            field=models.CharField(choices=[('classified', 'Classified'), ('pending', 'Pending'), ('processing', 'Processing')], db_index=True, default='classified', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='messagelog',
+            name='sender_info',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
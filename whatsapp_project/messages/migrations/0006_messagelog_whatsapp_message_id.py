@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_messages', '0005_telegram_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagelog',
+            name='remote_jid',
+            field=models.CharField(blank=True, default='', max_length=128),
+        ),
+        migrations.AddField(
+            model_name='messagelog',
+            name='wa_message_id',
+            field=models.CharField(blank=True, default='', max_length=128),
+        ),
+        migrations.AddConstraint(
+            model_name='messagelog',
+            constraint=models.UniqueConstraint(condition=models.Q(('wa_message_id', ''), _negated=True), fields=('remote_jid', 'wa_message_id'), name='unique_whatsapp_message'),
+        ),
+    ]
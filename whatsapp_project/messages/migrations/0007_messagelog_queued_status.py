@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_messages', '0006_messagelog_whatsapp_message_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='messagelog',
+            name='classification_status',
+            field=models.CharField(choices=[('classified', 'Classified'), ('pending', 'Pending'), ('processing', 'Processing'), ('queued', 'Queued')], db_index=True, default='classified', max_length=20),
+        ),
+    ]
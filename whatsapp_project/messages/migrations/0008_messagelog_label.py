@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_messages', '0007_messagelog_queued_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagelog',
+            name='label',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_messages', '0008_messagelog_label'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagelog',
+            name='rules_version',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:55
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_messages', '0009_messagelog_rules_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelegramChatRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.CharField(max_length=64, unique=True)),
+                ('next_send_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'whatsapp_messages_telegramchatrate',
+            },
+        ),
+    ]
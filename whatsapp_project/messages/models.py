@@ -1,11 +1,100 @@
 from django.db import models
+from django.utils import timezone
 
 class MessageLog(models.Model):
+    # Borderline messages wait as PENDING until a background worker asks Gemini;
+    # messages shed by a full ingest queue wait as QUEUED, not yet classified at all
+    CLASSIFIED='classified'
+    PENDING='pending'
+    PROCESSING='processing'
+    QUEUED='queued'
+    STATUS_CHOICES=[
+        (CLASSIFIED,'Classified'),
+        (PENDING,'Pending'),
+        (PROCESSING,'Processing'),
+        (QUEUED,'Queued'),
+    ]
+
     source=models.CharField(max_length=20,default='Whatsapp')
     raw_text=models.TextField()
     is_relevant=models.BooleanField(default=False)
     forwarded_to_telegram=models.BooleanField(default=False)
     created_at=models.DateTimeField(auto_now_add=True)
+    # Near-duplicate reposts point at the forwarded original instead of being sent again
+    duplicate_of=models.ForeignKey('self',null=True,blank=True,on_delete=models.SET_NULL,related_name='duplicates')
+    minhash=models.BinaryField(null=True,blank=True)
+    sender_info=models.JSONField(default=dict,blank=True)
+    classification_rule=models.CharField(max_length=50,blank=True,default='')
+    # Version of the rule set that classified the message (see messages/rules.py)
+    rules_version=models.CharField(max_length=64,blank=True,default='')
+    classification_status=models.CharField(max_length=20,choices=STATUS_CHOICES,default=CLASSIFIED,db_index=True)
+    classification_attempts=models.PositiveSmallIntegerField(default=0)
+    claimed_at=models.DateTimeField(null=True,blank=True)
+    # WhatsApp's own message key; gateway redeliveries of a stored message are skipped
+    wa_message_id=models.CharField(max_length=128,blank=True,default='')
+    remote_jid=models.CharField(max_length=128,blank=True,default='')
+    # Reviewed relevance (None until someone checks it); training data for the local classifier
+    label=models.BooleanField(null=True,blank=True)
     
     class Meta:
-        db_table = 'whatsapp_messages_messagelog'
\ No newline at end of file
+        db_table = 'whatsapp_messages_messagelog'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['remote_jid', 'wa_message_id'],
+                condition=~models.Q(wa_message_id=''),
+                name='unique_whatsapp_message'
+            ),
+        ]
+
+class GeminiVerdict(models.Model):
+    """Gemini classification shared by every worker and kept across deploys"""
+    text_hash=models.CharField(max_length=64)
+    prompt_version=models.CharField(max_length=20)
+    category=models.CharField(max_length=100)
+    confidence=models.FloatField(default=0.0)
+    explanation=models.TextField(blank=True,default='')
+    created_at=models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'whatsapp_messages_geminiverdict'
+        constraints = [
+            models.UniqueConstraint(fields=['text_hash', 'prompt_version'], name='unique_gemini_verdict'),
+        ]
+
+class TelegramOutbox(models.Model):
+    """A Telegram delivery, written in the same transaction as the MessageLog it forwards"""
+    PENDING='pending'
+    SENDING='sending'
+    SENT='sent'
+    FAILED='failed'
+    STATUS_CHOICES=[
+        (PENDING,'Pending'),
+        (SENDING,'Sending'),
+        (SENT,'Sent'),
+        (FAILED,'Failed'),
+    ]
+
+    message_log=models.ForeignKey(MessageLog,null=True,blank=True,on_delete=models.CASCADE,related_name='telegram_outbox')
+    chat_id=models.CharField(max_length=64)
+    text=models.TextField()
+    status=models.CharField(max_length=20,choices=STATUS_CHOICES,default=PENDING,db_index=True)
+    attempts=models.PositiveSmallIntegerField(default=0)
+    next_attempt_at=models.DateTimeField(default=timezone.now,db_index=True)
+    claimed_at=models.DateTimeField(null=True,blank=True)
+    sent_at=models.DateTimeField(null=True,blank=True)
+    last_error=models.TextField(blank=True,default='')
+    # One {"at", "status", "latency_ms", "error"} entry per delivery attempt
+    attempt_log=models.JSONField(default=list,blank=True)
+    created_at=models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'whatsapp_messages_telegramoutbox'
+
+class TelegramChatRate(models.Model):
+    """A chat's send pacing, shared by every worker and dispatcher that sends to it"""
+    chat_id=models.CharField(max_length=64,unique=True)
+    # When the chat's send allowance is back to full; a send is allowed while it is less than a burst ahead
+    next_send_at=models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'whatsapp_messages_telegramchatrate'
@@ -0,0 +1,110 @@
+"""
+Background completion of classifications deferred to Gemini.
+
+With GEMINI_ASYNC enabled the webhook stores borderline messages as PENDING
+instead of waiting on Gemini; the process_pending_messages command claims them
+and finishes the job here. Messages shed by a full ingest queue (QUEUED) get
+their first classification here too.
+"""
+import logging
+
+from .dedup import get_near_duplicate_index, minhash_signature
+from .filter import classify_batch, classify_message_batch, gemini_intent_check, is_hiring_intent
+from .forwarding import forward_opportunity
+from .models import MessageLog
+
+logger = logging.getLogger(__name__)
+
+# A message whose Gemini call keeps failing is given up on (as not relevant)
+MAX_GEMINI_ATTEMPTS = 3
+
+
+def process_pending_message(message_log: MessageLog, timeout: float = None) -> bool:
+    """Ask Gemini about a deferred message, update its row and forward it if relevant"""
+    result = gemini_intent_check(message_log.raw_text, timeout=timeout)
+    return apply_gemini_result(message_log, result)
+
+
+def process_pending_batch(message_logs: list, timeout: float = None) -> int:
+    """Classify several deferred messages with batched Gemini prompts; returns how many were relevant"""
+    results = classify_batch([message_log.raw_text for message_log in message_logs], timeout=timeout)
+    return sum(
+        1 for message_log, result in zip(message_logs, results)
+        if apply_gemini_result(message_log, result)
+    )
+
+
+def apply_gemini_result(message_log: MessageLog, result: dict) -> bool:
+    """Record Gemini's answer for a deferred message and forward it if relevant"""
+    message_log.claimed_at = None
+
+    if result.get("skipped"):
+        # Rate limited or circuit open: not the message's fault, requeue without using an attempt
+        message_log.classification_status = MessageLog.PENDING
+        message_log.save(update_fields=['classification_status', 'claimed_at'])
+        return False
+
+    message_log.classification_attempts += 1
+
+    if result.get("error"):
+        if message_log.classification_attempts < MAX_GEMINI_ATTEMPTS:
+            # Back in the queue for another worker pass
+            message_log.classification_status = MessageLog.PENDING
+        else:
+            logger.warning(f"Giving up on Gemini after {message_log.classification_attempts} attempts: {message_log.raw_text[:40]}...")
+            message_log.classification_status = MessageLog.CLASSIFIED
+            message_log.classification_rule = 'gemini_error'
+        message_log.save(update_fields=['classification_status', 'classification_rule',
+                                        'classification_attempts', 'claimed_at'])
+        return False
+
+    return finish_classification(message_log, is_hiring_intent(result), 'gemini')
+
+
+def process_queued_messages(message_logs: list) -> int:
+    """
+    Classify messages a full ingest queue stored unclassified; borderline ones
+    move on to PENDING for the Gemini pass. Returns how many were relevant.
+    """
+    relevant = 0
+    classifications = classify_message_batch([message_log.raw_text for message_log in message_logs], defer_gemini=True)
+    for message_log, classification in zip(message_logs, classifications):
+        message_log.claimed_at = None
+        message_log.rules_version = classification['rules_version']
+
+        if classification['rule'] == 'gemini_pending':
+            message_log.classification_status = MessageLog.PENDING
+            message_log.classification_rule = classification['rule']
+            message_log.save(update_fields=['classification_status', 'classification_rule', 'rules_version',
+                                            'claimed_at'])
+            continue
+
+        if finish_classification(message_log, bool(classification['is_job']), classification['rule']):
+            relevant += 1
+    return relevant
+
+
+def finish_classification(message_log: MessageLog, is_relevant: bool, rule: str) -> bool:
+    """Record the final verdict for a background-classified message and forward it if relevant"""
+    message_log.is_relevant = is_relevant
+    message_log.classification_status = MessageLog.CLASSIFIED
+    message_log.classification_rule = rule
+
+    signature = ()
+    if is_relevant:
+        # A repost may have been forwarded while this one waited in the queue
+        near_duplicates = get_near_duplicate_index()
+        if near_duplicates is not None:
+            signature = minhash_signature(message_log.raw_text)
+            original_id = near_duplicates.find(signature)
+            if original_id:
+                message_log.duplicate_of_id = original_id
+
+    message_log.save(update_fields=['is_relevant', 'classification_status', 'classification_rule', 'rules_version',
+                                    'classification_attempts', 'claimed_at', 'duplicate_of'])
+    logger.info(f"Background classification finished ({rule}): relevant={is_relevant} - '{message_log.raw_text[:40]}...'")
+
+    if is_relevant and not message_log.duplicate_of_id:
+        forward_opportunity(message_log, signature)
+
+    return is_relevant
@@ -0,0 +1,209 @@
+"""
+Stage pipeline behind the rule engine in filter.py.
+
+A message runs through registered stages until one decides it. A stage's
+decide() returns a verdict dict (accept or reject) or None to continue.
+Reorderable stages must come first and may only reject. Every such order
+gives the same is_job, so with adaptive ordering on, the pipeline
+periodically moves the cheapest, most decisive ones to the front, based on
+what it measured on live traffic. Only the deciding rule can differ, when
+several stages would have rejected the same message. The stages after them
+(accepting rules, the local model, Gemini) always keep their place.
+"""
+import threading
+import time
+
+
+class MessageContext:
+    """
+    One message on its way through the pipeline, with the rule set every stage
+    uses for it; the keyword scan runs once, on first use
+    """
+
+    __slots__ = ('message', 'message_lower', 'rules', 'use_gemini', 'defer_gemini', 'prepared', '_hits',
+                 'scan_seconds')
+
+    def __init__(self, message: str, rules, use_gemini: bool = True, defer_gemini: bool = False):
+        self.message = message
+        self.message_lower = message.lower()
+        self.rules = rules
+        self.use_gemini = use_gemini
+        self.defer_gemini = defer_gemini
+        # Stage name -> whatever that stage's prepare() worked out for this message
+        self.prepared = {}
+        self._hits = None
+        self.scan_seconds = 0.0
+
+    @property
+    def hits(self) -> dict:
+        if self._hits is None:
+            started = time.perf_counter()
+            self._hits = self.rules.matcher.scan(self.message_lower)
+            self.scan_seconds = time.perf_counter() - started
+        return self._hits
+
+
+class Stage:
+    """
+    One classifier rule. `uses_hits` marks stages that read the shared keyword
+    scan, so the first of them to run is expected to pay for it
+    """
+    name = ''
+    reorderable = False
+    uses_hits = False
+
+    def decide(self, context: MessageContext):
+        raise NotImplementedError
+
+    def prepare(self, contexts: list):
+        """
+        Called by run_many() with every message of a batch about to reach this
+        stage, so per-message work can be done for all of them at once
+        """
+
+
+class ClassifierPipeline:
+    def __init__(self, stages: list, adaptive: bool = False, reorder_every: int = 1000):
+        reorderable = 0
+        while reorderable < len(stages) and stages[reorderable].reorderable:
+            reorderable += 1
+        if any(stage.reorderable for stage in stages[reorderable:]):
+            raise ValueError("Reorderable stages must come before the fixed ones")
+
+        self.stages = tuple(stages)
+        self.adaptive = adaptive
+        self.reorder_every = reorder_every
+        self._reorderable = reorderable
+        self._order = self.stages
+        self._lock = threading.Lock()
+        # name -> [calls, decided, seconds]: lifetime totals, and a window that decays at every reorder
+        self._totals = {stage.name: [0, 0, 0.0] for stage in stages}
+        self._window = {stage.name: [0, 0, 0.0] for stage in stages}
+        self._scan = [0, 0.0]
+        self._runs = 0
+        self._reorders = 0
+
+    def run(self, context: MessageContext) -> dict:
+        """The first verdict a stage returns; the last stage must always decide"""
+        timings = []
+        verdict = None
+        for stage in self._order:
+            scanned = context.scan_seconds
+            started = time.perf_counter()
+            verdict = stage.decide(context)
+            # The shared scan is booked separately, not to whichever stage happened to trigger it
+            elapsed = time.perf_counter() - started - (context.scan_seconds - scanned)
+            timings.append((stage.name, elapsed, verdict is not None))
+            if verdict is not None:
+                break
+        self._record(timings, context.scan_seconds)
+        return verdict
+
+    def run_many(self, contexts: list) -> list:
+        """
+        run() for a batch, stage by stage: each stage is prepared once with all
+        the messages that reach it. One verdict per context, in order.
+        """
+        order = self._order
+        verdicts = [None] * len(contexts)
+        timings = [[] for _ in contexts]
+        undecided = list(range(len(contexts)))
+        for stage in order:
+            if not undecided:
+                break
+            started = time.perf_counter()
+            stage.prepare([contexts[index] for index in undecided])
+            # The batch's preparation is shared out evenly over the messages it served
+            prepared = (time.perf_counter() - started) / len(undecided)
+            still_undecided = []
+            for index in undecided:
+                context = contexts[index]
+                scanned = context.scan_seconds
+                started = time.perf_counter()
+                verdict = stage.decide(context)
+                elapsed = time.perf_counter() - started - (context.scan_seconds - scanned) + prepared
+                timings[index].append((stage.name, elapsed, verdict is not None))
+                if verdict is None:
+                    still_undecided.append(index)
+                else:
+                    verdicts[index] = verdict
+            undecided = still_undecided
+        for context, context_timings in zip(contexts, timings):
+            self._record(context_timings, context.scan_seconds)
+        return verdicts
+
+    def _record(self, timings: list, scan_seconds: float):
+        with self._lock:
+            for name, elapsed, decided in timings:
+                for stats in (self._totals[name], self._window[name]):
+                    stats[0] += 1
+                    stats[1] += decided
+                    stats[2] += elapsed
+            if scan_seconds:
+                self._scan[0] += 1
+                self._scan[1] += scan_seconds
+            self._runs += 1
+            if self.adaptive and self._runs % self.reorder_every == 0:
+                self._reorder()
+
+    def _reorder(self):
+        """
+        Greedy order for the reorderable stages: next comes the one with the least
+        expected cost per decision (its own cost, plus the keyword scan if it
+        would be the first to need it, over the share of messages it decides)
+        """
+        scan_cost = self._scan[1] / self._scan[0] if self._scan[0] else 0.0
+        remaining = list(self._order[:self._reorderable])
+        order = []
+        scanned = False
+        while remaining:
+            def rank(stage):
+                calls, decided, seconds = self._window[stage.name]
+                if not calls or not decided:
+                    return float('inf')
+                cost = seconds / calls + (scan_cost if stage.uses_hits and not scanned else 0.0)
+                return cost / (decided / calls)
+            best = min(remaining, key=rank)
+            remaining.remove(best)
+            order.append(best)
+            scanned = scanned or best.uses_hits
+        self._order = tuple(order) + self._order[self._reorderable:]
+        self._reorders += 1
+        # Older traffic counts half at every reorder, so the order follows shifts in the mix
+        for stats in self._window.values():
+            stats[0] //= 2
+            stats[1] //= 2
+            stats[2] /= 2
+
+    def reset_order(self):
+        """
+        Back to the registered order, with the adaptive window cleared; the
+        lifetime totals behind stats() (and the exported counters) are kept
+        """
+        with self._lock:
+            self._order = self.stages
+            self._window = {stage.name: [0, 0, 0.0] for stage in self.stages}
+
+    def stats(self) -> dict:
+        """Current order and, per stage, how often it ran, how often it decided and its mean cost"""
+        with self._lock:
+            return {
+                "order": [stage.name for stage in self._order],
+                "adaptive": self.adaptive,
+                "runs": self._runs,
+                "reorders": self._reorders,
+                "keyword_scan": {
+                    "calls": self._scan[0],
+                    "mean_us": round(self._scan[1] / self._scan[0] * 1e6, 1) if self._scan[0] else 0.0,
+                },
+                "stages": {
+                    name: {
+                        "calls": calls,
+                        "decided": decided,
+                        "decisiveness": round(decided / calls, 4) if calls else 0.0,
+                        "mean_us": round(seconds / calls * 1e6, 1) if calls else 0.0,
+                        "seconds": seconds,
+                    }
+                    for name, (calls, decided, seconds) in self._totals.items()
+                },
+            }
@@ -0,0 +1,185 @@
+"""
+Rate limiting and circuit breaking for calls to external services (Gemini,
+Telegram). Both are in-process and thread-safe; every thread of a worker
+shares the same instance.
+"""
+import threading
+import time
+from collections import deque
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.throttled = 0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Take tokens if available right now"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                self.granted += 1
+                return True
+            self.throttled += 1
+            return False
+
+    def acquire(self, tokens: float = 1, timeout: float = None) -> bool:
+        """Wait until tokens are available, giving up after timeout seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    self.granted += 1
+                    return True
+                wait = (tokens - self._tokens) / self.rate if self.rate > 0 else float('inf')
+                if deadline is not None and now + wait > deadline:
+                    self.throttled += 1
+                    return False
+            time.sleep(wait)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "rate_per_second": self.rate,
+                "capacity": self.capacity,
+                "tokens": round(self._tokens, 2),
+                "granted": self.granted,
+                "throttled": self.throttled,
+            }
+
+
+class CircuitBreaker:
+    """
+    Opens when the recent error rate (slow calls count as errors) crosses a
+    threshold, rejects calls while open, then lets a single probe through after
+    a cooldown (half-open) and closes again if it succeeds.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, error_rate_threshold: float = 0.5, min_calls: int = 5,
+                 window_seconds: float = 60.0, slow_call_seconds: float = 10.0,
+                 cooldown_seconds: float = 30.0):
+        self.name = name
+        self.error_rate_threshold = error_rate_threshold
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.cooldown_seconds = cooldown_seconds
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._calls = deque()  # (finished_at, failed, latency) within the window
+        self.counters = {"calls": 0, "failures": 0, "slow_calls": 0, "rejected": 0, "opened": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == self.OPEN and now - self._opened_at >= self.cooldown_seconds:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now; callers must then record its outcome"""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.counters["rejected"] += 1
+            return False
+
+    def cancel(self):
+        """An allowed call was not made after all; a half-open breaker lets the next caller probe"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record_success(self, latency: float):
+        self._record(failed=latency >= self.slow_call_seconds, latency=latency)
+
+    def record_failure(self, latency: float):
+        self._record(failed=True, latency=latency)
+
+    def _record(self, failed: bool, latency: float):
+        now = time.monotonic()
+        with self._lock:
+            self.counters["calls"] += 1
+            if failed:
+                self.counters["failures"] += 1
+            if latency >= self.slow_call_seconds:
+                self.counters["slow_calls"] += 1
+
+            if self._current_state(now) == self.HALF_OPEN:
+                # The probe decides: recover or wait out another cooldown
+                self._probe_in_flight = False
+                if failed:
+                    self._open(now)
+                else:
+                    self._state = self.CLOSED
+                    self._calls.clear()
+                return
+
+            self._calls.append((now, failed, latency))
+            self._prune(now)
+            failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+            if (self._state == self.CLOSED and len(self._calls) >= self.min_calls
+                    and failures / len(self._calls) >= self.error_rate_threshold):
+                self._open(now)
+
+    def _open(self, now: float):
+        self._state = self.OPEN
+        self._opened_at = now
+        self.counters["opened"] += 1
+        self._calls.clear()
+
+    def _prune(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            self._prune(now)
+            recent = len(self._calls)
+            failures = sum(1 for _, failed, _ in self._calls if failed)
+            latency = sum(call_latency for _, _, call_latency in self._calls)
+            return {
+                "name": self.name,
+                "state": state,
+                "recent_calls": recent,
+                "recent_error_rate": round(failures / recent, 3) if recent else 0.0,
+                "recent_avg_latency": round(latency / recent, 3) if recent else 0.0,
+                "seconds_until_probe": (
+                    round(max(0.0, self.cooldown_seconds - (now - self._opened_at)), 1)
+                    if state == self.OPEN else 0.0
+                ),
+                **self.counters,
+            }
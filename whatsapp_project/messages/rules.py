@@ -0,0 +1,256 @@
+"""
+Versioned rule sets: the keyword lists and rejection regexes the classifier runs on.
+
+The built-in rules are the lists in filter.py. With RULES_FILE set, workers
+run on a JSON file instead; `python manage.py export_rules` writes one to
+start from. The file is stat'ed at most every RULES_CHECK_SECONDS. Only when
+its mtime or size changes is it read, validated and compiled (once per
+version). The new rule set is then swapped in with a single reference
+assignment, so a message is always classified by one complete version. A
+file that fails to load leaves the running rules in place.
+
+Reject regexes from a file must not be able to backtrack catastrophically:
+unbounded greedy or lazy quantifiers (`.*`, `\s+`) and quantifiers nested in
+other quantifiers are refused at load time (see pattern_risk); use bounded
+`{0,n}` ranges or possessive `*+` / `++` as the built-in rules do.
+
+A version is the file's declared "version" plus a hash of the resolved rules,
+so an edit that forgets to bump the declared version still gets a new one.
+Verdicts carry it, and the classifier cache is keyed on it.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from decouple import config
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from .matcher import KeywordMatcher
+
+logger = logging.getLogger(__name__)
+
+RULES_FILE = config('RULES_FILE', default='')
+RULES_CHECK_SECONDS = config('RULES_CHECK_SECONDS', default=5.0, cast=float)
+
+# Compiled rule sets kept per worker, so flipping back to a recent version costs nothing
+COMPILED_VERSIONS = 4
+# classification_rule holds "regex:<name>"
+MAX_RULE_NAME_LENGTH = 40
+# A file can widen the reject scan window up to this many characters, not unbound it
+MAX_REJECT_SCAN_LIMIT = 20000
+# Stamp of a rules file that doesn't exist (yet)
+MISSING = 'missing'
+
+
+def rules_version(declared: str, keywords: dict, reject_rules: tuple, max_reject_scan_chars: int) -> str:
+    canonical = json.dumps([keywords, reject_rules, max_reject_scan_chars], sort_keys=True, ensure_ascii=False)
+    return f"{declared}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:10]}"
+
+
+class RuleSet:
+    """One compiled, immutable version of the rules"""
+
+    def __init__(self, keywords: dict, reject_rules, max_reject_scan_chars: int, declared_version: str):
+        self.keywords = {category: tuple(words) for category, words in keywords.items()}
+        self.reject_rules = tuple((name, pattern) for name, pattern in reject_rules)
+        self.max_reject_scan_chars = max_reject_scan_chars
+        self.declared_version = declared_version
+        self.version = rules_version(declared_version, self.keywords, self.reject_rules, max_reject_scan_chars)
+        self.matcher = KeywordMatcher(self.keywords)
+        self.compiled_reject_rules = tuple((name, re.compile(pattern)) for name, pattern in self.reject_rules)
+
+    def match_reject_rule(self, message_lower: str):
+        """Return the name of the first immediate rejection rule that fires, or None"""
+        text = message_lower[:self.max_reject_scan_chars]
+        for name, pattern in self.compiled_reject_rules:
+            if pattern.search(text):
+                return name
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.declared_version,
+            "keywords": {category: list(words) for category, words in self.keywords.items()},
+            "reject_rules": [[name, pattern] for name, pattern in self.reject_rules],
+            "max_reject_scan_chars": self.max_reject_scan_chars,
+        }
+
+
+def pattern_risk(pattern: str):
+    """
+    Why a reject regex could backtrack catastrophically (an unbounded greedy or
+    lazy quantifier, or a quantifier nested in another), or None if it can't
+    """
+    return _tree_risk(sre_parse.parse(pattern), repeated=False, atomic=False)
+
+
+def _tree_risk(tree, repeated: bool, atomic: bool):
+    for op, argument in tree:
+        subtrees, inner_repeated, inner_atomic = [], repeated, atomic
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, sre_parse.POSSESSIVE_REPEAT):
+            low, high, body = argument
+            if repeated and high > 1:
+                return "a quantifier nested in another quantifier"
+            # Possessive quantifiers and atomic groups never give back what they matched
+            if high == sre_parse.MAXREPEAT and op != sre_parse.POSSESSIVE_REPEAT and not atomic:
+                return "an unbounded quantifier (use {0,n} or a possessive *+ / ++)"
+            subtrees, inner_repeated = [body], repeated or high > 1
+        elif op == sre_parse.SUBPATTERN:
+            subtrees = [argument[-1]]
+        elif op == sre_parse.BRANCH:
+            subtrees = argument[1]
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            subtrees = [argument[1]]
+        elif op == sre_parse.ATOMIC_GROUP:
+            subtrees, inner_atomic = [argument], True
+        elif op == sre_parse.GROUPREF_EXISTS:
+            subtrees = [branch for branch in argument[1:] if branch]
+        for subtree in subtrees:
+            risk = _tree_risk(subtree, inner_repeated, inner_atomic)
+            if risk:
+                return risk
+    return None
+
+
+def parse_rules(data, defaults: RuleSet) -> tuple:
+    """
+    (declared version, keywords, reject rules, scan cap) from a rules file's JSON;
+    keyword categories and keys the file leaves out keep their built-in value
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Rules file must hold a JSON object")
+
+    keywords = dict(defaults.keywords)
+    for category, words in data.get('keywords', {}).items():
+        if category not in keywords:
+            raise ValueError(f"Unknown keyword category {category!r} (expected one of {', '.join(keywords)})")
+        if not isinstance(words, list) or not all(isinstance(word, str) for word in words):
+            raise ValueError(f"Keywords for {category!r} must be a list of strings")
+        keywords[category] = tuple(words)
+
+    reject_rules = defaults.reject_rules
+    if 'reject_rules' in data:
+        reject_rules = []
+        for rule in data['reject_rules']:
+            if not (isinstance(rule, list) and len(rule) == 2 and all(isinstance(part, str) for part in rule)):
+                raise ValueError(f"Reject rule {rule!r} must be a [name, pattern] pair")
+            if len(rule[0]) > MAX_RULE_NAME_LENGTH:
+                raise ValueError(f"Reject rule name {rule[0]!r} is longer than {MAX_RULE_NAME_LENGTH} characters")
+            risk = pattern_risk(rule[1])
+            if risk:
+                raise ValueError(f"Reject rule {rule[0]!r} has {risk}")
+            reject_rules.append(tuple(rule))
+        reject_rules = tuple(reject_rules)
+
+    max_reject_scan_chars = data.get('max_reject_scan_chars', defaults.max_reject_scan_chars)
+    if (isinstance(max_reject_scan_chars, bool) or not isinstance(max_reject_scan_chars, int)
+            or not 0 < max_reject_scan_chars <= MAX_REJECT_SCAN_LIMIT):
+        raise ValueError(f"max_reject_scan_chars must be an integer from 1 to {MAX_REJECT_SCAN_LIMIT}")
+    declared = str(data.get('version', 'file'))[:40]
+    return declared, keywords, reject_rules, max_reject_scan_chars
+
+
+class RuleStore:
+    """
+    The rules a worker classifies with: the built-in set, or RULES_FILE's
+    latest version that loaded cleanly
+    """
+
+    def __init__(self, defaults: RuleSet, path: str = '', check_seconds: float = RULES_CHECK_SECONDS,
+                 on_change=None):
+        self.defaults = defaults
+        self.check_seconds = check_seconds
+        self.on_change = on_change
+        self._rules = defaults
+        self._compiled = OrderedDict([(defaults.version, defaults)])
+        self._lock = threading.Lock()
+        self._counters = {"checks": 0, "reloads": 0, "errors": 0}
+        self.last_error = ''
+        self.watch(path)
+
+    def watch(self, path: str):
+        """Follow another rules file (loaded on the next current() call); '' for the built-in rules"""
+        self.path = path
+        self._stamp = None
+        self._checked_at = float('-inf')
+        if not path:
+            self._swap(self.defaults)
+
+    def current(self) -> RuleSet:
+        if self.path and time.monotonic() - self._checked_at >= self.check_seconds:
+            self.refresh()
+        return self._rules
+
+    def refresh(self):
+        """Reload the file if its mtime or size changed; load errors are logged and the rules kept"""
+        # Whoever holds the lock is already checking; everyone else keeps the current rules
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            self._counters["checks"] += 1
+            try:
+                stat = os.stat(self.path)
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                if stamp == self._stamp:
+                    return
+                # Set before loading, so a broken file is reported once rather than at every check
+                self._stamp = stamp
+                rules = self.load(self.path)
+            except (OSError, ValueError, TypeError, re.error) as e:
+                if self._stamp == MISSING:
+                    return
+                if isinstance(e, FileNotFoundError):
+                    self._stamp = MISSING
+                self._counters["errors"] += 1
+                self.last_error = str(e)
+                logger.error(f"❌ Could not load rules from {self.path}, keeping {self._rules.version}: {e}")
+                return
+            self.last_error = ''
+            self._swap(rules)
+        finally:
+            self._lock.release()
+
+    def load(self, path: str) -> RuleSet:
+        """Read, validate and compile a rules file (compiled sets are reused per version)"""
+        with open(path, encoding='utf-8') as rules_file:
+            declared, keywords, reject_rules, max_chars = parse_rules(json.load(rules_file), self.defaults)
+        version = rules_version(declared, keywords, reject_rules, max_chars)
+        rules = self._compiled.get(version)
+        if rules is None:
+            rules = RuleSet(keywords, reject_rules, max_chars, declared)
+            self._compiled[version] = rules
+            while len(self._compiled) > COMPILED_VERSIONS:
+                self._compiled.popitem(last=False)
+        else:
+            self._compiled.move_to_end(version)
+        return rules
+
+    def _swap(self, rules: RuleSet):
+        if rules is self._rules:
+            return
+        previous, self._rules = self._rules, rules
+        self._counters["reloads"] += 1
+        logger.info(f"🔁 Classifier rules {previous.version} -> {rules.version}")
+        if self.on_change is not None:
+            self.on_change(rules)
+
+    def stats(self) -> dict:
+        rules = self._rules
+        return {
+            **self._counters,
+            "version": rules.version,
+            "source": self.path or 'builtin',
+            "keywords": sum(len(words) for words in rules.keywords.values()),
+            "reject_rules": len(rules.reject_rules),
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,292 @@
+"""
+Incremental reading of large webhook bodies.
+
+A history sync after a reconnect delivers thousands of messages in one body.
+Instead of json.loads on the whole thing, the document is read from the
+request stream a block at a time, the objects leading to the wanted array are
+walked key by key, and each array item is decoded on its own with
+JSONDecoder.raw_decode. Memory stays around one read block plus one message.
+A value longer than the buffered block is not re-decoded after every read:
+each new block is scanned once for where the value ends (_ValueEnd), and the
+value is decoded once it is complete. Values beside the path are scanned past
+the same way without being decoded, so a large sibling costs no memory.
+"""
+import codecs
+import json
+import re
+
+STREAM_READ_SIZE = 64 * 1024
+
+# Scalars met beside the path are kept in `values` only up to this many characters of JSON
+MAX_KEPT_SCALAR_CHARS = 1024
+
+_STRUCTURE = re.compile(r'["{}\[\]]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[,\]}\s]')
+# Inside a container: everything up to the next bracket or unterminated string, whole strings included
+_CONTAINER_RUN = re.compile(r'(?:[^"{}\[\]]++|"(?:[^"\\]++|\\.)*+")*+')
+
+
+class _ValueEnd:
+    """
+    Finds where a JSON value ends across consecutive blocks of text, carrying
+    its nesting depth and string/escape state from one block to the next
+    """
+
+    def __init__(self, first_char: str):
+        self.scalar = first_char not in '{["'
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text: str, start: int):
+        """Index just past the value's end in text, or None if it continues in the next block"""
+        if self.scalar:
+            match = _SCALAR_END.search(text, start)
+            return match.start() if match else None
+
+        index = start
+        while index < len(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                    index += 1
+                    continue
+                match = _STRING_SPECIAL.search(text, index)
+                if match is None:
+                    return None
+                index = match.end()
+                if match.group() == '\\':
+                    self.escaped = True
+                    continue
+                self.in_string = False
+                if self.depth == 0:
+                    return index
+                continue
+
+            if self.depth:
+                index = _CONTAINER_RUN.match(text, index).end()
+            match = _STRUCTURE.search(text, index)
+            if match is None:
+                return None
+            index = match.end()
+            char = match.group()
+            if char == '"':
+                self.in_string = True
+            elif char in '{[':
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    return index
+        return None
+
+
+class StreamingJSONArray:
+    """
+    Iterate the items of the array at `path` (a tuple of object keys) in a JSON
+    document read from `stream`. Scalars met on the way are kept in `values`,
+    keyed by their own path, e.g. values[('data', 'event')].
+    """
+
+    def __init__(self, stream, path: tuple, read_size: int = STREAM_READ_SIZE):
+        self.stream = stream
+        self.path = tuple(path)
+        self.read_size = read_size
+        self.values = {}
+        self.bytes_read = 0
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._head = None
+        self._unread = b''
+
+    def __iter__(self):
+        return self._walk(())
+
+    def head(self) -> bytes:
+        """The first block of raw bytes, for sniffing the document before (not while) it is walked"""
+        if self._head is None:
+            self._head = self._unread = self._read_raw()
+        return self._head
+
+    def _read_raw(self) -> bytes:
+        if self._unread:
+            data, self._unread = self._unread, b''
+            return data
+        data = self.stream.read(self.read_size)
+        self.bytes_read += len(data)
+        return data
+
+    def _read_block(self) -> str:
+        """Decoded text of the next block ('' once the stream is exhausted)"""
+        if self._eof:
+            return ''
+        data = self._read_raw()
+        if not data:
+            self._eof = True
+            return self._utf8.decode(b'', final=True)
+        return self._utf8.decode(data)
+
+    def _fill(self) -> bool:
+        """Read the next block, dropping what has been consumed; False at end of stream"""
+        block = self._read_block()
+        if not block:
+            # A multi-byte character split across reads can leave a block decoding to nothing
+            if not self._eof:
+                return self._fill()
+            return False
+        self._buffer = self._buffer[self._pos:] + block
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Next non-whitespace character without consuming it ('' at end of document)"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def _take(self, expected: str):
+        char = self._peek()
+        if char not in expected:
+            raise ValueError(f"Malformed JSON: expected {expected!r}, got {char!r} after {self.bytes_read} bytes")
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """Decode one complete value, reading more of the stream if it isn't all buffered"""
+        self._peek()
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if self._eof:
+                raise
+            return self._long_value()
+        # A number cut by the end of the block ("12", "12.", "1e") only ends at a delimiter
+        if (not isinstance(value, (dict, list, str)) and end == len(self._buffer) and not self._eof):
+            return self._long_value()
+        self._pos = end
+        return value
+
+    def _long_value(self):
+        """
+        A value running past the buffered block: read blocks until its end turns
+        up, scanning each block once, then decode the collected text in one go
+        """
+        value_end = _ValueEnd(self._buffer[self._pos])
+        parts = []
+        start = self._pos
+        while True:
+            end = value_end.feed(self._buffer, start)
+            if end is not None:
+                break
+            parts.append(self._buffer[start:])
+            self._buffer = self._read_block()
+            self._pos = start = 0
+            if not self._buffer and self._eof:
+                end = 0
+                break
+        parts.append(self._buffer[start:end])
+        text = ''.join(parts)
+        value, consumed = self._decoder.raw_decode(text)
+        if consumed != len(text):
+            raise ValueError(f"Malformed JSON: unexpected data after a value, {self.bytes_read} bytes in")
+        self._pos = end
+        return value
+
+    def _skip(self, keep: int = 0):
+        """
+        Move past one value without keeping it. Returns the text of a scalar
+        of at most `keep` characters, else None.
+        """
+        char = self._peek()
+        if not char:
+            raise ValueError(f"Malformed JSON: document ends where a value was expected, {self.bytes_read} bytes in")
+        if char not in '{[':
+            return self._skip_scalar(keep)
+
+        # Decoded and dropped when it is all buffered, otherwise walked one child at a time
+        try:
+            self._pos = self._decoder.raw_decode(self._buffer, self._pos)[1]
+            return None
+        except json.JSONDecodeError:
+            if self._eof:
+                raise
+        closer = '}' if char == '{' else ']'
+        self._take(char)
+        if self._peek() == closer:
+            self._take(closer)
+            return None
+        while True:
+            if char == '{':
+                self._skip()
+                self._take(':')
+            self._skip()
+            if self._take(',' + closer) == closer:
+                return None
+
+    def _skip_scalar(self, keep: int):
+        """_skip for a string, number or literal, scanning each block once"""
+        value_end = _ValueEnd(self._buffer[self._pos])
+        parts = []
+        size = 0
+        start = self._pos
+        while True:
+            end = value_end.feed(self._buffer, start)
+            size += (len(self._buffer) if end is None else end) - start
+            if size <= keep:
+                parts.append(self._buffer[start:end])
+            if end is not None:
+                break
+            self._buffer = self._read_block()
+            self._pos = start = 0
+            if not self._buffer and self._eof:
+                raise ValueError(f"Malformed JSON: document ends inside a value, {self.bytes_read} bytes in")
+        self._pos = end
+        return ''.join(parts) if size <= keep else None
+
+    def _skip_value(self, path: tuple):
+        """Move past a value off the path, keeping it in `values` if it is a short scalar"""
+        text = self._skip(MAX_KEPT_SCALAR_CHARS)
+        if text is not None:
+            self.values[path] = self._decoder.decode(text)
+
+    def _walk(self, path: tuple):
+        if path == self.path:
+            if self._peek() != '[':
+                self._skip()
+                return
+            self._take('[')
+            if self._peek() == ']':
+                self._take(']')
+                return
+            while True:
+                yield self._value()
+                if self._take(',]') == ']':
+                    return
+
+        if self._peek() != '{':
+            self._skip_value(path)
+            return
+
+        target = self.path[len(path)]
+        self._take('{')
+        if self._peek() == '}':
+            self._take('}')
+            return
+        while True:
+            key = self._value()
+            self._take(':')
+            child = path + (key,)
+            if key == target:
+                yield from self._walk(child)
+            else:
+                self._skip_value(child)
+            if self._take(',}') == '}':
+                return
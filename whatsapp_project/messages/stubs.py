@@ -0,0 +1,176 @@
+"""
+Local stand-ins for Telegram and Gemini used by the benchmark and load-test
+commands, with configurable latency and error rates.
+
+Telegram is a real HTTP server speaking enough of the Bot API (sendMessage,
+including 429 responses with retry_after) for TelegramClient and
+AsyncTelegramClient. Gemini is stubbed at the model object, since the SDK's
+async calls can't be pointed at a local endpoint.
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+
+SINGLE_MESSAGE_PATTERN = re.compile(r'^Message: "(.*)"$', re.MULTILINE)
+BATCH_ITEM_PATTERN = re.compile(r'^\[(\d+)\] "(.*)"$', re.MULTILINE)
+
+
+class StubTelegramServer:
+    """Bot API sendMessage stub on 127.0.0.1, served from a background thread"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: float = 1.0, seed: int = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "sent": 0, "errors": 0, "rate_limited": 0}
+        self.messages = []
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                status, payload = stub._respond(body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _respond(self, body: bytes) -> tuple:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.counters["requests"] += 1
+            roll = self._random.random()
+            if roll < self.rate_limit_rate:
+                self.counters["rate_limited"] += 1
+                return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                             "parameters": {"retry_after": self.retry_after}}
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.counters["errors"] += 1
+                return 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+            self.counters["sent"] += 1
+            self.messages.append(body)
+            return 200, {"ok": True, "result": {"message_id": self.counters["sent"]}}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class StubGeminiModel:
+    """
+    GenerativeModel stand-in: answers "Client looking to hire freelancer" for
+    messages mentioning hiring and "General message" otherwise, after `latency`
+    seconds, failing `error_rate` of calls
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "errors": 0}
+
+    def _answer(self, prompt: str):
+        with self._lock:
+            self.counters["calls"] += 1
+            if self._random.random() < self.error_rate:
+                self.counters["errors"] += 1
+                raise RuntimeError("Stub Gemini error")
+
+        # Batched prompts list messages as [n] "text"; single prompts as Message: "text"
+        numbered = BATCH_ITEM_PATTERN.findall(prompt)
+        if numbered:
+            return SimpleNamespace(text="\n".join(
+                f"[{number}]\n{self._verdict(message)}" for number, message in numbered
+            ))
+        single = SINGLE_MESSAGE_PATTERN.search(prompt)
+        return SimpleNamespace(text=self._verdict(single.group(1) if single else ''))
+
+    @staticmethod
+    def _verdict(message: str) -> str:
+        if 'hiring' in message.lower():
+            return "Category: Client looking to hire freelancer\nConfidence: 0.92\nExplanation: Stub verdict"
+        return "Category: General message\nConfidence: 0.85\nExplanation: Stub verdict"
+
+    def generate_content(self, prompt, request_options=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._answer(prompt)
+
+    async def generate_content_async(self, prompt, request_options=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._answer(prompt)
+
+
+@contextmanager
+def stubbed_services(gemini_model: StubGeminiModel = None, telegram_server: StubTelegramServer = None,
+                     near_duplicates: bool = False, verdict_store: bool = True):
+    """
+    Route Gemini calls to gemini_model and Telegram sends to telegram_server for
+    the duration, lifting the rate limits and breaker that would otherwise
+    throttle a benchmark. Near-duplicate suppression is off unless asked for;
+    verdict_store=False keeps Gemini verdicts out of the database.
+    """
+    from . import dedup, filter, telegram
+    from .resilience import CircuitBreaker, TokenBucket
+
+    with ExitStack() as stack:
+        if gemini_model is not None:
+            stack.enter_context(mock.patch.object(filter, '_gemini_model', gemini_model))
+            stack.enter_context(mock.patch.object(filter, 'gemini_rate_limiter', TokenBucket(1e9, 1e9)))
+            stack.enter_context(mock.patch.object(
+                filter, 'gemini_breaker', CircuitBreaker('gemini-stub', min_calls=10 ** 9)
+            ))
+        if telegram_server is not None:
+            client = telegram.TelegramClient(
+                api_base=telegram_server.url, chat_rate_per_minute=1e9, chat_burst=10 ** 9
+            )
+            stack.enter_context(mock.patch.object(telegram, '_telegram_client', client))
+        if not verdict_store:
+            stack.enter_context(mock.patch.object(filter, 'load_stored_verdicts', lambda text_hashes: {}))
+            stack.enter_context(mock.patch.object(filter, 'store_verdicts', lambda results: None))
+        if not near_duplicates:
+            stack.enter_context(mock.patch.object(dedup, 'DEDUP_ENABLED', False))
+        yield
@@ -1,12 +1,34 @@
 import requests
+import asyncio
+import json
 import logging
+import random
 import re
+import threading
+import time
+import weakref
 from decouple import config
+from requests.adapters import HTTPAdapter
+from .metrics import inc, observe
+from .resilience import TokenBucket
+# httpx is only needed by the async webhook; without it async sends run on a worker thread
+try:
+    import httpx
+except ImportError:
+    httpx = None
 
 logger = logging.getLogger(__name__)
 
 BOT_TOKEN = config('BOT_TOKEN', default='7884745275:AAGTNI72u1ry0sYxmzPt2W3dwe_4ZTT2bJk')
 CHAT_ID = config('CHAT_ID', default='-4886371299')
+TELEGRAM_API_BASE = config('TELEGRAM_API_BASE', default='https://api.telegram.org')
+
+# Telegram allows about 20 messages per minute into one group
+TELEGRAM_CHAT_RATE_PER_MINUTE = config('TELEGRAM_CHAT_RATE_PER_MINUTE', default=20.0, cast=float)
+TELEGRAM_CHAT_BURST = config('TELEGRAM_CHAT_BURST', default=3, cast=int)
+TELEGRAM_MAX_RETRIES = config('TELEGRAM_MAX_RETRIES', default=3, cast=int)
+# Longest we are willing to block on retry_after / backoff before giving up
+TELEGRAM_MAX_RETRY_WAIT = config('TELEGRAM_MAX_RETRY_WAIT', default=30.0, cast=float)
 
 def escape_markdown_v2(text: str) -> str:
     """Escape special characters for Telegram MarkdownV2"""
@@ -28,55 +50,254 @@ def clean_message_for_telegram(text: str) -> str:
     text = re.sub(r'[🚀🌐📍💰🎯📩🏀⚽]+', '', text)
     
     return text.strip()
-def send_to_telegram(text: str, sender_info: dict = None):
+class TelegramClient:
     """
-    Send message to Telegram with only essential information
+    Bot API client with a pooled keep-alive session, exponential backoff that
+    honours Telegram's retry_after, and per-chat pacing under the group limit.
+    Its pacing only covers this process's send_message calls; outbox deliveries
+    pace on the rate every worker shares (forwarding.reserve_chat_slot).
+    """
+
+    def __init__(self, bot_token: str = BOT_TOKEN, api_base: str = TELEGRAM_API_BASE,
+                 max_retries: int = TELEGRAM_MAX_RETRIES, max_retry_wait: float = TELEGRAM_MAX_RETRY_WAIT,
+                 chat_rate_per_minute: float = TELEGRAM_CHAT_RATE_PER_MINUTE,
+                 chat_burst: int = TELEGRAM_CHAT_BURST, timeout: float = 10):
+        self.base_url = f"{api_base.rstrip('/')}/bot{bot_token}"
+        self.max_retries = max_retries
+        self.max_retry_wait = max_retry_wait
+        self.chat_rate_per_minute = chat_rate_per_minute
+        self.chat_burst = chat_burst
+        self.timeout = timeout
+
+        # One TLS connection is reused for every forward instead of a handshake each time
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=10)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._chat_buckets = {}
+        self._lock = threading.Lock()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        with self._lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(rate=self.chat_rate_per_minute / 60, capacity=self.chat_burst)
+                self._chat_buckets[chat_id] = bucket
+            return bucket
+
+    def post_message(self, chat_id, text: str) -> dict:
+        """
+        Make exactly one sendMessage call (no pacing, no retries) and describe the outcome:
+        {"ok": bool, "status": HTTP status or None, "retry_after": seconds or None, "error": str}
+        """
+        started = time.perf_counter()
+        try:
+            response = self.session.post(
+                f"{self.base_url}/sendMessage",
+                data={'chat_id': chat_id, 'text': text},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            result = {"ok": False, "status": None, "retry_after": None, "error": str(e)}
+        else:
+            result = self.describe_response(response.status_code, response.text)
+        return record_telegram_call(result, time.perf_counter() - started)
+
+    @staticmethod
+    def describe_response(status_code: int, body: str) -> dict:
+        """Outcome dict for a sendMessage response, with Telegram's retry_after on 429"""
+        if status_code == 200:
+            return {"ok": True, "status": 200, "retry_after": None, "error": ""}
+
+        retry_after = None
+        if status_code == 429:
+            try:
+                retry_after = float(json.loads(body).get('parameters', {}).get('retry_after'))
+            except (ValueError, TypeError, AttributeError):
+                retry_after = None
+        return {
+            "ok": False,
+            "status": status_code,
+            "retry_after": retry_after,
+            "error": body[:500]
+        }
+
+    @staticmethod
+    def is_retryable(result: dict) -> bool:
+        """Network errors, flood control and server errors are worth retrying"""
+        status = result["status"]
+        return status is None or status == 429 or status >= 500
+
+    def backoff_delay(self, attempt: int, result: dict, cap: float = None) -> float:
+        """Telegram's retry_after when given, else exponential backoff with jitter"""
+        if result.get("retry_after"):
+            return result["retry_after"]
+        # Clamped after the jitter, so the cap is never exceeded
+        return min(cap or self.max_retry_wait, 2 ** attempt * random.uniform(0.8, 1.2))
+
+    def acquire_slot(self, chat_id, timeout: float = 0) -> bool:
+        """
+        Take a send slot from this process's pacing of the chat; by default only if
+        one is free right now, so request paths never sleep here
+        """
+        return self._chat_bucket(chat_id).acquire(timeout=timeout)
+
+    def send_message(self, chat_id, text: str) -> bool:
+        """
+        Send with per-chat pacing and retries, blocking for up to max_retry_wait per
+        wait; True once Telegram accepted the message. Not for request paths.
+        """
+        for attempt in range(self.max_retries + 1):
+            if not self.acquire_slot(chat_id, timeout=self.max_retry_wait):
+                logger.error(f"Telegram send rate for chat {chat_id} exhausted, dropping message")
+                return False
+
+            result = self.post_message(chat_id, text)
+            if result["ok"]:
+                return True
+
+            if not self.is_retryable(result) or attempt == self.max_retries:
+                break
+
+            delay = self.backoff_delay(attempt, result)
+            if delay > self.max_retry_wait:
+                logger.error(f"Telegram asked to wait {delay:.0f}s, more than {self.max_retry_wait:.0f}s; giving up")
+                break
+            logger.warning(f"Telegram send failed ({result['status']}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+        logger.error(f"Failed to send to Telegram: {result['status']} - {result['error']}")
+        return False
+
+_telegram_client = None
+_telegram_client_lock = threading.Lock()
+
+def record_telegram_call(result: dict, seconds: float) -> dict:
+    """Count a sendMessage outcome by HTTP status ("network" when there was no response)"""
+    inc('telegram_requests_total', status=result["status"] or 'network')
+    observe('telegram_request_seconds', seconds)
+    return result
+
+
+def get_telegram_client() -> TelegramClient:
+    """Shared client for this worker, so the connection pool is reused"""
+    global _telegram_client
+    if _telegram_client is None:
+        with _telegram_client_lock:
+            if _telegram_client is None:
+                _telegram_client = TelegramClient()
+    return _telegram_client
+
+class AsyncTelegramClient:
     """
+    Async sendMessage for the ASGI webhook, sharing outcome handling with a
+    TelegramClient. Uses httpx when installed, else runs the sync client
+    on a worker thread.
+    """
+
+    def __init__(self, client: TelegramClient):
+        self.client = client
+        self._http = None
+        if httpx is not None:
+            self._http = httpx.AsyncClient(
+                timeout=client.timeout,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=10)
+            )
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+
+    async def post_message(self, chat_id, text: str) -> dict:
+        """One sendMessage call, same result shape as TelegramClient.post_message"""
+        if self._http is None:
+            return await asyncio.to_thread(self.client.post_message, chat_id, text)
+        started = time.perf_counter()
+        try:
+            response = await self._http.post(
+                f"{self.client.base_url}/sendMessage",
+                data={'chat_id': chat_id, 'text': text}
+            )
+        except httpx.HTTPError as e:
+            result = {"ok": False, "status": None, "retry_after": None, "error": str(e) or type(e).__name__}
+        else:
+            result = self.client.describe_response(response.status_code, response.text)
+        return record_telegram_call(result, time.perf_counter() - started)
+
+# httpx connections belong to the event loop that opened them
+_async_telegram_clients = weakref.WeakKeyDictionary()
+
+def get_async_telegram_client() -> AsyncTelegramClient:
+    """
+    Async client for the running event loop, backed by the worker's shared
+    client, and closed when the loop finishes
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_telegram_clients.get(loop)
+    if client is None:
+        client = _async_telegram_clients[loop] = AsyncTelegramClient(get_telegram_client())
+        # Under WSGI every async request runs in its own asyncio.run() loop, which cancels leftover
+        # tasks on the way out; this one closes the client's connections when that happens
+        client._closer = loop.create_task(_close_with_loop(client))
+    return client
+
+async def _close_with_loop(client: AsyncTelegramClient):
+    loop = asyncio.get_running_loop()
     try:
-        # Clean the message text to avoid Markdown parsing issues
-        clean_text = clean_message_for_telegram(text)
-        
-        # Build the message with only name, contact, and message
-        message_parts = ["🚀 NEW OPPORTUNITY!\n"]
-        
-        if sender_info:
-            # Add sender name (clean it too)
-            if sender_info.get('name'):
-                clean_name = clean_message_for_telegram(sender_info['name'])
-                message_parts.append(f"👤 Contact: {clean_name}")
-            
-            # Add contact number
-            contact_number = None
-            if sender_info.get('number'):
-                contact_number = sender_info['number'].replace('@s.whatsapp.net', '').replace('@g.us', '')
-            elif sender_info.get('participant'):
-                contact_number = sender_info['participant'].replace('@s.whatsapp.net', '')
-            
-            if contact_number:
-                message_parts.append(f"📱 Number: +{contact_number}")
-        
-        # Add the message
-        message_parts.append(f"\n💬 Message:\n{clean_text}")
+        await loop.create_future()
+    finally:
+        # The client holds this task, which holds the loop, so the entry must go explicitly
+        _async_telegram_clients.pop(loop, None)
+        await client.aclose()
+
+OPPORTUNITY_HEADER = "🚀 NEW OPPORTUNITY!\n"
+
+def format_telegram_message(text: str, sender_info: dict = None) -> str:
+    """Build the forwarded message with only name, contact, and message"""
+    return "\n".join([OPPORTUNITY_HEADER, format_opportunity_details(text, sender_info)])
+
+def format_opportunity_details(text: str, sender_info: dict = None) -> str:
+    """Name, number and message lines of a forward, without the header"""
+    # Clean the message text to avoid Markdown parsing issues
+    clean_text = clean_message_for_telegram(text)
+    
+    # Build the message with only name, contact, and message
+    message_parts = []
+    
+    if sender_info:
+        # Add sender name (clean it too)
+        if sender_info.get('name'):
+            clean_name = clean_message_for_telegram(sender_info['name'])
+            message_parts.append(f"👤 Contact: {clean_name}")
         
-        final_message = "\n".join(message_parts)
+        # Add contact number
+        contact_number = None
+        if sender_info.get('number'):
+            contact_number = sender_info['number'].replace('@s.whatsapp.net', '').replace('@g.us', '')
+        elif sender_info.get('participant'):
+            contact_number = sender_info['participant'].replace('@s.whatsapp.net', '')
         
+        if contact_number:
+            message_parts.append(f"📱 Number: +{contact_number}")
+    
+    # Add the message
+    message_parts.append(f"\n💬 Message:\n{clean_text}")
+    
+    return "\n".join(message_parts)
+
+def send_to_telegram(text: str, sender_info: dict = None):
+    """
+    Send message to Telegram with only essential information
+    """
+    try:
+        final_message = format_telegram_message(text, sender_info)
+
         # Use plain text instead of Markdown to avoid parsing issues
-        payload = {
-            'chat_id': CHAT_ID,
-            'text': final_message
-        }
-        
-        response = requests.post(
-            f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage", 
-            data=payload,
-            timeout=10
-        )
-        if response.status_code == 200:
+        success = get_telegram_client().send_message(CHAT_ID, final_message)
+        if success:
             logger.info(f"Message sent to Telegram successfully")
-            return True
-        else:
-            logger.error(f"Failed to send to Telegram: {response.status_code} - {response.text}")
-            return False
+        return success
             
     except Exception as e:
         logger.error(f"Error sending to Telegram: {e}")
@@ -1,3 +1,746 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import itertools
+import threading
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from . import filter, ingest, local_model, metrics
+from .claims import claim_batch
+from .dedup import NearDuplicateIndex, minhash_signature
+from .digest import TELEGRAM_MAX_MESSAGE_LENGTH, digest_header, digest_item, pack_digest
+from .events import event_stats
+from .filter import (
+    BUILTIN_RULES, CLASSIFIER_TEST_CASES, RULE_STORE, classification_cache_stats, classify_message,
+    classify_message_batch, clear_classification_cache, current_rules, match_reject_rule,
+)
+from .management.commands.bench_classifier import BRANCH_SEEDS, build_corpus
+from .matcher import KeywordMatcher
+from . import forwarding
+from .forwarding import OUTBOX_MAX_ATTEMPTS, OutboxSweeper, reserve_chat_slot
+from .models import MessageLog, TelegramChatRate, TelegramOutbox
+from .pipeline import ClassifierPipeline, MessageContext
+from .resilience import CircuitBreaker, TokenBucket
+from .rules import RuleSet, parse_rules, pattern_risk
+from .streaming import StreamingJSONArray
+from .telegram import TelegramClient, format_telegram_message
+from .work_queue import IngestQueue
+
+
+def sample_messages() -> list:
+    """The classifier test cases plus the benchmark corpus, short and long"""
+    corpus = build_corpus(5, 3000, 1)
+    return [message for message, _ in CLASSIFIER_TEST_CASES] + [
+        message for messages in corpus.values() for message in messages
+    ]
+
+
+class KeywordMatcherTests(SimpleTestCase):
+    """The Aho-Corasick matcher must find exactly what `keyword in text` checks would"""
+
+    def test_matches_substring_checks_on_every_category(self):
+        rules = current_rules()
+        for message in sample_messages():
+            text = message.lower()
+            hits = rules.matcher.scan(text)
+            for category, keywords in rules.keywords.items():
+                expected = {keyword.lower() for keyword in keywords if keyword and keyword.lower() in text}
+                self.assertEqual(hits[category], expected, f"{category}: {message[:60]!r}")
+
+    def test_overlapping_and_nested_keywords(self):
+        matcher = KeywordMatcher({'a': ['he', 'she', 'hers'], 'b': ['his', 'he'], 'c': []})
+        hits = matcher.scan('ushers and this')
+        self.assertEqual(hits, {'a': {'he', 'she', 'hers'}, 'b': {'he', 'his'}, 'c': set()})
+
+    def test_keywords_are_lowercased_and_deduplicated(self):
+        matcher = KeywordMatcher({'a': ['Hiring', 'hiring', '']})
+        self.assertEqual(matcher.categories['a'], ('hiring',))
+        self.assertEqual(matcher.scan('we are hiring')['a'], {'hiring'})
+
+
+class RejectRuleTests(SimpleTestCase):
+    def test_company_postings_hit_a_reject_rule(self):
+        self.assertEqual(match_reject_rule(BRANCH_SEEDS['regex'][0].lower()), 'in_hand_amount')
+        self.assertEqual(match_reject_rule('male & female candidates'), 'male_female')
+        self.assertEqual(match_reject_rule(BRANCH_SEEDS['regex'][1].lower()), 'what_we_offer')
+        self.assertEqual(match_reject_rule("salary 15000 to 17000 in hand"), 'salary_range')
+
+    def test_genuine_requirements_pass(self):
+        for message, expected in CLASSIFIER_TEST_CASES:
+            if expected:
+                self.assertIsNone(match_reject_rule(message.lower()), message)
+
+    def test_only_the_scan_window_is_searched(self):
+        padding = 'x' * BUILTIN_RULES.max_reject_scan_chars
+        self.assertEqual(BUILTIN_RULES.match_reject_rule('fiverr.com'), 'fiverr_link')
+        self.assertIsNone(BUILTIN_RULES.match_reject_rule(padding + 'fiverr.com'))
+
+    def test_builtin_rules_cannot_backtrack_catastrophically(self):
+        for name, pattern in BUILTIN_RULES.reject_rules:
+            self.assertIsNone(pattern_risk(pattern), name)
+
+    def test_unsafe_patterns_are_refused(self):
+        self.assertIn('unbounded', pattern_risk(r'salary.*in hand'))
+        self.assertIn('nested', pattern_risk(r'(?:ab{0,3}){0,5}'))
+        self.assertIsNone(pattern_risk(r'(?<!\d)\d++\s*+to.{0,80}?salary'))
+
+    def test_scan_window_from_a_file_must_be_bounded(self):
+        for value in (0, -1, 10 ** 9, 2.5, '2000', True):
+            with self.assertRaises(ValueError, msg=value):
+                parse_rules({"max_reject_scan_chars": value}, BUILTIN_RULES)
+        self.assertEqual(parse_rules({"max_reject_scan_chars": 500}, BUILTIN_RULES)[3], 500)
+
+    def test_deceptive_offer_check_survives_edited_keywords(self):
+        keywords = dict(BUILTIN_RULES.keywords)
+        keywords['job_requirement'] = tuple(word for word in keywords['job_requirement'] if word != 'looking for')
+        rules = RuleSet(keywords, BUILTIN_RULES.reject_rules, BUILTIN_RULES.max_reject_scan_chars, 'edited')
+        for message in BRANCH_SEEDS['deceptive_offer']:
+            verdict = filter.DeceptiveOfferStage().decide(MessageContext(message, rules))
+            self.assertEqual(verdict['rule'], 'deceptive_offer', message)
+
+
+class ClassificationCacheTests(TestCase):
+    def setUp(self):
+        # Messages decided by the rules only, so no test reaches Gemini or the trained model
+        patcher = mock.patch.object(local_model, '_local_classifier', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        clear_classification_cache()
+        self.addCleanup(clear_classification_cache)
+
+    def counters(self) -> tuple:
+        stats = classification_cache_stats()
+        return stats['hits'], stats['misses']
+
+    def test_repeat_is_served_from_cache(self):
+        message = BRANCH_SEEDS['pattern_match'][0]
+        hits, misses = self.counters()
+
+        first = classify_message(message)
+        self.assertEqual(self.counters(), (hits, misses + 1))
+        second = classify_message(message)
+        self.assertEqual(self.counters(), (hits + 1, misses + 1))
+        self.assertIs(second, first)
+        self.assertEqual(first['rule'], 'pattern_match')
+
+    def test_reposts_share_a_cache_entry(self):
+        hits, _ = self.counters()
+        classify_message("Looking for Poster Designers!  Need creative designers")
+        classify_message("looking for poster designers! need creative designers")
+        self.assertEqual(self.counters()[0], hits + 1)
+
+    def test_batch_matches_single_message_verdicts(self):
+        # One message from each rule-decided branch, each sent twice
+        messages = [seeds[0] for branch, seeds in BRANCH_SEEDS.items() if branch != 'gemini']
+        singles = [classify_message(message, use_gemini=False) for message in messages]
+        clear_classification_cache()
+        hits, misses = self.counters()
+        batch = classify_message_batch(messages + messages)
+        self.assertEqual([(result['is_job'], result['rule']) for result in batch[:len(messages)]],
+                         [(result['is_job'], result['rule']) for result in singles])
+        self.assertEqual(batch[len(messages):], batch[:len(messages)])
+        self.assertEqual(self.counters(), (hits + len(messages), misses + len(messages)))
+
+    def test_new_rules_version_invalidates_verdicts(self):
+        message = BRANCH_SEEDS['company_job'][0]
+        before = classify_message(message)
+
+        data = BUILTIN_RULES.to_dict()
+        data['version'] = 'test-2'
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as rules_file:
+            json.dump(data, rules_file)
+        self.addCleanup(os.remove, rules_file.name)
+        RULE_STORE.watch(rules_file.name)
+        self.addCleanup(RULE_STORE.watch, '')
+
+        hits, misses = self.counters()
+        after = classify_message(message)
+        self.assertEqual(self.counters(), (hits, misses + 1))
+        self.assertNotEqual(after['rules_version'], before['rules_version'])
+        self.assertTrue(after['rules_version'].startswith('test-2:'))
+        self.assertEqual(after['rule'], before['rule'])
+
+    def test_new_local_model_invalidates_verdicts(self):
+        message = BRANCH_SEEDS['freelancer_offer'][0]
+        classify_message(message)
+        hits, misses = self.counters()
+        with mock.patch.object(filter, 'local_model_version', return_value='retrained'):
+            classify_message(message)
+        self.assertEqual(self.counters(), (hits, misses + 1))
+
+
+class ClaimBatchTests(TestCase):
+    def setUp(self):
+        self.logs = [
+            MessageLog.objects.create(raw_text=f"queued {number}", classification_status=MessageLog.QUEUED)
+            for number in range(5)
+        ]
+        MessageLog.objects.create(raw_text="already classified")
+
+    def queued(self):
+        return MessageLog.objects.filter(classification_status=MessageLog.QUEUED).order_by('id')
+
+    def test_claims_up_to_batch_size_and_applies_updates(self):
+        claimed = claim_batch(self.queued(), 3, classification_status=MessageLog.PROCESSING)
+        self.assertEqual(claimed, [log.pk for log in self.logs[:3]])
+        self.assertEqual(
+            set(MessageLog.objects.filter(classification_status=MessageLog.PROCESSING).values_list('pk', flat=True)),
+            set(claimed)
+        )
+
+    def test_successive_claims_are_disjoint(self):
+        first = claim_batch(self.queued(), 3, classification_status=MessageLog.PROCESSING)
+        second = claim_batch(self.queued(), 3, classification_status=MessageLog.PROCESSING)
+        self.assertEqual(second, [log.pk for log in self.logs[3:]])
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(claim_batch(self.queued(), 3, classification_status=MessageLog.PROCESSING), [])
+
+
+class StreamingJSONArrayTests(SimpleTestCase):
+    def document(self, messages: list) -> dict:
+        return {"event": "messages.upsert", "data": {
+            "event": "messages.upsert",
+            "skipped": {"nested": [1, {"a": "]}"}], "text": "x" * 5000},
+            "data": {"messages": messages, "after": True},
+            "count": 12345,
+        }}
+
+    def read(self, document, read_size: int) -> StreamingJSONArray:
+        body = json.dumps(document, ensure_ascii=False).encode('utf-8')
+        return StreamingJSONArray(io.BytesIO(body), ('data', 'data', 'messages'), read_size=read_size)
+
+    def test_items_and_scalars_match_json_loads(self):
+        messages = [
+            {"key": {"id": f"ID{number}"}, "message": {"conversation": 'héllo "quoted" \\ 🚀 ' * number},
+             "score": number * 1.5, "flag": None}
+            for number in range(30)
+        ]
+        document = self.document(messages)
+        for read_size in (1, 7, 64, 4096):
+            reader = self.read(document, read_size)
+            self.assertEqual(list(reader), messages, read_size)
+            self.assertEqual(reader.values[('data', 'event')], 'messages.upsert')
+            self.assertEqual(reader.values[('data', 'count')], 12345)
+
+    def test_value_longer_than_a_block(self):
+        messages = [{"text": "y" * 300000}, {"text": "short"}]
+        self.assertEqual(list(self.read(self.document(messages), 64 * 1024)), messages)
+
+    def test_missing_or_empty_array(self):
+        self.assertEqual(list(self.read({"data": {"event": "presence.update"}}, 16)), [])
+        self.assertEqual(list(self.read(self.document([]), 16)), [])
+
+    def test_siblings_are_skipped_and_only_short_scalars_kept(self):
+        document = self.document([{"a": 1}])
+        document["data"]["history"] = [{"text": "z" * 200000}] * 3
+        document["data"]["note"] = "n" * 200000
+        reader = self.read(document, 4096)
+        self.assertEqual(list(reader), [{"a": 1}])
+        self.assertEqual(reader.values[('data', 'event')], 'messages.upsert')
+        self.assertNotIn(('data', 'note'), reader.values)
+        self.assertNotIn(('data', 'history'), reader.values)
+
+    def test_malformed_body_raises(self):
+        for body in (b'{"data": {"data": {"messages": [{"a": 1}, {"b": ',
+                     b'{"data": {"data": {"messages": [1 2]}}}',
+                     b'{"data": {"count": tru, "data": {"messages": []}}}',
+                     b'{"data": {"skipped": [1, {"a": 2'):
+            with self.assertRaises(ValueError):
+                list(StreamingJSONArray(io.BytesIO(body), ('data', 'data', 'messages'), read_size=8))
+
+
+class IngestStreamTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(ingest, 'ingest_message_list', side_effect=lambda chunk: list(chunk))
+        self.ingested = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def body(self, count: int, event_first: bool) -> io.BytesIO:
+        messages = [{"key": {"id": f"ID{number}"}, "message": {"conversation": f"m{number} " + "x" * 500}}
+                    for number in range(count)]
+        data = {"data": {"messages": messages}}
+        data = {"event": "messages.upsert", **data} if event_first else {**data, "event": "messages.upsert"}
+        return io.BytesIO(json.dumps({"data": data}).encode('utf-8'))
+
+    def test_chunks_are_stored_as_they_stream(self):
+        self.assertEqual(ingest.ingest_stream(self.body(450, True), chunk_size=200), ('messages.upsert', 450))
+        self.assertEqual([len(call.args[0]) for call in self.ingested.call_args_list], [200, 200, 50])
+
+    def test_event_after_data_in_the_first_block(self):
+        self.assertEqual(ingest.ingest_stream(self.body(20, False), chunk_size=200), ('messages.upsert', 20))
+
+    def test_event_after_data_is_not_buffered_without_bound(self):
+        with self.assertRaises(ValueError):
+            ingest.ingest_stream(self.body(450, False), chunk_size=200)
+        self.ingested.assert_not_called()
+
+    def test_other_events_store_nothing(self):
+        body = io.BytesIO(json.dumps({"data": {"event": "presence.update", "data": {"messages": [{"a": 1}]}}}).encode())
+        self.assertEqual(ingest.ingest_stream(body), ('presence.update', 0))
+        self.ingested.assert_not_called()
+
+
+class IngestQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.handled = []
+        self.overflowed = []
+
+    def handler(self, job):
+        self.started.set()
+        self.release.wait(5)
+        self.handled.append(job)
+
+    def test_full_queue_refuses_jobs(self):
+        work = IngestQueue(self.handler, self.overflowed.append, depth=2, workers=1)
+        self.addCleanup(self.release.set)
+        self.assertTrue(work.submit('running'))
+        self.assertTrue(self.started.wait(5))
+        self.assertTrue(work.submit('waiting 1'))
+        self.assertTrue(work.submit('waiting 2'))
+        self.assertFalse(work.submit('shed'))
+        stats = work.snapshot()
+        self.assertEqual((stats['submitted'], stats['shed'], stats['depth']), (3, 1, 2))
+
+    def test_close_overflows_waiting_and_unfinished_jobs(self):
+        work = IngestQueue(self.handler, self.overflowed.append, depth=5, workers=1)
+        self.addCleanup(self.release.set)
+        work.submit('running')
+        self.assertTrue(self.started.wait(5))
+        work.submit('waiting')
+        work.close(timeout=0.05)
+        self.assertEqual(self.overflowed, ['waiting', 'running'])
+        self.assertFalse(work.submit('late'))
+
+    def test_close_waits_for_jobs_that_finish_in_time(self):
+        work = IngestQueue(self.handler, self.overflowed.append, depth=5, workers=2)
+        work.submit('a')
+        self.assertTrue(self.started.wait(5))
+        threading.Timer(0.05, self.release.set).start()
+        work.close(timeout=5)
+        self.assertEqual(self.handled, ['a'])
+        self.assertEqual(self.overflowed, [])
+
+
+class WebhookEventCounterTests(SimpleTestCase):
+    def post(self, body):
+        return self.client.post('/api/whatsapp/webhook/', json.dumps(body), content_type='application/json')
+
+    def received(self, label: str) -> int:
+        return event_stats().get(label, {}).get('received', 0)
+
+    def test_counters_are_limited_to_known_events(self):
+        before = {label: self.received(label) for label in ('presence.update', 'other', 'unknown')}
+        for body in ({"event": "presence.update", "data": {"event": "presence.update"}},
+                     {"data": {"event": "x" * 5000}},
+                     {"data": {"event": "made.up"}},
+                     {"data": {}}):
+            self.assertEqual(self.post(body).status_code, 200)
+        self.assertEqual(self.received('presence.update'), before['presence.update'] + 1)
+        self.assertEqual(self.received('other'), before['other'] + 2)
+        self.assertEqual(self.received('unknown'), before['unknown'] + 1)
+        self.assertNotIn('made.up', event_stats())
+
+    def test_non_string_event_is_counted_as_other(self):
+        before = self.received('other')
+        for event in (["messages.upsert"], {"a": 1}, 42):
+            response = self.post({"data": {"event": event}})
+            self.assertEqual(response.json(), {"status": "received"})
+        self.assertEqual(self.received('other'), before + 3)
+
+
+class MetricsSnapshotTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        for name, value in (('METRICS_DIR', self.directory), ('METRICS_FLUSH_SECONDS', 0.0)):
+            patcher = mock.patch.object(metrics, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def snapshot_files(self) -> list:
+        return [name for name in os.listdir(self.directory) if name.startswith('worker-')]
+
+    def test_processes_without_snapshots_write_nothing(self):
+        with mock.patch.object(metrics, '_snapshots_enabled', False):
+            metrics.inc('test_events_total')
+            self.assertEqual(self.snapshot_files(), [])
+            # A scrape served by such a process still reports its own metrics
+            self.assertIn('test_events_total', metrics.merged_snapshot()['counters'])
+        self.assertEqual(self.snapshot_files(), [])
+
+    def test_web_workers_flush_snapshots(self):
+        with mock.patch.object(metrics, '_snapshots_enabled', True):
+            metrics.inc('test_events_total')
+            self.assertEqual(self.snapshot_files(), [metrics.snapshot_name()])
+
+
+class ChatRateTests(TestCase):
+    def test_burst_then_one_send_per_interval(self):
+        waits = [reserve_chat_slot('chat', rate_per_minute=20, burst=3) for _ in range(4)]
+        self.assertEqual(waits[:3], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(waits[3], 3.0, delta=0.5)
+        self.assertEqual(reserve_chat_slot('other chat', rate_per_minute=20, burst=3), 0.0)
+
+    def test_rate_is_shared_through_the_database(self):
+        # Another worker that already used the chat's burst leaves no slot for this one
+        TelegramChatRate.objects.create(chat_id='chat', next_send_at=timezone.now() + timedelta(seconds=9))
+        self.assertGreater(reserve_chat_slot('chat', rate_per_minute=20, burst=3), 2.5)
+
+        TelegramChatRate.objects.filter(chat_id='chat').update(next_send_at=timezone.now() - timedelta(seconds=60))
+        self.assertEqual(reserve_chat_slot('chat', rate_per_minute=20, burst=3), 0.0)
+        # Idle time doesn't bank more than one burst
+        self.assertLess(TelegramChatRate.objects.get(chat_id='chat').next_send_at, timezone.now() + timedelta(seconds=4))
+
+
+class MessageLabelAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_superuser('reviewer', 'r@example.com', 'x'))
+        self.logs = [MessageLog.objects.create(raw_text=f"message {number}") for number in range(3)]
+        self.url = '/admin/whatsapp_messages/messagelog/'
+
+    def test_changelist_shows_labels(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'message 0')
+
+    def test_actions_set_and_clear_labels(self):
+        pks = [log.pk for log in self.logs[:2]]
+        self.client.post(self.url, {'action': 'label_relevant', '_selected_action': pks})
+        self.assertEqual(list(MessageLog.objects.filter(label=True).values_list('pk', flat=True).order_by('pk')), pks)
+        self.client.post(self.url, {'action': 'label_irrelevant', '_selected_action': pks[:1]})
+        self.client.post(self.url, {'action': 'clear_label', '_selected_action': pks[1:]})
+        self.assertEqual(
+            [MessageLog.objects.get(pk=log.pk).label for log in self.logs], [False, None, None]
+        )
+
+
+class NearDuplicateIndexTests(SimpleTestCase):
+    ORIGINAL = ("Looking for a React developer to build a dashboard for our startup, budget 20k, "
+                "DM me with your portfolio")
+    REPOST = ("🔥 looking for a react developer to build a dashboard for our startup, budget 20k!! "
+              "DM me with your portfolio asap")
+    OTHER = "Need a logo designer for a bakery brand, simple and modern, paying 3000, message me"
+
+    def test_reposts_merge_with_the_original(self):
+        index = NearDuplicateIndex()
+        index.add(1, minhash_signature(self.ORIGINAL))
+        self.assertEqual(index.find(minhash_signature(self.REPOST)), 1)
+        self.assertEqual(index.find(minhash_signature(self.ORIGINAL.upper())), 1)
+
+    def test_different_messages_do_not_merge(self):
+        index = NearDuplicateIndex()
+        index.add(1, minhash_signature(self.ORIGINAL))
+        self.assertIsNone(index.find(minhash_signature(self.OTHER)))
+        self.assertIsNone(index.find(()))
+
+    def test_closest_match_wins(self):
+        index = NearDuplicateIndex()
+        index.add(1, minhash_signature(self.REPOST))
+        index.add(2, minhash_signature(self.ORIGINAL))
+        self.assertEqual(index.find(minhash_signature(self.ORIGINAL)), 2)
+
+    def test_entries_leave_the_window(self):
+        index = NearDuplicateIndex(window_seconds=60)
+        index.add(1, minhash_signature(self.ORIGINAL), added_at=time.time() - 120)
+        self.assertIsNone(index.find(minhash_signature(self.REPOST)))
+        self.assertEqual(len(index), 0)
+
+        index = NearDuplicateIndex(max_entries=1)
+        index.add(1, minhash_signature(self.ORIGINAL))
+        index.add(2, minhash_signature(self.OTHER))
+        self.assertIsNone(index.find(minhash_signature(self.REPOST)))
+        self.assertEqual(index.find(minhash_signature(self.OTHER)), 2)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ResilienceTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('messages.resilience.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket_bursts_then_refills_at_its_rate(self):
+        bucket = TokenBucket(rate=2, capacity=3)
+        self.assertEqual([bucket.try_acquire() for _ in range(4)], [True, True, True, False])
+        self.clock.now += 0.5
+        self.assertEqual([bucket.try_acquire() for _ in range(2)], [True, False])
+        self.clock.now += 60
+        self.assertEqual(sum(bucket.try_acquire() for _ in range(10)), 3)
+        self.assertFalse(bucket.acquire(timeout=0))
+        self.assertEqual((bucket.granted, bucket.throttled), (7, 10))
+
+    def breaker(self) -> CircuitBreaker:
+        return CircuitBreaker('test', error_rate_threshold=0.5, min_calls=4, window_seconds=60,
+                              slow_call_seconds=5, cooldown_seconds=30)
+
+    def test_opens_on_error_rate_and_rejects_until_cooldown(self):
+        breaker = self.breaker()
+        breaker.record_success(0.1)
+        breaker.record_failure(0.1)
+        breaker.record_success(0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        # Slow calls count as failures
+        breaker.record_success(6)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+        self.clock.now += 30
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success(0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        breaker = self.breaker()
+        for _ in range(4):
+            breaker.record_failure(0.1)
+        self.clock.now += 30
+        self.assertTrue(breaker.allow())
+        breaker.record_failure(0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.counters['opened'], 2)
+
+    def test_cancelled_probe_lets_the_next_caller_probe(self):
+        breaker = self.breaker()
+        for _ in range(4):
+            breaker.record_failure(0.1)
+        self.clock.now += 30
+        self.assertTrue(breaker.allow())
+        breaker.cancel()
+        self.assertTrue(breaker.allow())
+
+    def test_old_calls_leave_the_window(self):
+        breaker = self.breaker()
+        for _ in range(3):
+            breaker.record_failure(0.1)
+        self.clock.now += 61
+        breaker.record_failure(0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class PackDigestTests(SimpleTestCase):
+    def entries(self, *lengths) -> list:
+        return [SimpleNamespace(pk=number, text=format_telegram_message(f"{number}:" + "x" * length))
+                for number, length in enumerate(lengths)]
+
+    def test_short_forwards_share_one_message(self):
+        entries = self.entries(100, 200, 300)
+        groups = pack_digest(entries)
+        self.assertEqual(len(groups), 1)
+        texts, grouped = groups[0]
+        self.assertEqual(grouped, entries)
+        self.assertTrue(texts[0].startswith(digest_header(3)))
+        for entry in entries:
+            self.assertIn(digest_item(entry.text), texts[0])
+
+    def test_groups_split_at_the_message_limit_in_order(self):
+        entries = self.entries(*[1500] * 7)
+        groups = pack_digest(entries)
+        self.assertGreater(len(groups), 1)
+        self.assertEqual([entry for _, grouped in groups for entry in grouped], entries)
+        for texts, _ in groups:
+            self.assertEqual(len(texts), 1)
+            self.assertLessEqual(len(texts[0]), TELEGRAM_MAX_MESSAGE_LENGTH)
+
+    def test_text_of_exactly_the_limit_is_kept_whole(self):
+        entry = self.entries(0)[0]
+        entry.text = digest_header(1) + "y" * (TELEGRAM_MAX_MESSAGE_LENGTH - len(digest_header(1)))
+        self.assertEqual(pack_digest([entry]), [([entry.text], [entry])])
+
+    def test_oversized_forward_goes_out_in_parts(self):
+        short, long = self.entries(50, 10000)
+        groups = pack_digest([short, long])
+        self.assertEqual([grouped for _, grouped in groups], [[short], [long]])
+        parts = groups[1][0]
+        self.assertEqual(len(parts), 3)
+        self.assertTrue(all(len(part) <= TELEGRAM_MAX_MESSAGE_LENGTH for part in parts))
+        self.assertEqual(''.join(part.removeprefix(digest_header(1)) for part in parts), digest_item(long.text))
+
+
+class StageOrderTests(SimpleTestCase):
+    def setUp(self):
+        for patcher in (mock.patch.object(local_model, '_local_classifier', False),
+                        mock.patch.object(filter.logger, 'disabled', True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Every branch's seeds and the classifier cases; the long benchmark messages add nothing per order
+        self.messages = [message for message, _ in CLASSIFIER_TEST_CASES] + [
+            message for seeds in BRANCH_SEEDS.values() for message in seeds
+        ]
+
+    def pipeline(self, **options) -> ClassifierPipeline:
+        return ClassifierPipeline([type(stage)() for stage in filter.CLASSIFIER_PIPELINE.stages], **options)
+
+    def verdicts(self, pipeline: ClassifierPipeline) -> list:
+        rules = current_rules()
+        return [pipeline.run(MessageContext(message, rules, use_gemini=False))['is_job'] for message in self.messages]
+
+    def test_every_order_of_reorderable_stages_gives_the_same_verdicts(self):
+        pipeline = self.pipeline()
+        expected = self.verdicts(pipeline)
+        reorderable, fixed = pipeline.stages[:pipeline._reorderable], pipeline.stages[pipeline._reorderable:]
+        self.assertGreater(len(reorderable), 1)
+        for order in itertools.permutations(reorderable):
+            pipeline._order = order + fixed
+            self.assertEqual(self.verdicts(pipeline), expected, [stage.name for stage in order])
+
+    def test_adaptive_reordering_keeps_verdicts(self):
+        expected = self.verdicts(self.pipeline())
+        adaptive = self.pipeline(adaptive=True, reorder_every=5)
+        self.assertEqual(self.verdicts(adaptive), expected)
+        self.assertGreater(adaptive.stats()['reorders'], 0)
+        self.assertEqual(self.verdicts(adaptive), expected)
+
+
+def telegram_result(status, retry_after=None) -> dict:
+    return {"ok": status == 200, "status": status, "retry_after": retry_after,
+            "error": "" if status == 200 else f"error {status}"}
+
+
+class OutboxDeliveryTests(TestCase):
+    def setUp(self):
+        self.results = []
+        patcher = mock.patch.object(TelegramClient, 'post_message', side_effect=lambda chat_id, text: self.results.pop(0))
+        self.post = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.slot_wait = 0.0
+        patcher = mock.patch.object(forwarding, 'reserve_chat_slot', side_effect=lambda chat_id: self.slot_wait)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        log = MessageLog.objects.create(raw_text="Need a video editor", is_relevant=True)
+        self.entry = TelegramOutbox.objects.create(message_log=log, chat_id='chat', text='forward')
+        self.sweeper = OutboxSweeper(digest=False)
+
+    def sweep(self, *results) -> TelegramOutbox:
+        self.results.extend(results)
+        self.sweeper.sweep()
+        self.entry.refresh_from_db()
+        return self.entry
+
+    def make_due(self):
+        TelegramOutbox.objects.filter(pk=self.entry.pk).update(next_attempt_at=timezone.now())
+
+    def seconds_until_due(self) -> float:
+        return (self.entry.next_attempt_at - timezone.now()).total_seconds()
+
+    def test_sent_row_marks_the_message_forwarded(self):
+        entry = self.sweep(telegram_result(200))
+        self.assertEqual((entry.status, entry.attempts), (TelegramOutbox.SENT, 1))
+        self.assertTrue(MessageLog.objects.get(pk=entry.message_log_id).forwarded_to_telegram)
+        self.assertEqual(self.sweep().status, TelegramOutbox.SENT)
+        self.assertEqual(self.post.call_count, 1)
+
+    def test_server_error_is_retried_with_backoff(self):
+        entry = self.sweep(telegram_result(500))
+        self.assertEqual((entry.status, entry.attempts), (TelegramOutbox.PENDING, 1))
+        self.assertTrue(1 < self.seconds_until_due() <= 2.4)
+        # Not due yet: the next sweep leaves it alone
+        self.sweep()
+        self.assertEqual(self.post.call_count, 1)
+
+        self.make_due()
+        entry = self.sweep(telegram_result(200))
+        self.assertEqual((entry.status, entry.attempts), (TelegramOutbox.SENT, 2))
+        self.assertEqual([attempt['status'] for attempt in entry.attempt_log], [500, 200])
+
+    def test_flood_control_waits_for_retry_after(self):
+        self.sweep(telegram_result(429, retry_after=17))
+        self.assertAlmostEqual(self.seconds_until_due(), 17, delta=1)
+
+    def test_gives_up_after_max_attempts(self):
+        for attempt in range(1, OUTBOX_MAX_ATTEMPTS + 1):
+            entry = self.sweep(telegram_result(502))
+            self.assertEqual(entry.attempts, attempt)
+            self.make_due()
+        self.assertEqual(entry.status, TelegramOutbox.FAILED)
+        self.sweep()
+        self.assertEqual(self.post.call_count, OUTBOX_MAX_ATTEMPTS)
+
+    def test_client_errors_fail_at_once(self):
+        entry = self.sweep(telegram_result(400))
+        self.assertEqual((entry.status, entry.attempts), (TelegramOutbox.FAILED, 1))
+
+    def test_busy_chat_reschedules_without_an_attempt(self):
+        self.slot_wait = 12.0
+        entry = self.sweep()
+        self.assertEqual((entry.status, entry.attempts), (TelegramOutbox.PENDING, 0))
+        self.assertAlmostEqual(self.seconds_until_due(), 12, delta=1)
+        self.post.assert_not_called()
+
+    def test_rows_claimed_by_a_dead_dispatcher_are_requeued(self):
+        TelegramOutbox.objects.filter(pk=self.entry.pk).update(
+            status=TelegramOutbox.SENDING, claimed_at=timezone.now() - timedelta(hours=1)
+        )
+        self.assertEqual(self.sweep(telegram_result(200)).status, TelegramOutbox.SENT)
+
+
+class RedeliveryTests(TestCase):
+    def setUp(self):
+        for patcher in (mock.patch.object(local_model, '_local_classifier', False),
+                        mock.patch.object(ingest, 'get_near_duplicate_index', return_value=None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        ingest._recent_message_ids.clear()
+        self.addCleanup(ingest._recent_message_ids.clear)
+
+    def gateway_messages(self, *ids) -> list:
+        # Rule-decided (keyword check) texts, so nothing reaches Gemini or Telegram
+        return [{"key": {"id": message_id, "remoteJid": "123@g.us", "participant": "9@s.whatsapp.net"},
+                 "message": {"conversation": f"Good morning everyone {message_id}"}}
+                for message_id in ids]
+
+    def stored_ids(self) -> list:
+        return sorted(MessageLog.objects.values_list('wa_message_id', flat=True))
+
+    def test_redeliveries_are_skipped_through_the_database(self):
+        self.assertEqual(len(ingest.ingest_message_list(self.gateway_messages('A', 'B'))), 2)
+        before = ingest.ingest_stats()['redelivered_db']
+        self.assertEqual(ingest.ingest_message_list(self.gateway_messages('A', 'B', 'C')), [
+            MessageLog.objects.get(wa_message_id='C')
+        ])
+        self.assertEqual(ingest.ingest_stats()['redelivered_db'], before + 2)
+        self.assertEqual(self.stored_ids(), ['A', 'B', 'C'])
+
+    def test_redeliveries_are_skipped_from_the_recent_ids_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest.ingest_message_list(self.gateway_messages('A'))
+        before = ingest.ingest_stats()['redelivered_memory']
+        with self.assertNumQueries(0):
+            self.assertEqual(ingest.ingest_message_list(self.gateway_messages('A')), [])
+        self.assertEqual(ingest.ingest_stats()['redelivered_memory'], before + 1)
+
+    def test_repeats_within_a_batch_are_stored_once(self):
+        ingest.ingest_message_list(self.gateway_messages('A', 'A', 'B'))
+        self.assertEqual(self.stored_ids(), ['A', 'B'])
+
+    def test_concurrent_redelivery_is_retried_without_the_stored_messages(self):
+        extracted = ingest.extract_messages(self.gateway_messages('A', 'B'))
+        fresh = ingest.drop_seen_messages(extracted)
+        # Another worker commits A between the redelivery check and the insert
+        ingest.ingest_message_list(self.gateway_messages('A'))
+        ingest._recent_message_ids.clear()
+        logs = ingest.classify_and_persist(fresh)
+        self.assertEqual([log.wa_message_id for log in logs], ['B'])
+        self.assertEqual(self.stored_ids(), ['A', 'B'])
@@ -1,17 +1,47 @@
-from django.shortcuts import render
-from django.http import JsonResponse
+from django.db.models import Count
+from django.http import Http404, HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from .models import MessageLog
-from .filter import is_relevant_message
-from .telegram import send_to_telegram
+from .models import TelegramOutbox
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from .events import event_stats, is_ignorable_event, record_event, sniff_event_type
+from .filter import classification_cache_stats, classifier_pipeline_stats, gemini_health, rule_stats
+from .ingest import aingest_messages, enqueue_messages, ingest_messages, ingest_stats, ingest_stream
+from .log import log_payload
+from .metrics import merged_snapshot, metric_key, render_prometheus, timed, timed_view
+from .work_queue import ingest_queue_stats
 import logging
 import datetime
 import json
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# The outbox backlog is counted at most once per METRICS_OUTBOX_SECONDS, however often /metrics/ is scraped
+METRICS_OUTBOX_SECONDS = 30
+_outbox_counts = (float('-inf'), {})
+_outbox_counts_lock = threading.Lock()
+
+def webhook_status() -> dict:
+    """Health and counters reported on GET"""
+    return {
+        "status": "webhook_active", 
+        "message": "WhatsApp webhook is running",
+        "timestamp": str(datetime.datetime.now()),
+        "method": "GET",
+        "classifier_cache": classification_cache_stats(),
+        "classifier_pipeline": classifier_pipeline_stats(),
+        "rules": rule_stats(),
+        "gemini": gemini_health(),
+        "ingest": ingest_stats(),
+        "ingest_queue": ingest_queue_stats(),
+        "events": event_stats()
+    }
+
 @csrf_exempt
+@timed_view
 def whatsapp_webhook(request):
     # Debug logging for method
     logger.info(f"Received {request.method} request on webhook endpoint")
@@ -19,92 +49,50 @@ def whatsapp_webhook(request):
     # Handle GET requests for testing
     if request.method == "GET":
         logger.info("Processing GET request on webhook endpoint")
-        return JsonResponse({
-            "status": "webhook_active", 
-            "message": "WhatsApp webhook is running",
-            "timestamp": str(datetime.datetime.now()),
-            "method": "GET"
-        })
+        return JsonResponse(webhook_status())
     
     # Handle POST requests (actual webhooks)
     elif request.method == "POST":
-        # Log ALL incoming requests for debugging
-        logger.info("=" * 50)
-        logger.info("WEBHOOK POST REQUEST RECEIVED")
-        logger.info(f"Method: {request.method}")
-        logger.info(f"Headers: {dict(request.headers)}")
-        logger.info(f"Raw Data: {request.body}")
-        logger.info("=" * 50)
-        
+        # History syncs are read from the stream in chunks instead of being decoded whole
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if content_length > settings.WEBHOOK_STREAMING_THRESHOLD:
+            logger.info(f"Streaming {content_length}-byte webhook body")
+            try:
+                event_type, stored = ingest_stream(request)
+                record_event(event_type)
+                return JsonResponse({"status": "received", "stored": stored})
+            except Exception as e:
+                logger.error(f"Error processing streamed webhook: {e}")
+                return JsonResponse({"status": "error", "message": str(e)})
+
+        # Presence, receipts and other ignored events are answered without parsing or logging the body
+        if settings.WEBHOOK_FAST_PATH:
+            sniffed_event = sniff_event_type(request.body)
+            if is_ignorable_event(request.body, sniffed_event):
+                record_event(sniffed_event, fast_path=True)
+                return JsonResponse({"status": "ignored", "event": sniffed_event})
+
+        # A sample of bodies is logged (truncated) for debugging; the rest skip formatting entirely
+        log_payload(logger, request.body, request.headers,
+                    settings.LOG_PAYLOAD_SAMPLE_RATE, settings.LOG_PAYLOAD_MAX_CHARS)
+
         try:
             # Parse JSON data
-            if request.body:
-                webhook_data = json.loads(request.body)
-            else:
-                webhook_data = {}
-            
-            logger.info(f"Parsed Data: {webhook_data}")
-            
+            with timed('webhook_stage_seconds', stage='parse'):
+                if request.body:
+                    webhook_data = json.loads(request.body)
+                else:
+                    webhook_data = {}
+
             event_type = webhook_data.get('data', {}).get('event', '')
+            record_event(event_type)
 
             if event_type == 'messages.upsert':
-                messages = webhook_data.get('data', {}).get('data', {}).get('messages', [])
-
-                for msg_data in messages:
-                    # Extract message text
-                    message_text = ""
-                    if 'message' in msg_data:
-                        msg_obj = msg_data['message']
-
-                        if 'conversation' in msg_obj:
-                            message_text = msg_obj['conversation']
-                        elif 'extendedTextMessage' in msg_obj:
-                            message_text = msg_obj['extendedTextMessage'].get('text', '')
-                        elif 'imageMessage' in msg_obj:
-                            message_text = msg_obj['imageMessage'].get('caption', '')
-                        elif 'videoMessage' in msg_obj:
-                            message_text = msg_obj['videoMessage'].get('caption', '')
-
-                    # Extract only essential sender info (name and contact)
-                    sender_info = {}
-
-                    # Get sender name
-                    if 'pushName' in msg_data:
-                        sender_info['name'] = msg_data['pushName']
-
-                    # Get contact number
-                    if 'key' in msg_data and 'remoteJid' in msg_data['key']:
-                        remote_jid = msg_data['key']['remoteJid']
-                        if '@g.us' in remote_jid:
-                            # Group message - try to get participant
-                            if 'participant' in msg_data.get('key', {}):
-                                sender_info['participant'] = msg_data['key']['participant']
-                        else:
-                            # Direct message
-                            sender_info['number'] = remote_jid
-
-                    # Process the message if we found text
-                    if message_text.strip():
-                        is_relevant = is_relevant_message(message_text)
-
-                        # Create simple log entry
-                        message_log = MessageLog.objects.create(
-                            raw_text=message_text,
-                            is_relevant=is_relevant,
-                            forwarded_to_telegram=False
-                        )
-
-                        # Send to Telegram if relevant
-                        if is_relevant:
-                            try:
-                                success = send_to_telegram(message_text, sender_info)
-                                message_log.forwarded_to_telegram = success
-                                message_log.save()
-
-                                if success:
-                                    logger.info(f"Opportunity forwarded: {message_text[:50]}...")
-                            except Exception as e:
-                                logger.error(f"Failed to send to Telegram: {e}")
+                # Classification happens on the queue's workers (or later, if the queue is full)
+                if settings.WEBHOOK_INGEST_QUEUE:
+                    queued = enqueue_messages(webhook_data)
+                    return JsonResponse({"status": "accepted", "queued": queued}, status=202)
+                ingest_messages(webhook_data)
             
             return JsonResponse({"status": "received"})
 
@@ -114,4 +102,79 @@ def whatsapp_webhook(request):
     
     # If neither GET nor POST
     else:
-        return JsonResponse({"status": "error", "message": "Method not allowed"}, status=405)
\ No newline at end of file
+        return JsonResponse({"status": "error", "message": "Method not allowed"}, status=405)
+
+@csrf_exempt
+@timed_view
+async def whatsapp_webhook_async(request):
+    """
+    Async variant of whatsapp_webhook for ASGI servers: a request's Gemini and
+    Telegram calls overlap, and the worker serves other requests while they
+    are in flight
+    """
+    logger.info(f"Received async {request.method} request on webhook endpoint")
+
+    if request.method == "GET":
+        return JsonResponse(await sync_to_async(webhook_status)())
+
+    elif request.method == "POST":
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        try:
+            if content_length > settings.WEBHOOK_STREAMING_THRESHOLD:
+                logger.info(f"Streaming {content_length}-byte webhook body")
+                event_type, stored = await sync_to_async(ingest_stream)(request)
+                record_event(event_type)
+                return JsonResponse({"status": "received", "stored": stored})
+
+            if settings.WEBHOOK_FAST_PATH:
+                sniffed_event = sniff_event_type(request.body)
+                if is_ignorable_event(request.body, sniffed_event):
+                    record_event(sniffed_event, fast_path=True)
+                    return JsonResponse({"status": "ignored", "event": sniffed_event})
+
+            log_payload(logger, request.body, request.headers,
+                        settings.LOG_PAYLOAD_SAMPLE_RATE, settings.LOG_PAYLOAD_MAX_CHARS)
+
+            with timed('webhook_stage_seconds', stage='parse'):
+                webhook_data = json.loads(request.body) if request.body else {}
+
+            event_type = webhook_data.get('data', {}).get('event', '')
+            record_event(event_type)
+
+            if event_type == 'messages.upsert':
+                if settings.WEBHOOK_INGEST_QUEUE:
+                    queued = await sync_to_async(enqueue_messages)(webhook_data)
+                    return JsonResponse({"status": "accepted", "queued": queued}, status=202)
+                await aingest_messages(webhook_data, timeout=settings.WEBHOOK_GEMINI_TIMEOUT)
+
+            return JsonResponse({"status": "received"})
+
+        except Exception as e:
+            logger.error(f"Error processing webhook: {e}")
+            return JsonResponse({"status": "error", "message": str(e)})
+
+    else:
+        return JsonResponse({"status": "error", "message": "Method not allowed"}, status=405)
+
+def outbox_counts() -> dict:
+    """Outbox rows per status, shared by all workers, so read from the database (and briefly cached)"""
+    global _outbox_counts
+    with _outbox_counts_lock:
+        counted_at, counts = _outbox_counts
+        if time.monotonic() - counted_at >= METRICS_OUTBOX_SECONDS:
+            counts = {
+                metric_key('telegram_outbox_rows', status=status): count
+                for status, count in TelegramOutbox.objects.values_list('status').annotate(count=Count('id')).order_by()
+            }
+            _outbox_counts = (time.monotonic(), counts)
+        return counts
+
+def prometheus_metrics(request):
+    """Every worker's counters and histograms in the Prometheus text format"""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {settings.METRICS_TOKEN}":
+        return HttpResponse(status=401)
+
+    return HttpResponse(render_prometheus(merged_snapshot(), outbox_counts()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,204 @@
+"""
+Bounded in-process queue between the webhook and the ingest stages.
+
+The webhook hands each upsert to a fixed pool of worker threads and answers
+202 straight away. When the queue is full the batch is shed instead: its
+messages are stored unclassified (status QUEUED) in one insert, and
+process_pending_messages classifies them later. Either way the request costs
+about the same, however large the burst. At shutdown the workers get a few
+seconds to finish; batches still waiting or in flight are shed the same way.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from decouple import config
+from django.db import connection
+
+from .metrics import metric_key, register_collector
+
+logger = logging.getLogger(__name__)
+
+INGEST_QUEUE_DEPTH = config('INGEST_QUEUE_DEPTH', default=100, cast=int)
+INGEST_QUEUE_WORKERS = config('INGEST_QUEUE_WORKERS', default=2, cast=int)
+# How long shutdown waits for batches being ingested before storing them unclassified
+INGEST_QUEUE_CLOSE_TIMEOUT = config('INGEST_QUEUE_CLOSE_TIMEOUT', default=10.0, cast=float)
+
+# Wait-time percentiles are taken over this many of the latest jobs
+WAIT_SAMPLE_SIZE = 1000
+
+
+def _percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+class IngestQueue:
+    """
+    Fixed worker threads running handler(job) for queued jobs; submit() never
+    blocks and refuses jobs once `depth` are waiting. Jobs still waiting at
+    shutdown, or still running when close() stops waiting for them, are passed
+    to overflow(job) so they aren't lost.
+    """
+
+    def __init__(self, handler, overflow, depth: int = INGEST_QUEUE_DEPTH, workers: int = INGEST_QUEUE_WORKERS):
+        self.handler = handler
+        self.overflow = overflow
+        self.depth = depth
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=depth)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._in_flight = {}
+        self._closed = False
+        self._waits = deque(maxlen=WAIT_SAMPLE_SIZE)
+        self._counters = {"submitted": 0, "shed": 0, "processed": 0, "failed": 0, "busy": 0}
+        self._max_depth = 0
+        self._max_wait = 0.0
+        self._total_wait = 0.0
+        self._started = 0
+
+    def _start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"ingest-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job) -> bool:
+        """Queue a job; False when the queue is full or shutting down"""
+        with self._lock:
+            if self._closed:
+                self._counters["shed"] += 1
+                return False
+            if not self._threads:
+                self._start()
+        try:
+            self._queue.put_nowait((time.monotonic(), job))
+        except queue.Full:
+            with self._lock:
+                self._counters["shed"] += 1
+            return False
+        with self._lock:
+            self._counters["submitted"] += 1
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+        return True
+
+    def _work(self):
+        while True:
+            enqueued_at, job = self._queue.get()
+            if job is None:
+                return
+            wait = time.monotonic() - enqueued_at
+            with self._lock:
+                self._waits.append(wait)
+                self._total_wait += wait
+                self._started += 1
+                self._max_wait = max(self._max_wait, wait)
+                self._counters["busy"] += 1
+                self._in_flight[threading.get_ident()] = job
+            failed = False
+            try:
+                self.handler(job)
+            except Exception as e:
+                failed = True
+                logger.error(f"❌ Queued ingest failed, storing the batch unclassified: {e}")
+                self._overflow(job)
+            finally:
+                # Worker threads keep their own connection; don't hold it between jobs
+                connection.close()
+                with self._lock:
+                    self._in_flight.pop(threading.get_ident(), None)
+                    self._counters["busy"] -= 1
+                    self._counters["failed" if failed else "processed"] += 1
+
+    def _overflow(self, job):
+        try:
+            self.overflow(job)
+        except Exception as e:
+            logger.error(f"❌ Could not store overflowed batch, messages lost: {e}")
+
+    def close(self, timeout: float = INGEST_QUEUE_CLOSE_TIMEOUT):
+        """
+        Stop accepting jobs, hand the ones still waiting to overflow, then give
+        running jobs up to `timeout` seconds before overflowing those too
+        """
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                _, job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._overflow(job)
+        for _ in self._threads:
+            self._queue.put((0.0, None))
+
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        with self._lock:
+            unfinished = list(self._in_flight.values())
+            self._in_flight.clear()
+        if unfinished:
+            # Acknowledged with 202 but not stored yet; a late commit of the same rows hits the unique key
+            logger.warning(f"⚠️ {len(unfinished)} ingest batches still running at shutdown, storing them unclassified")
+        for job in unfinished:
+            self._overflow(job)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                **self._counters,
+                "depth": self._queue.qsize(),
+                "capacity": self.depth,
+                "workers": self.workers,
+                "max_depth": self._max_depth,
+                "wait_ms": {
+                    "mean": round(self._total_wait / self._started * 1000, 1) if self._started else 0.0,
+                    "p50": round(_percentile(waits, 0.5) * 1000, 1),
+                    "p95": round(_percentile(waits, 0.95) * 1000, 1),
+                    "max": round(self._max_wait * 1000, 1),
+                },
+            }
+
+
+_ingest_queue = None
+_ingest_queue_lock = threading.Lock()
+
+
+def get_ingest_queue(handler, overflow) -> IngestQueue:
+    """The worker's ingest queue, drained to overflow at interpreter shutdown"""
+    global _ingest_queue
+    if _ingest_queue is None:
+        with _ingest_queue_lock:
+            if _ingest_queue is None:
+                _ingest_queue = IngestQueue(handler, overflow)
+                atexit.register(_ingest_queue.close)
+    return _ingest_queue
+
+
+def ingest_queue_stats() -> dict:
+    """Queue depth and wait times for this worker (empty until the first queued request)"""
+    return _ingest_queue.snapshot() if _ingest_queue is not None else {}
+
+
+def _metrics_collector() -> dict:
+    stats = ingest_queue_stats()
+    if not stats:
+        return {}
+    return {
+        "counters": {metric_key('ingest_queue_total', outcome=outcome): stats[outcome]
+                     for outcome in ('submitted', 'shed', 'processed', 'failed')},
+        "gauges": {
+            metric_key('ingest_queue_depth'): stats['depth'],
+            metric_key('ingest_queue_busy_workers'): stats['busy'],
+            **{metric_key('ingest_queue_wait_seconds', quantile=quantile): stats['wait_ms'][name] / 1000
+               for quantile, name in (('0.5', 'p50'), ('0.95', 'p95'))},
+        },
+    }
+
+
+register_collector(_metrics_collector)
@@ -14,3 +14,15 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'whatsapp_project.settings')
 
 application = get_asgi_application()
+
+# Outbox deliveries and their retries run on a thread of each worker, off the request path
+from messages.forwarding import start_outbox_sweeper  # noqa: E402
+
+start_outbox_sweeper()
+
+# Only web workers write the metrics snapshots that /metrics/ merges; management commands keep theirs in memory
+from django.conf import settings  # noqa: E402
+from messages.metrics import enable_snapshots  # noqa: E402
+
+if settings.METRICS_ENABLED:
+    enable_snapshots()
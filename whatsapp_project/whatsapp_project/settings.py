@@ -137,40 +137,93 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-# Add this to your settings.py
+# Classification pipeline
+# Leave borderline messages as "pending" for `manage.py process_pending_messages`
+# instead of calling Gemini inside the webhook request
+GEMINI_ASYNC = config("GEMINI_ASYNC", default=False, cast=bool)
+
+# Leave Telegram delivery to `python manage.py dispatch_outbox` instead of each web worker's outbox sweeper thread
+TELEGRAM_OUTBOX_ASYNC = config("TELEGRAM_OUTBOX_ASYNC", default=False, cast=bool)
+
+# Answer ignored webhook events (presence, receipts, ...) from their raw bytes without JSON decoding
+WEBHOOK_FAST_PATH = config("WEBHOOK_FAST_PATH", default=True, cast=bool)
+
+# Bodies larger than this (bytes) are parsed incrementally from the request stream
+WEBHOOK_STREAMING_THRESHOLD = config("WEBHOOK_STREAMING_THRESHOLD", default=1024 * 1024, cast=int)
+
+# Deadline for each Gemini call made by the async webhook (the request is cancelled when it expires)
+WEBHOOK_GEMINI_TIMEOUT = config("WEBHOOK_GEMINI_TIMEOUT", default=10.0, cast=float)
+
+# Hand upserts to a bounded queue of ingest worker threads and answer 202 at once;
+# when the queue is full, messages are stored unclassified for `process_pending_messages`
+WEBHOOK_INGEST_QUEUE = config("WEBHOOK_INGEST_QUEUE", default=False, cast=bool)
+
+# /metrics/ answers 404 unless enabled, and only then do web workers write metrics snapshots;
+# with a token set, scrapes must send it as a Bearer token
+METRICS_ENABLED = config("METRICS_ENABLED", default=False, cast=bool)
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+# Sampled, truncated webhook body dumps: share of requests logged and characters kept
+LOG_PAYLOAD_SAMPLE_RATE = config("LOG_PAYLOAD_SAMPLE_RATE", default=0.01, cast=float)
+LOG_PAYLOAD_MAX_CHARS = config("LOG_PAYLOAD_MAX_CHARS", default=2048, cast=int)
+
+# Records go through a bounded in-memory queue to one listener thread that writes a
+# size-rotated JSON log file and the console; request threads never wait on log I/O
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'messages.log.JsonFormatter',
+        },
+        'console': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+    },
+    'filters': {
+        # Per log call site: at most LOG_RATE_LIMIT records a second (warnings and errors are never dropped)
+        'rate_limit': {
+            '()': 'messages.log.RateLimitFilter',
+            'rate': config("LOG_RATE_LIMIT", default=20, cast=int),
+            'per': 1.0,
+        },
+    },
     'handlers': {
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': 'webhook_debug.log',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': config("LOG_FILE", default='webhook_debug.log'),
+            'maxBytes': config("LOG_MAX_BYTES", default=10 * 1024 * 1024, cast=int),
+            'backupCount': config("LOG_BACKUP_COUNT", default=5, cast=int),
+            'encoding': 'utf-8',
+            'formatter': 'json',
         },
         'console': {
             'level': 'DEBUG',
             'class': 'logging.StreamHandler',
+            'formatter': 'console',
+        },
+        'queue': {
+            'class': 'messages.log.QueueListenerHandler',
+            'handlers': ['cfg://handlers.file', 'cfg://handlers.console'],
+            'maxsize': config("LOG_QUEUE_SIZE", default=10000, cast=int),
+            'filters': ['rate_limit'],
         },
     },
     'loggers': {
-        'messages.views': {
-            'handlers': ['file', 'console'],
-            'level': 'DEBUG',
-            'propagate': True,
-        },
-        'messages.filter': {
-            'handlers': ['file', 'console'],
-            'level': 'DEBUG',
-            'propagate': True,
+        'messages': {
+            'handlers': ['queue'],
+            'level': config("LOG_LEVEL", default='INFO'),
+            'propagate': False,
         },
         'django.request': {
-            'handlers': ['file', 'console'],
-            'level': 'DEBUG',
-            'propagate': True,
-        },
-        'root': {
-            'handlers': ['console'],
-            'level': 'INFO',
+            'handlers': ['queue'],
+            'level': 'WARNING',
+            'propagate': False,
         },
     },
+    'root': {
+        'handlers': ['queue'],
+        'level': 'INFO',
+    },
 }
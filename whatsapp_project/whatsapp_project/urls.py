@@ -16,9 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from messages.views import whatsapp_webhook
+from messages.views import prometheus_metrics, whatsapp_webhook, whatsapp_webhook_async
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/whatsapp/webhook/', whatsapp_webhook),
+    path('api/whatsapp/webhook/async/', whatsapp_webhook_async),
+    path('metrics/', prometheus_metrics),
 ]